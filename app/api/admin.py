@@ -1,18 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime, timedelta
-
-from app.db.session import get_db
-from app.db.models import User, UserRole, UsageLog, SubscriptionPlan
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field, conint
+from typing import Dict, List, Optional
+from datetime import datetime, timezone
+
+from app.db.session import get_db, async_engine
+from app.db.pool import pool_stats
+from app.db.instrumentation import sql_profiler
+from app.core.config import settings
+from app.db.models import User, UserRole, SubscriptionPlan
 from app.api.auth import get_current_active_user
+from app.core.principals import Principal, principal_cache
+from app.core.plans import plan_catalogue
+from app.services.usage import UsageService, UsageSort, usage_buffer
+from app.services.rollups import rebuild_rollups
+from app.services.retention import usage_retention
+from app.services.outbox import billing_worker
+from app.services.billing import BillingService
+from app.services.metering import metered_usage_reporter
+from app.services.subscriptions import subscription_sweeper
+from app.services.tokens import RefreshTokenService
+from app.services.stats import system_stats
+from app.services.export import ExportFormat, MEDIA_TYPES, export_usage
+from app.services.ingest import ingest_usage, parse_events
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, page_size, paginate
 
 router = APIRouter()
 
 
-def get_admin_user(current_user: User = Depends(get_current_active_user)):
+async def get_admin_user(current_user: Principal = Depends(get_current_active_user)):
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -44,6 +62,13 @@ class UserUsageStats(BaseModel):
     last_request: Optional[datetime]
 
 
+class PlanUpdate(BaseModel):
+    requests_per_minute: int = Field(gt=0)
+    monthly_quota: int = Field(gt=0)
+    # Route template -> units charged per request; omit to keep the current costs
+    endpoint_costs: Optional[Dict[str, conint(gt=0)]] = None
+
+
 class SystemStats(BaseModel):
     total_users: int
     active_users: int
@@ -53,24 +78,39 @@ class SystemStats(BaseModel):
     pro_plan_users: int
 
 
+def user_page(cursor: Optional[str], skip: int):
+    """Users ordered by id, starting after the cursor (or at the legacy offset)"""
+    query = select(User.id).order_by(User.id)
+    if cursor:
+        (after_id,) = decode_cursor(cursor, (int,))
+        return query.where(User.id > after_id)
+    if skip:
+        return query.offset(skip)
+    return query
+
+
 @router.get("/users", response_model=List[AdminUserResponse])
 async def get_all_users(
-    skip: int = 0,
+    response: Response,
+    cursor: Optional[str] = None,
     limit: int = 100,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    skip: int = Query(0, deprecated=True, description="Use cursor instead"),
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    users = db.query(User).offset(skip).limit(limit).all()
+    page = user_page(cursor, skip).limit(page_size(limit) + 1).subquery()
+    users = await db.scalars(select(User).join(page, page.c.id == User.id).order_by(User.id))
+    users, _ = paginate(users.all(), limit, lambda user: (user.id,), response)
     return users
 
 
 @router.get("/users/{user_id}", response_model=AdminUserResponse)
 async def get_user(
     user_id: int,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -82,10 +122,10 @@ async def get_user(
 @router.put("/users/{user_id}/suspend")
 async def suspend_user(
     user_id: int,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -93,20 +133,50 @@ async def suspend_user(
         )
     
     user.is_active = not user.is_active
-    db.commit()
+    await db.commit()
+    await principal_cache.invalidate(user.username)
+    if not user.is_active:
+        # A suspended user's sessions stay dead if they are reactivated later
+        await RefreshTokenService(db).revoke_user(user.id)
     
     status_msg = "activated" if user.is_active else "suspended"
     return {"message": f"User {user.username} {status_msg} successfully"}
 
 
+@router.post("/users/{user_id}/subscription")
+async def grant_subscription(
+    user_id: int,
+    current_period_end: Optional[datetime] = None,
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Grant PRO without a Stripe checkout (invoiced or comped accounts)
+
+    An invoiced grant ends at current_period_end (plus grace); without one it lasts until canceled.
+    """
+    if current_period_end is not None:
+        if current_period_end.tzinfo is not None:
+            current_period_end = current_period_end.astimezone(timezone.utc).replace(tzinfo=None)
+        if current_period_end <= datetime.utcnow():
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="current_period_end must be in the future"
+            )
+    service = BillingService(db)
+    if await service.get_user_subscription(user_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Already subscribed")
+    if not await service.create_subscription(user_id, SubscriptionPlan.PRO, current_period_end):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return {"message": "Subscription granted"}
+
+
 @router.put("/users/{user_id}/role")
 async def update_user_role(
     user_id: int,
     new_role: UserRole,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -114,97 +184,186 @@ async def update_user_role(
         )
     
     user.role = new_role
-    db.commit()
+    await db.commit()
+    await principal_cache.invalidate(user.username)
     
     return {"message": f"User {user.username} role updated to {new_role.value}"}
 
 
 @router.get("/usage", response_model=List[UserUsageStats])
 async def get_usage_stats(
-    skip: int = 0,
+    response: Response,
+    cursor: Optional[str] = None,
     limit: int = 100,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    plan: Optional[SubscriptionPlan] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    sort: UsageSort = UsageSort.USER_ID,
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    # Get current month start
-    now = datetime.utcnow()
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # Query usage stats
-    usage_stats = db.query(
-        User.id,
-        User.username,
-        User.email,
-        User.subscription_plan,
-        func.count(UsageLog.id).label('total_requests'),
-        func.sum(
-            func.case(
-                (UsageLog.timestamp >= month_start, 1),
-                else_=0
-            )
-        ).label('requests_this_month'),
-        func.max(UsageLog.timestamp).label('last_request')
-    ).join(
-        UsageLog, User.id == UsageLog.user_id, isouter=True
-    ).group_by(
-        User.id, User.username, User.email, User.subscription_plan
-    ).offset(skip).limit(limit).all()
-    
-    result = []
-    for stat in usage_stats:
-        result.append(UserUsageStats(
-            user_id=stat.id,
-            username=stat.username,
-            email=stat.email,
-            total_requests=stat.total_requests or 0,
-            requests_this_month=stat.requests_this_month or 0,
-            subscription_plan=stat.subscription_plan,
-            last_request=stat.last_request
-        ))
+    """Per-user usage totals from the rollups, one page of users at a time"""
+    rows, next_cursor = await UsageService(db).list_user_usage(
+        page_size(limit), cursor, plan=plan, start=start, end=end, sort=sort
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [UserUsageStats(**row) for row in rows]
+
+
+@router.post("/usage/events")
+async def ingest_usage_events(
+    request: Request,
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Bulk usage reporting for gateways: a JSON array or NDJSON body of events
     
-    return result
+    Each event has user_id, endpoint, method, status_code and optionally timestamp
+    (ISO 8601, defaults to now) and response_time_ms. The batch is stored only if
+    every event is valid.
+    """
+    events = parse_events(await request.body(), request.headers.get("content-type", ""))
+    accepted = await ingest_usage(db, events)
+    return {"accepted": accepted}
+
+
+@router.get("/usage/export")
+async def export_usage_logs(
+    format: ExportFormat = ExportFormat.NDJSON,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    endpoint: Optional[str] = None,
+    current_user: Principal = Depends(get_admin_user)
+):
+    """Stream raw usage logs for billing reconciliation (start inclusive, end exclusive)"""
+    filename = f"usage_{start:%Y%m%d}" if start else "usage"
+    if end:
+        filename += f"_{end:%Y%m%d}"
+    extension = "csv" if format == ExportFormat.CSV else "jsonl"
+    return StreamingResponse(
+        export_usage(format, start=start, end=end, user_id=user_id, endpoint=endpoint),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    )
+
+
+@router.get("/usage/pipeline")
+async def get_usage_pipeline_stats(current_user: Principal = Depends(get_admin_user)):
+    """Counters for the batched usage-log writer"""
+    return usage_buffer.stats()
+
+
+@router.post("/usage/rollups/rebuild")
+async def rebuild_usage_rollups(
+    user_id: Optional[int] = None,
+    current_user: Principal = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Recompute usage rollups from the raw logs (backfill or repair)"""
+    processed = await rebuild_rollups(db, user_id=user_id)
+    return {"message": "Usage rollups rebuilt", "logs_processed": processed}
+
+
+@router.get("/usage/retention")
+async def get_usage_retention(current_user: Principal = Depends(get_admin_user)):
+    """Retention settings and the outcome of the last maintenance run"""
+    return usage_retention.stats()
+
+
+@router.post("/usage/retention/run")
+async def run_usage_retention(current_user: Principal = Depends(get_admin_user)):
+    """Create upcoming partitions and expire old usage logs now"""
+    return await usage_retention.run_once()
+
+
+@router.get("/billing/worker")
+async def get_billing_worker_stats(current_user: Principal = Depends(get_admin_user)):
+    """Outbox/webhook backlog by status and this worker's delivery counters"""
+    return await billing_worker.stats()
+
+
+@router.get("/billing/usage-reports")
+async def get_usage_reports(current_user: Principal = Depends(get_admin_user)):
+    return metered_usage_reporter.stats()
+
+
+@router.post("/billing/usage-reports/run")
+async def run_usage_reports(
+    dry_run: Optional[bool] = None,
+    current_user: Principal = Depends(get_admin_user)
+):
+    """Capture closed billing windows and report pending usage now (dry_run defaults to the setting)"""
+    return await metered_usage_reporter.run_once(dry_run=dry_run)
+
+
+@router.get("/billing/subscriptions/sweep")
+async def get_subscription_sweep(current_user: Principal = Depends(get_admin_user)):
+    return subscription_sweeper.stats()
+
+
+@router.post("/billing/subscriptions/sweep")
+async def run_subscription_sweep(current_user: Principal = Depends(get_admin_user)):
+    """Expire lapsed subscriptions now instead of waiting for the next sweep"""
+    return await subscription_sweeper.run_once()
+
+
+@router.get("/db/pool")
+async def get_pool_stats(current_user: Principal = Depends(get_admin_user)):
+    """Connection pool usage for this worker, for sizing pools against worker count"""
+    return {
+        "config": {
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_timeout": settings.db_pool_timeout,
+            "pool_recycle": settings.db_pool_recycle,
+        },
+        "stats": pool_stats.snapshot(async_engine.sync_engine.pool),
+    }
+
+
+@router.get("/debug/sql")
+async def get_sql_profile(
+    limit: int = Query(20, ge=1),
+    reset: bool = False,
+    current_user: Principal = Depends(get_admin_user)
+):
+    """Slowest profiled requests with their query counts and repeated (N+1) statements"""
+    report = sql_profiler.report(limit)
+    if reset:
+        sql_profiler.reset()
+    return report
+
+
+@router.get("/plans")
+async def get_plans(current_user: Principal = Depends(get_admin_user)):
+    """Plan limits and endpoint costs as currently enforced by this worker"""
+    return {
+        "plans": [limits.to_dict() for limits in plan_catalogue.all()],
+        "loaded_at": plan_catalogue.loaded_at,
+    }
+
+
+@router.put("/plans/{plan}")
+async def update_plan(
+    plan: SubscriptionPlan,
+    update: PlanUpdate,
+    current_user: Principal = Depends(get_admin_user)
+):
+    """Change a plan's limits; other workers pick it up within PLAN_CATALOGUE_REFRESH_SECONDS"""
+    limits = await plan_catalogue.update_plan(
+        plan, update.requests_per_minute, update.monthly_quota, update.endpoint_costs
+    )
+    return limits.to_dict()
 
 
 @router.get("/stats", response_model=SystemStats)
 async def get_system_stats(
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    current_user: Principal = Depends(get_admin_user)
 ):
-    # Get date ranges
-    now = datetime.utcnow()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    # Total users
-    total_users = db.query(User).count()
-    
-    # Active users
-    active_users = db.query(User).filter(User.is_active == True).count()
-    
-    # Requests today
-    requests_today = db.query(UsageLog).filter(
-        UsageLog.timestamp >= today_start
-    ).count()
-    
-    # Requests this month
-    requests_this_month = db.query(UsageLog).filter(
-        UsageLog.timestamp >= month_start
-    ).count()
-    
-    # Plan distribution
-    free_plan_users = db.query(User).filter(
-        User.subscription_plan == SubscriptionPlan.FREE
-    ).count()
-    
-    pro_plan_users = db.query(User).filter(
-        User.subscription_plan == SubscriptionPlan.PRO
-    ).count()
-    
-    return SystemStats(
-        total_users=total_users,
-        active_users=active_users,
-        total_requests_today=requests_today,
-        total_requests_this_month=requests_this_month,
-        free_plan_users=free_plan_users,
-        pro_plan_users=pro_plan_users
-    )
+    # Cached for a few seconds so polling dashboards do not each hit the database
+    stats = await system_stats.get()
+    response.headers["Age"] = str(int(system_stats.age() or 0))
+    return SystemStats(**stats)
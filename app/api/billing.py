@@ -0,0 +1,53 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from typing import Optional
+
+from app.db.session import get_db
+from app.db.models import SubscriptionPlan
+from app.api.auth import get_current_active_user
+from app.core.principals import Principal
+from app.services.billing import BillingService, construct_event
+
+router = APIRouter()
+
+
+class SubscriptionResponse(BaseModel):
+    plan: SubscriptionPlan
+    status: str
+    current_period_start: Optional[datetime]
+    current_period_end: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+
+@router.get("/subscription", response_model=Optional[SubscriptionResponse])
+async def get_subscription(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await BillingService(db).get_user_subscription(current_user.id)
+
+
+@router.delete("/subscription")
+async def cancel_subscription(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not await BillingService(db).cancel_subscription(current_user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active subscription")
+    return {"message": "Subscription canceled"}
+
+
+@router.post("/webhook")
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    """Acknowledge a signed Stripe event once it is stored; it is applied by the billing worker
+
+    This is the only way a user becomes PRO on their own: customer.subscription.created
+    is sent by Stripe once a checkout has been paid.
+    """
+    event = construct_event(await request.body(), request.headers.get("stripe-signature"))
+    created = await BillingService(db).handle_stripe_webhook(event)
+    return {"received": True, "duplicate": not created}
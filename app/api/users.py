@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 from app.db.session import get_db
-from app.db.models import User, UserRole, UsageLog
+from app.db.models import UserRole
 from app.api.auth import get_current_active_user
+from app.core.principals import Principal
+from app.services.usage import UsageService
+from app.core.pagination import NEXT_CURSOR_HEADER, page_size
 
 router = APIRouter()
 
@@ -29,42 +33,38 @@ class UsageStats(BaseModel):
     average_response_time: float
 
 
+class UsageLogResponse(BaseModel):
+    id: int
+    endpoint: str
+    method: str
+    status_code: int
+    timestamp: datetime
+    response_time_ms: Optional[float]
+    
+    class Config:
+        from_attributes = True
+
+
 @router.get("/profile", response_model=UserProfile)
-async def get_profile(current_user: User = Depends(get_current_active_user)):
+async def get_profile(current_user: Principal = Depends(get_current_active_user)):
     return current_user
 
 
 @router.get("/usage", response_model=UsageStats)
-async def get_usage_stats(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    # Get total usage
-    total_requests = db.query(UsageLog).filter(UsageLog.user_id == current_user.id).count()
-    
-    # Get current month usage
-    from datetime import datetime, timedelta
-    now = datetime.utcnow()
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    monthly_requests = db.query(UsageLog).filter(
-        UsageLog.user_id == current_user.id,
-        UsageLog.timestamp >= month_start
-    ).count()
-    
-    # Get most used endpoint
-    most_used_result = db.query(UsageLog.endpoint).filter(
-        UsageLog.user_id == current_user.id
-    ).group_by(UsageLog.endpoint).order_by(db.func.count().desc()).first()
-    
-    most_used_endpoint = most_used_result[0] if most_used_result else "N/A"
-    
-    # Get average response time
-    avg_response_time = db.query(db.func.avg(UsageLog.response_time_ms)).filter(
-        UsageLog.user_id == current_user.id,
-        UsageLog.response_time_ms.isnot(None)
-    ).scalar() or 0.0
-    
-    return UsageStats(
-        total_requests=total_requests,
-        requests_this_month=monthly_requests,
-        most_used_endpoint=most_used_endpoint,
-        average_response_time=float(avg_response_time)
-    )
+async def get_usage_stats(current_user: Principal = Depends(get_current_active_user), db: AsyncSession = Depends(get_db)):
+    return UsageStats(**await UsageService(db).get_usage_summary(current_user.id))
+
+
+@router.get("/usage/logs", response_model=List[UsageLogResponse])
+async def get_usage_logs(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Recent requests, newest first; pass X-Next-Cursor back as cursor for the next page"""
+    logs, next_cursor = await UsageService(db).get_user_usage(current_user.id, page_size(limit), cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return logs
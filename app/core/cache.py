@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL"""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+    
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class StaleWhileRevalidate:
+    """Single async value that is served stale while one background task refreshes it
+    
+    Fresh for `ttl` seconds; up to `max_stale` seconds after that the old value is
+    returned immediately and a refresh starts in the background. Older (or missing)
+    values make callers wait, but concurrent callers share one load.
+    """
+    
+    def __init__(self, loader: Callable[[], Awaitable[Any]], ttl: float, max_stale: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._value: Any = None
+        self._loaded_at: Optional[float] = None
+        self._refresh: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.loads = 0
+    
+    async def _load(self) -> Any:
+        try:
+            value = await self.loader()
+            self._value, self._loaded_at = value, time.monotonic()
+            self.loads += 1
+            return value
+        finally:
+            self._refresh = None
+    
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None:
+            self._refresh = asyncio.create_task(self._load())
+        return self._refresh
+    
+    def _report_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error refreshing cached value", exc_info=task.exception())
+    
+    def age(self) -> Optional[float]:
+        """Seconds since the cached value was loaded"""
+        return None if self._loaded_at is None else time.monotonic() - self._loaded_at
+    
+    async def get(self) -> Any:
+        age = self.age()
+        if age is not None and age < self.ttl:
+            self.hits += 1
+            return self._value
+        if age is not None and age < self.ttl + self.max_stale:
+            self.stale_hits += 1
+            self._start_refresh().add_done_callback(self._report_failure)
+            return self._value
+        # shield: a caller that disconnects must not cancel the load others are awaiting
+        return await asyncio.shield(self._start_refresh())
+    
+    def invalidate(self):
+        self._loaded_at = None
+    
+    def stats(self) -> dict:
+        return {"age_seconds": self.age(), "hits": self.hits, "stale_hits": self.stale_hits, "loads": self.loads}
@@ -4,13 +4,118 @@ from typing import Optional
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./saas_auth.db"
+    # Defaults to database_url with the asyncpg (Postgres) or aiosqlite (SQLite) driver
+    async_database_url: Optional[str] = None
+    
+    # Connection pool (per worker process)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    
+    # Applied to every new connection when the database is SQLite
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    
+    # Startup work; turn both off where `alembic upgrade head` runs before the app starts
+    create_tables_on_startup: bool = True
+    seed_admin_on_startup: bool = True  # migration 0011 seeds the same account
     secret_key: str = "your-super-secret-key-here"
     algorithm: str = "HS256"
+    # "jose" (python-jose) or "pyjwt"
+    jwt_backend: str = "jose"
+    # PEM keys, used instead of secret_key when algorithm is RS*/PS*/ES*/EdDSA
+    jwt_private_key: Optional[str] = None
+    jwt_public_key: Optional[str] = None
+    token_cache_size: int = 10000
+    
+    # bcrypt worker pool; calls beyond workers + queue limit get a 503
+    password_hash_workers: int = 4
+    password_hash_queue_limit: int = 64
+    # First scheme hashes new passwords; e.g. "argon2,bcrypt" (needs argon2-cffi) migrates on login
+    password_schemes: str = "bcrypt"
+    bcrypt_rounds: Optional[int] = None
+    # When set, bcrypt_rounds is calibrated at startup to stay within this hash time
+    # (a few bcrypt runs per boot; set bcrypt_rounds instead for fast starts)
+    password_hash_target_ms: Optional[float] = None
     access_token_expire_minutes: int = 30
     refresh_token_expire_days: int = 7
     stripe_api_key: Optional[str] = None
     stripe_webhook_secret: Optional[str] = None
+    stripe_api_base: Optional[str] = None  # e.g. http://localhost:12111 for stripe-mock
+    
+    # Billing worker: outbound Stripe calls (outbox) and inbound webhooks (inbox)
+    billing_worker_concurrency: int = 4
+    billing_worker_poll_seconds: float = 1.0
+    billing_worker_batch_size: int = 100
+    billing_worker_lease_seconds: float = 60.0  # a claimed message is retried after this if never finished
+    billing_worker_max_attempts: int = 8
+    billing_retry_base_seconds: float = 2.0
+    billing_retry_max_seconds: float = 600.0
+    
+    # Subscription lifecycle sweeper (expires subscriptions past their period end plus grace)
+    subscription_sweep_interval_seconds: float = 300.0
+    subscription_sweep_batch_size: int = 1000
+    subscription_grace_seconds: float = 86400.0  # after current_period_end, waiting for a renewal webhook
+    
+    # Metered billing: per-customer usage per closed window, reported to Stripe usage records
+    metered_billing_enabled: bool = False
+    metered_billing_dry_run: bool = False  # capture and count, but roll back and send nothing
+    metered_billing_window: str = "day"  # or "hour"
+    metered_billing_lookback_windows: int = 2  # closed windows re-captured each run, for late usage
+    metered_billing_interval_seconds: float = 3600.0
+    metered_billing_batch_size: int = 1000
+    metered_billing_concurrency: int = 16
+    metered_billing_max_attempts: int = 5
     redis_url: str = "redis://localhost:6379"
+    redis_socket_timeout_seconds: float = 0.1  # every Redis call is on the request path or a tight loop
+    redis_connect_timeout_seconds: float = 0.25
+    
+    # Per-request rate limiting and usage metering
+    metering_enabled: bool = True
+    rate_limit_algorithm: str = "sliding_window"  # or "token_bucket"
+    rate_limit_backend: str = "redis"  # or "memory" for single-worker/test setups
+    quota_reconcile_interval_seconds: float = 30.0
+    plan_catalogue_refresh_seconds: float = 30.0  # how soon other workers see plan changes
+    
+    # Authenticated-user cache
+    principal_cache_size: int = 10000
+    principal_cache_ttl_seconds: float = 60.0
+    principal_cache_redis: bool = False  # share across workers via redis_url
+    principal_cache_local_ttl_seconds: float = 5.0
+    
+    # Refresh token families revoked on logout or reuse; access tokens are checked in memory
+    token_revocation_redis: bool = False  # share revocations across workers via redis_url (enable with more than one worker)
+    token_revocation_sync_seconds: float = 1.0  # how soon other workers see a revocation
+    
+    # Prometheus text metrics at /metrics
+    metrics_enabled: bool = True
+    
+    # Debug: per-request query count/DB time headers and GET /admin/debug/sql (not for production)
+    sql_profiling_enabled: bool = False
+    sql_profile_report_size: int = 50  # slowest requests kept
+    sql_profile_repeat_threshold: int = 5  # same statement this often in one request is flagged as N+1
+    
+    # Usage ingestion pipeline
+    usage_queue_max_size: int = 10000
+    usage_flush_batch_size: int = 500
+    usage_flush_interval_seconds: float = 1.0
+    usage_ingest_max_events: int = 10000  # per POST /admin/usage/events
+    
+    # Usage log retention and monthly partitions (partitions are Postgres only)
+    usage_retention_days: Optional[int] = None  # keep forever when unset
+    usage_retention_action: str = "drop"  # or "detach" to keep old partitions as standalone tables
+    usage_retention_batch_size: int = 5000  # rows per DELETE where partitions are unavailable
+    refresh_token_retention_hours: float = 24.0  # expired refresh tokens are deleted this long after expiry
+    usage_partition_premake_months: int = 3
+    usage_maintenance_interval_seconds: float = 3600.0
+    usage_export_chunk_size: int = 5000  # rows fetched and encoded per chunk when exporting
+    
+    # Admin dashboard stats cache (served stale while refreshing in the background)
+    admin_stats_ttl_seconds: float = 5.0
+    admin_stats_max_stale_seconds: float = 60.0
     
     class Config:
         env_file = ".env"
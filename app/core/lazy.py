@@ -0,0 +1,21 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """Module whose import runs on first attribute access (importlib's LazyLoader recipe)
+
+    For optional clients that are expensive to import and unused by many processes;
+    `except module.SomeError` clauses only touch the module once something raised.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,169 @@
+import logging
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Millisecond buckets suited to request, query and pool-wait latencies
+DEFAULT_BUCKETS_MS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and three increments"""
+    
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def snapshot(self) -> Dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Counter:
+    """Monotonic counter; inc() is a single unlocked add"""
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+# Metrics are updated without locks: every instrumented call site runs on the event
+# loop thread (work done in executors is timed there and observed back on the loop).
+
+
+class Family:
+    """A metric with labels; labels() returns the child for one label combination"""
+    
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str], factory: Callable):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            # Only creating a child takes the lock; lookups and updates never do
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+    
+    def samples(self):
+        return list(self._children.items())
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format"""
+    
+    def __init__(self):
+        self._families: Dict[str, Family] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+    
+    def _family(self, name: str, help: str, kind: str, labelnames: Sequence[str], factory: Callable) -> Family:
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(name, help, kind, labelnames, factory)
+            return family
+    
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Family:
+        return self._family(name, help, "counter", labelnames, Counter)
+    
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS_MS) -> Family:
+        return self._family(name, help, "histogram", labelnames, lambda: Histogram(buckets))
+    
+    def register_histogram(self, name: str, help: str, histogram: Histogram):
+        """Expose a histogram that is owned and updated elsewhere"""
+        self._family(name, help, "histogram", (), lambda: histogram).labels()
+    
+    def gauge(self, name: str, help: str, read: Callable[[], float]):
+        """A value read at scrape time"""
+        with self._lock:
+            self._gauges[name] = (help, read)
+    
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in list(self._families.values()):
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, metric in family.samples():
+                if family.kind == "counter":
+                    lines.append(f"{family.name}_total{_labels(family.labelnames, values)} {_number(metric.value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), metric.counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{family.name}_bucket{_labels(family.labelnames, values, le)} {cumulative}")
+                lines.append(f"{family.name}_sum{_labels(family.labelnames, values)} {_number(metric.sum)}")
+                lines.append(f"{family.name}_count{_labels(family.labelnames, values)} {metric.count}")
+        for name, (help, read) in list(self._gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                logger.exception("Error reading gauge %s", name)
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Hot-path metrics, created once so call sites only do a labels() lookup
+http_request_duration = registry.histogram(
+    "http_request_duration_milliseconds", "Request latency by route template", ("route", "method")
+)
+http_requests = registry.counter(
+    "http_requests", "Requests by route template and status code", ("route", "method", "status")
+)
+db_query_duration = registry.histogram(
+    "db_query_duration_milliseconds", "SQL statement latency by statement kind and table", ("operation", "table")
+)
+password_hash_duration = registry.histogram(
+    "password_hash_duration_milliseconds", "bcrypt time per call, excluding queueing", ("operation",),
+    buckets=(10, 25, 50, 100, 150, 250, 400, 600, 1000, 2500)
+)
+jwt_decode_duration = registry.histogram(
+    "jwt_decode_duration_milliseconds", "Token signature and claims verification time (cache misses)"
+)
+jwt_cache_hits = registry.counter("jwt_cache_hits", "Tokens served from the verified-token cache")
+limiter_duration = registry.histogram(
+    "rate_limiter_duration_milliseconds", "Rate limit and quota check round trips", ("check", "backend")
+)
@@ -0,0 +1,61 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+from fastapi import HTTPException, Response, status
+
+# List endpoints keep returning plain arrays; the cursor for the next page rides in a header
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(*values: Any) -> str:
+    """Opaque cursor for the sort key of the last row on a page"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> Tuple:
+    """Decode a cursor produced by encode_cursor, checking it holds the expected key types"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError("wrong cursor shape")
+        values = []
+        for value, kind in zip(payload, types):
+            if kind is datetime:
+                value = datetime.fromisoformat(value)
+            elif not isinstance(value, kind) or isinstance(value, bool):
+                raise ValueError("wrong cursor value type")
+            values.append(value)
+        return tuple(values)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+
+def page_size(limit: int) -> int:
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"limit must be between 1 and {MAX_PAGE_SIZE}"
+        )
+    return limit
+
+
+def paginate(rows: List, limit: int, key, response: Optional[Response] = None) -> Tuple[List, Optional[str]]:
+    """Trim a limit+1 fetch to one page and work out the cursor for the next one
+
+    key(row) returns the sort-key values of a row. When a response is given the
+    cursor is also set as the X-Next-Cursor header.
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*key(rows[-1]))
+        if response is not None:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return rows, next_cursor
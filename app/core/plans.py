@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Mapping, Optional
+from sqlalchemy import delete, insert, select
+from app.db.models import Plan, PlanEndpointCost, SubscriptionPlan
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Seeded into an empty plans table, and used until the catalogue is first loaded
+DEFAULT_PLANS = {
+    SubscriptionPlan.FREE: {"requests_per_minute": 60, "monthly_quota": 1000},
+    SubscriptionPlan.PRO: {"requests_per_minute": 300, "monthly_quota": 10000},
+}
+
+
+@dataclass(frozen=True)
+class PlanLimits:
+    """Immutable limits for one plan; endpoint costs are keyed by route template"""
+    plan: SubscriptionPlan
+    requests_per_minute: int
+    monthly_quota: int
+    endpoint_costs: Mapping[str, int] = field(default_factory=dict)
+
+    def cost(self, endpoint: Optional[str]) -> int:
+        return self.endpoint_costs.get(endpoint, 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "plan": self.plan.value,
+            "requests_per_minute": self.requests_per_minute,
+            "monthly_quota": self.monthly_quota,
+            "endpoint_costs": dict(self.endpoint_costs),
+        }
+
+
+def default_snapshot() -> Dict[SubscriptionPlan, PlanLimits]:
+    return {plan: PlanLimits(plan, **limits) for plan, limits in DEFAULT_PLANS.items()}
+
+
+class PlanCatalogue:
+    """Plan limits from the plans tables, resolved per request from an in-memory snapshot
+
+    The snapshot is a plain dict swapped atomically on reload, so lookups take no
+    lock and run no query. Every worker reloads it every refresh_interval seconds;
+    the worker that applies an admin change reloads immediately.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._snapshot = default_snapshot()
+        self._task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[datetime] = None
+
+    def get(self, plan: SubscriptionPlan) -> PlanLimits:
+        limits = self._snapshot.get(plan)
+        # A plan missing from the table falls back to FREE limits rather than failing requests
+        return limits if limits is not None else self._snapshot[SubscriptionPlan.FREE]
+
+    def all(self):
+        return list(self._snapshot.values())
+
+    async def load(self):
+        async with AsyncSessionLocal() as db:
+            plans = (await db.execute(select(Plan.code, Plan.requests_per_minute, Plan.monthly_quota))).all()
+            costs = (await db.execute(select(PlanEndpointCost.plan, PlanEndpointCost.endpoint, PlanEndpointCost.cost))).all()
+
+        endpoint_costs: Dict[SubscriptionPlan, Dict[str, int]] = {}
+        for row in costs:
+            endpoint_costs.setdefault(SubscriptionPlan(row.plan), {})[row.endpoint] = row.cost
+
+        snapshot = default_snapshot()
+        for row in plans:
+            plan = SubscriptionPlan(row.code)
+            snapshot[plan] = PlanLimits(
+                plan, row.requests_per_minute, row.monthly_quota, endpoint_costs.get(plan, {})
+            )
+        self._snapshot = snapshot
+        self.loaded_at = datetime.utcnow()
+
+    async def seed_defaults(self):
+        """Insert the default plans when the table is empty (fresh installs without migrations)"""
+        async with AsyncSessionLocal() as db:
+            if (await db.execute(select(Plan.code).limit(1))).first() is not None:
+                return
+            await db.execute(insert(Plan), [
+                {"code": plan, **limits} for plan, limits in DEFAULT_PLANS.items()
+            ])
+            await db.commit()
+
+    async def update_plan(self, plan: SubscriptionPlan, requests_per_minute: int, monthly_quota: int,
+                          endpoint_costs: Optional[Mapping[str, int]] = None) -> PlanLimits:
+        """Upsert a plan (replacing its endpoint costs when given) and reload the snapshot"""
+        async with AsyncSessionLocal() as db:
+            row = await db.get(Plan, plan)
+            if row is None:
+                row = Plan(code=plan)
+                db.add(row)
+            row.requests_per_minute = requests_per_minute
+            row.monthly_quota = monthly_quota
+            await db.flush()
+
+            if endpoint_costs is not None:
+                await db.execute(delete(PlanEndpointCost).where(PlanEndpointCost.plan == plan))
+                if endpoint_costs:
+                    await db.execute(insert(PlanEndpointCost), [
+                        {"plan": plan, "endpoint": endpoint, "cost": cost}
+                        for endpoint, cost in endpoint_costs.items()
+                    ])
+            await db.commit()
+
+        await self.load()
+        return self.get(plan)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Error reloading plan catalogue")
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self.seed_defaults()
+        await self.load()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+plan_catalogue = PlanCatalogue(settings.plan_catalogue_refresh_seconds)
@@ -0,0 +1,136 @@
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+from sqlalchemy import select
+from app.db.models import User, UserRole, SubscriptionPlan
+from app.db.session import AsyncSessionLocal
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.rate_limit import REDIS_RETRY_SECONDS, get_redis_client, redis
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Compact snapshot of the authenticated user, safe to cache between requests"""
+    id: int
+    username: str
+    email: str
+    role: UserRole
+    is_active: bool
+    subscription_plan: SubscriptionPlan
+    
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=UserRole(user.role),
+            is_active=user.is_active,
+            subscription_plan=SubscriptionPlan(user.subscription_plan),
+        )
+    
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["role"] = self.role.value
+        data["subscription_plan"] = self.subscription_plan.value
+        return json.dumps(data)
+    
+    @classmethod
+    def from_json(cls, raw) -> "Principal":
+        data = json.loads(raw)
+        data["role"] = UserRole(data["role"])
+        data["subscription_plan"] = SubscriptionPlan(data["subscription_plan"])
+        return cls(**data)
+
+
+class PrincipalCache:
+    """Principals keyed by token subject: in-process LRU, optionally shared through Redis
+    
+    With Redis enabled the local tier uses a short TTL, so an invalidation made by
+    another worker is seen within principal_cache_local_ttl_seconds.
+    """
+    
+    def __init__(self, shared: bool = False):
+        self.shared = shared
+        local_ttl = settings.principal_cache_local_ttl_seconds if shared else settings.principal_cache_ttl_seconds
+        self.local = TTLCache(settings.principal_cache_size, local_ttl)
+        self._redis_retry_at = 0.0
+    
+    @property
+    def redis_client(self):
+        # After a failure, skip Redis for a while instead of paying the timeout on every miss
+        if not self.shared or time.monotonic() < self._redis_retry_at:
+            return None
+        return get_redis_client()
+    
+    def _redis_failed(self, e: Exception):
+        logger.warning("Redis unavailable for the principal cache, using the database: %s", e)
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+    
+    def _key(self, username: str) -> str:
+        return f"principal:{username}"
+    
+    async def _get_shared(self, username: str) -> Optional[Principal]:
+        if not self.redis_client:
+            return None
+        try:
+            raw = await self.redis_client.get(self._key(username))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return None
+        return Principal.from_json(raw) if raw else None
+    
+    async def _set_shared(self, principal: Principal):
+        if not self.redis_client:
+            return
+        try:
+            await self.redis_client.setex(
+                self._key(principal.username),
+                int(settings.principal_cache_ttl_seconds),
+                principal.to_json()
+            )
+        except redis.RedisError as e:
+            self._redis_failed(e)
+    
+    async def get(self, username: str) -> Optional[Principal]:
+        """Return the cached principal, loading it from the database on a miss"""
+        principal = self.local.get(username)
+        if principal is not None:
+            return principal
+        
+        principal = await self._get_shared(username)
+        if principal is None:
+            async with AsyncSessionLocal() as db:
+                user = (await db.execute(select(User).where(User.username == username))).scalars().first()
+            if user is None:
+                return None
+            principal = Principal.from_user(user)
+            await self._set_shared(principal)
+        
+        self.local.set(username, principal)
+        return principal
+    
+    async def invalidate(self, username: str):
+        """Drop a user's snapshot after it changes (suspension, role or plan change)"""
+        await self.invalidate_many([username])
+    
+    async def invalidate_many(self, usernames):
+        """Bulk invalidate (one Redis DELETE for all keys)"""
+        usernames = list(usernames)
+        for username in usernames:
+            self.local.pop(username)
+        # Deletes are attempted even while reads back off: a stale shared entry outlives the local TTL
+        client = get_redis_client() if self.shared else None
+        if client and usernames:
+            try:
+                await client.delete(*(self._key(username) for username in usernames))
+            except redis.RedisError as e:
+                logger.warning("Error invalidating cached principals: %s", e)
+
+
+principal_cache = PrincipalCache(shared=settings.principal_cache_redis)
@@ -0,0 +1,384 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam, case, select, update
+from app.db.models import User, RateLimit, SubscriptionPlan
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+from app.core.metrics import limiter_duration
+from app.core.plans import plan_catalogue
+from app.core.rate_limit import QUOTA_FUNCTION, REDIS_RETRY_SECONDS, get_redis_client, redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_QUOTA_DURATION = limiter_duration.labels("quota", "redis")
+MEMORY_QUOTA_DURATION = limiter_duration.labels("quota", "memory")
+
+# Counters outlive their month a little so the reconciler can still read them after rollover
+QUOTA_KEY_TTL_SECONDS = 40 * 24 * 3600
+
+CONSUME_SCRIPT = QUOTA_FUNCTION + """
+return consume_quota(KEYS[1], KEYS[2], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4])
+"""
+
+# refund(key, dirty_key, cost, member); a counter that has already expired is left alone
+REFUND_SCRIPT = """
+local used = redis.call('GET', KEYS[1])
+if not used then
+    return 0
+end
+used = math.max(0, tonumber(used) - tonumber(ARGV[1]))
+redis.call('SET', KEYS[1], used, 'KEEPTTL')
+redis.call('SADD', KEYS[2], ARGV[2])
+return used
+"""
+
+
+def quota_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Monthly quota exceeded. Please upgrade your plan."
+    )
+
+
+def month_key(now: Optional[datetime] = None) -> str:
+    """Calendar-month bucket used for quota counters, e.g. 202401"""
+    return (now or datetime.utcnow()).strftime("%Y%m")
+
+
+def month_start(key: str) -> datetime:
+    return datetime.strptime(key, "%Y%m")
+
+
+class RedisQuotaStore:
+    """Shared monthly counters in Redis; reports absolute values to the reconciler"""
+
+    absolute = True
+
+    def __init__(self, client):
+        self.client = client
+        self._consume = client.register_script(CONSUME_SCRIPT)
+        self._refund = client.register_script(REFUND_SCRIPT)
+
+    def _key(self, month: str, user_id: int) -> str:
+        return f"quota:{month}:{user_id}"
+
+    def _dirty_key(self, month: str) -> str:
+        return f"quota:dirty:{month}"
+
+    def consume_call(self, month: str, user_id: int, quota: int) -> Tuple[List[str], list]:
+        """Keys and arguments of consume_quota, for scripts that run it alongside other checks"""
+        return [self._key(month, user_id), self._dirty_key(month)], [quota, QUOTA_KEY_TTL_SECONDS, user_id]
+
+    async def consume(self, month: str, user_id: int, quota: int, cost: int = 1) -> Tuple[bool, int]:
+        allowed, used = await self._consume(
+            keys=[self._key(month, user_id), self._dirty_key(month)],
+            args=[quota, cost, QUOTA_KEY_TTL_SECONDS, user_id]
+        )
+        return bool(allowed), int(used)
+
+    async def refund(self, month: str, user_id: int, cost: int = 1):
+        await self._refund(keys=[self._key(month, user_id), self._dirty_key(month)], args=[cost, user_id])
+
+    async def seed(self, month: str, usage: Dict[int, int]):
+        pipe = self.client.pipeline(transaction=False)
+        for user_id, used in usage.items():
+            pipe.set(self._key(month, user_id), used, ex=QUOTA_KEY_TTL_SECONDS, nx=True)
+        await pipe.execute()
+
+    async def collect(self, month: str, batch_size: int = 1000) -> Dict[int, int]:
+        user_ids: List[int] = []
+        while True:
+            popped = await self.client.spop(self._dirty_key(month), batch_size)
+            if not popped:
+                break
+            user_ids.extend(int(user_id) for user_id in popped)
+        if not user_ids:
+            return {}
+        values = await self.client.mget([self._key(month, user_id) for user_id in user_ids])
+        return {
+            user_id: int(value)
+            for user_id, value in zip(user_ids, values)
+            if value is not None
+        }
+
+    async def restore(self, month: str, collected: Dict[int, int]):
+        if collected:
+            await self.client.sadd(self._dirty_key(month), *collected.keys())
+
+
+class ShardedQuotaStore:
+    """Per-process counters split across lock shards; reports deltas to the reconciler
+
+    Each worker only sees its own traffic, so use Redis when running more than one worker.
+    """
+
+    absolute = False
+
+    def __init__(self, shards: int = 16):
+        self._shards = [({}, {}, threading.Lock()) for _ in range(shards)]
+
+    def _shard(self, user_id: int):
+        return self._shards[user_id % len(self._shards)]
+
+    def consume(self, month: str, user_id: int, quota: int, cost: int = 1) -> Tuple[bool, int]:
+        totals, deltas, lock = self._shard(user_id)
+        key = (month, user_id)
+        with lock:
+            used = totals.get(key, 0)
+            if used + cost > quota:
+                return False, used
+            totals[key] = used + cost
+            deltas[key] = deltas.get(key, 0) + cost
+            return True, used + cost
+
+    def refund(self, month: str, user_id: int, cost: int = 1):
+        totals, deltas, lock = self._shard(user_id)
+        key = (month, user_id)
+        with lock:
+            if key in totals:
+                cost = min(cost, totals[key])
+                totals[key] -= cost
+                deltas[key] = deltas.get(key, 0) - cost
+
+    async def seed(self, month: str, usage: Dict[int, int]):
+        for user_id, used in usage.items():
+            totals, _, lock = self._shard(user_id)
+            key = (month, user_id)
+            with lock:
+                totals[key] = max(totals.get(key, 0), used)
+
+    async def collect(self, month: str) -> Dict[int, int]:
+        collected: Dict[int, int] = {}
+        for totals, deltas, lock in self._shards:
+            with lock:
+                for key in [key for key in deltas if key[0] == month]:
+                    collected[key[1]] = deltas.pop(key)
+                # Previous months' totals are no longer consulted
+                for key in [key for key in totals if key[0] < month]:
+                    del totals[key]
+        return collected
+
+    async def restore(self, month: str, collected: Dict[int, int]):
+        for user_id, delta in collected.items():
+            _, deltas, lock = self._shard(user_id)
+            key = (month, user_id)
+            with lock:
+                deltas[key] = deltas.get(key, 0) + delta
+
+
+class QuotaCounter:
+    """Monthly quota accounting with no SQL on the request path
+
+    The one exception is a failover from Redis: requests wait for a single query that
+    seeds the in-memory fallback with the last reconciled counts.
+    """
+
+    def __init__(self, store=None):
+        self.fallback = ShardedQuotaStore()
+        self._store = store
+        self._redis_retry_at = 0.0
+        self._fallback_seed: Optional[asyncio.Task] = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            client = get_redis_client() if settings.rate_limit_backend != "memory" else None
+            self._store = RedisQuotaStore(client) if client is not None else self.fallback
+        return self._store
+
+    def _redis_available(self) -> bool:
+        return self.store is not self.fallback and time.monotonic() >= self._redis_retry_at
+
+    def redis_store(self) -> Optional[RedisQuotaStore]:
+        """The Redis store while it is in use, for callers that fold the quota into their own script"""
+        return self.store if self._redis_available() else None
+
+    def _redis_failed(self, e: Exception):
+        logger.warning("Redis unavailable for quota counters, using in-memory fallback: %s", e)
+        failing_over = time.monotonic() >= self._redis_retry_at
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+        if failing_over:
+            # Redis holds absolute counts the fallback has never seen; start it from the last
+            # reconciled values rather than zero. Usage since the last reconcile is still missed.
+            self._fallback_seed = asyncio.create_task(self._seed_fallback())
+
+    async def _seed_fallback(self):
+        month = month_key()
+        try:
+            await self.fallback.seed(month, await self._reconciled_usage(month))
+        except Exception:
+            logger.exception("Error seeding quota fallback")
+
+    def _stores(self):
+        if self._redis_available():
+            return [self.store, self.fallback]
+        return [self.fallback]
+
+    async def consume(self, user_id: int, quota: int, cost: int = 1) -> Tuple[bool, int]:
+        """Count a request against this month's quota; returns (allowed, used)"""
+        month = month_key()
+        if self._redis_available():
+            start = time.perf_counter()
+            try:
+                result = await self.store.consume(month, user_id, quota, cost)
+                REDIS_QUOTA_DURATION.observe((time.perf_counter() - start) * 1000)
+                return result
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        if self._fallback_seed is not None:
+            await self._fallback_seed
+        start = time.perf_counter()
+        result = self.fallback.consume(month, user_id, quota, cost)
+        MEMORY_QUOTA_DURATION.observe((time.perf_counter() - start) * 1000)
+        return result
+
+    async def refund(self, user_id: int, cost: int = 1):
+        """Give back units charged for a request that turned out not to count"""
+        month = month_key()
+        if self._redis_available():
+            try:
+                await self.store.refund(month, user_id, cost)
+                return
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        self.fallback.refund(month, user_id, cost)
+
+    async def check(self, user_id: int, quota: int, cost: int = 1) -> int:
+        """Enforce the plan's monthly quota; returns usage including this request"""
+        allowed, used = await self.consume(user_id, quota, cost)
+        if not allowed:
+            raise quota_exceeded()
+        return used
+
+    async def _reconciled_usage(self, month: str) -> Dict[int, int]:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(RateLimit.user_id, RateLimit.current_monthly_usage).where(
+                    RateLimit.last_monthly_reset >= month_start(month)
+                )
+            )).all()
+        return {row.user_id: row.current_monthly_usage for row in rows}
+
+    async def load_from_db(self):
+        """Seed counters from the last reconciled values for the current month"""
+        month = month_key()
+        usage = await self._reconciled_usage(month)
+        for store in self._stores():
+            try:
+                await store.seed(month, usage)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+    async def reconcile(self) -> int:
+        """Persist counters to the rate_limits table in bulk"""
+        now = datetime.utcnow()
+        persisted = 0
+        # Also sweep last month so increments made just before rollover are not lost
+        previous = month_key(month_start(month_key(now)) - timedelta(days=1))
+        for month in (previous, month_key(now)):
+            for store in self._stores():
+                try:
+                    collected = await store.collect(month)
+                except redis.RedisError as e:
+                    self._redis_failed(e)
+                    continue
+                if not collected:
+                    continue
+                try:
+                    await self._persist(month, collected, store.absolute)
+                except Exception:
+                    logger.exception("Error persisting quota counters")
+                    await store.restore(month, collected)
+                    continue
+                persisted += len(collected)
+        return persisted
+
+    async def _persist(self, month: str, collected: Dict[int, int], absolute: bool):
+        start = month_start(month)
+        async with AsyncSessionLocal() as db:
+            existing = set(await db.scalars(
+                select(RateLimit.user_id).where(RateLimit.user_id.in_(collected.keys()))
+            ))
+
+            missing = [user_id for user_id in collected if user_id not in existing]
+            if missing:
+                users = (await db.execute(
+                    select(User.id, User.subscription_plan).where(User.id.in_(missing))
+                )).all()
+                for user in users:
+                    limits = plan_catalogue.get(SubscriptionPlan(user.subscription_plan))
+                    db.add(RateLimit(
+                        user_id=user.id,
+                        user_id_unique=user.id,
+                        requests_per_minute=limits.requests_per_minute,
+                        monthly_quota=limits.monthly_quota,
+                        current_monthly_usage=0,
+                        last_monthly_reset=start
+                    ))
+                await db.flush()
+
+            # Core UPDATE executed once with many parameter sets (executemany)
+            table = RateLimit.__table__
+            if absolute:
+                usage = bindparam("value")
+            else:
+                # Deltas add to the stored value unless it belongs to an earlier month
+                usage = case(
+                    (table.c.last_monthly_reset < start, bindparam("value")),
+                    else_=table.c.current_monthly_usage + bindparam("value")
+                )
+            await db.execute(
+                update(table)
+                .where(table.c.user_id == bindparam("uid"))
+                .values(current_monthly_usage=usage, last_monthly_reset=start),
+                [{"uid": user_id, "value": value} for user_id, value in collected.items()]
+            )
+            await db.commit()
+
+
+class QuotaReconciler:
+    """Background task that periodically writes quota counters back to the database"""
+
+    def __init__(self, counter: QuotaCounter, interval: float):
+        self.counter = counter
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_reconciled_at: Optional[datetime] = None
+
+    async def run_once(self) -> int:
+        persisted = await self.counter.reconcile()
+        self.last_reconciled_at = datetime.utcnow()
+        return persisted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Error reconciling quota counters")
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self.counter.load_from_db()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.run_once()
+
+
+quota_counter = QuotaCounter()
+quota_reconciler = QuotaReconciler(quota_counter, settings.quota_reconcile_interval_seconds)
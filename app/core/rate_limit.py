@@ -1,92 +1,328 @@
-from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from functools import lru_cache
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
-from app.db.models import User, RateLimit, SubscriptionPlan
-import redis
-import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
 from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.core.metrics import limiter_duration
+from app.core.plans import PlanLimits
 
-redis_client = redis.from_url(settings.redis_url) if settings.redis_url else None
+logger = logging.getLogger(__name__)
+
+# Imported on first use: processes that never reach Redis skip the import entirely
+redis = lazy_import("redis")
+
+
+@lru_cache(maxsize=1)
+def get_redis_client():
+    """The shared asyncio Redis client, created on first use (from_url does not connect)
+
+    Socket timeouts bound every call, so an unreachable Redis fails fast into the fallbacks.
+    """
+    if not settings.redis_url:
+        return None
+    from redis import asyncio as aioredis
+    return aioredis.from_url(
+        settings.redis_url,
+        socket_timeout=settings.redis_socket_timeout_seconds,
+        socket_connect_timeout=settings.redis_connect_timeout_seconds,
+    )
+
+
+# How long to stay on the in-memory fallback after Redis fails
+REDIS_RETRY_SECONDS = 30
+
+REDIS_MINUTE_DURATION = limiter_duration.labels("minute", "redis")
+REDIS_MINUTE_AND_QUOTA_DURATION = limiter_duration.labels("minute_and_quota", "redis")
+MEMORY_MINUTE_DURATION = limiter_duration.labels("minute", "memory")
+
+TOKEN_BUCKET = "token_bucket"
+SLIDING_WINDOW = "sliding_window"
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # seconds until the limit is fully replenished
+    retry_after: float  # seconds until the next request would be allowed
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+# The limits are Lua functions that run atomically on the server and take the clock
+# from Redis TIME, so concurrent callers cannot over-admit. Each is called either on
+# its own or, together with the monthly quota, as one script: one round-trip per request.
+# minute_limit(key, limit, param, cost, member) returns {allowed, remaining, reset_ms, retry_ms}.
+TOKEN_BUCKET_FUNCTION = """
+local function minute_limit(key, capacity, rate, cost, member)
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    local retry_ms = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    else
+        retry_ms = math.ceil((cost - tokens) / rate * 1000)
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    return {allowed, math.floor(tokens), math.ceil((capacity - tokens) / rate * 1000), retry_ms}
+end
+"""
+
+SLIDING_WINDOW_FUNCTION = """
+local function minute_limit(key, limit, window_ms, cost, member)
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window_ms)
+    local count = redis.call('ZCARD', key)
+    local allowed = 0
+    if count + cost <= limit then
+        for i = 1, cost do
+            redis.call('ZADD', key, now, member .. ':' .. i)
+        end
+        count = count + cost
+        allowed = 1
+    end
+    redis.call('PEXPIRE', key, window_ms)
+    local reset_ms = 0
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    if oldest[2] then
+        reset_ms = tonumber(oldest[2]) + window_ms - now
+    end
+    return {allowed, limit - count, reset_ms, allowed == 1 and 0 or reset_ms}
+end
+"""
+
+# consume_quota(key, dirty_key, quota, cost, ttl, member) returns {allowed, used};
+# also used on its own by RedisQuotaStore
+QUOTA_FUNCTION = """
+local function consume_quota(key, dirty_key, quota, cost, ttl, member)
+    local used = tonumber(redis.call('GET', key) or '0')
+    if used + cost > quota then
+        return {0, used}
+    end
+    used = redis.call('INCRBY', key, cost)
+    redis.call('EXPIRE', key, ttl)
+    redis.call('SADD', dirty_key, member)
+    return {1, used}
+end
+"""
+
+MINUTE_LIMIT_CALL = """
+return minute_limit(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4])
+"""
+
+# The quota is only charged for requests the minute limit admits
+MINUTE_LIMIT_AND_QUOTA_CALL = """
+local minute = minute_limit(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4])
+if minute[1] == 0 then
+    return {0, minute[2], minute[3], minute[4], 0, -1}
+end
+local quota = consume_quota(KEYS[2], KEYS[3], tonumber(ARGV[5]), tonumber(ARGV[3]), tonumber(ARGV[6]), ARGV[7])
+return {1, minute[2], minute[3], minute[4], quota[1], quota[2]}
+"""
+
+MINUTE_LIMIT_FUNCTIONS = {TOKEN_BUCKET: TOKEN_BUCKET_FUNCTION, SLIDING_WINDOW: SLIDING_WINDOW_FUNCTION}
+
+
+class RedisBackend:
+    """Rate limit state in Redis, each check a single atomic Lua call"""
+    
+    def __init__(self, client):
+        self.client = client
+        self._minute_limit = {
+            algorithm: client.register_script(function + MINUTE_LIMIT_CALL)
+            for algorithm, function in MINUTE_LIMIT_FUNCTIONS.items()
+        }
+        self._minute_limit_and_quota = {
+            algorithm: client.register_script(function + QUOTA_FUNCTION + MINUTE_LIMIT_AND_QUOTA_CALL)
+            for algorithm, function in MINUTE_LIMIT_FUNCTIONS.items()
+        }
+    
+    def _result(self, limit: int, allowed, remaining, reset_ms, retry_ms) -> RateLimitResult:
+        return RateLimitResult(bool(allowed), limit, max(int(remaining), 0), reset_ms / 1000, retry_ms / 1000)
+    
+    def _minute_args(self, algorithm: str, limit: int, cost: int) -> list:
+        if algorithm == TOKEN_BUCKET:
+            return [limit, limit / 60, cost, ""]
+        return [limit, 60000, cost, uuid.uuid4().hex]
+    
+    async def minute_limit(self, algorithm: str, key: str, limit: int, cost: int = 1) -> RateLimitResult:
+        response = await self._minute_limit[algorithm](keys=[key], args=self._minute_args(algorithm, limit, cost))
+        return self._result(limit, *response)
+    
+    async def minute_limit_and_quota(
+        self, algorithm: str, key: str, limit: int, cost: int, quota_keys: List[str], quota_args: list
+    ) -> Tuple[RateLimitResult, bool, int]:
+        """Per-minute limit and monthly quota in one call; the quota is charged only if the limit admits"""
+        *response, quota_allowed, used = await self._minute_limit_and_quota[algorithm](
+            keys=[key, *quota_keys], args=[*self._minute_args(algorithm, limit, cost), *quota_args]
+        )
+        return self._result(limit, *response), bool(quota_allowed), int(used)
+
+
+class MemoryBackend:
+    """In-process stand-in for RedisBackend, for tests and single-worker setups without Redis"""
+    
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, list] = {}
+        self._windows: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+    
+    def _evict(self, store: dict):
+        # Drop the oldest half once the key space grows past the cap
+        for key in list(store)[:len(store) // 2]:
+            del store[key]
+    
+    def token_bucket(self, key: str, capacity: int, refill_per_second: float, cost: int = 1) -> RateLimitResult:
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._evict(self._buckets)
+                state = self._buckets[key] = [float(capacity), now]
+            tokens = min(capacity, state[0] + max(0.0, now - state[1]) * refill_per_second)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            state[0], state[1] = tokens, now
+        retry_after = 0.0 if allowed else (cost - tokens) / refill_per_second
+        return RateLimitResult(
+            allowed, capacity, int(tokens), (capacity - tokens) / refill_per_second, retry_after
+        )
+    
+    def sliding_window(self, key: str, limit: int, window_seconds: float, cost: int = 1) -> RateLimitResult:
+        now = time.monotonic()
+        with self._lock:
+            log = self._windows.get(key)
+            if log is None:
+                if len(self._windows) >= self.max_keys:
+                    self._evict(self._windows)
+                log = self._windows[key] = deque()
+            while log and log[0] <= now - window_seconds:
+                log.popleft()
+            allowed = len(log) + cost <= limit
+            if allowed:
+                log.extend([now] * cost)
+            count = len(log)
+            reset_after = log[0] + window_seconds - now if log else 0.0
+        return RateLimitResult(
+            allowed, limit, max(limit - count, 0), reset_after, 0.0 if allowed else reset_after
+        )
 
 
 class RateLimiter:
-    def __init__(self):
-        self.redis_client = redis_client
+    def __init__(self, backend=None, algorithm: Optional[str] = None):
+        self.algorithm = algorithm or settings.rate_limit_algorithm
+        self.fallback = MemoryBackend()
+        self._backend = backend
+        self._redis_retry_at = 0.0
+    
+    @property
+    def backend(self):
+        # Resolved on the first check rather than at import
+        if self._backend is None:
+            client = get_redis_client() if settings.rate_limit_backend != "memory" else None
+            self._backend = RedisBackend(client) if client is not None else self.fallback
+        return self._backend
+    
+    def _redis_available(self) -> bool:
+        return self.backend is not self.fallback and time.monotonic() >= self._redis_retry_at
+    
+    def _redis_failed(self, e: Exception):
+        logger.warning("Redis unavailable for rate limiting, using in-memory fallback: %s", e)
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+    
+    def _key(self, user_id: int) -> str:
+        return f"rate_limit:{self.algorithm}:{user_id}"
         
-    def get_rate_limits(self, user: User, db: Session) -> Dict[str, int]:
-        """Get rate limits based on user's subscription plan"""
-        if user.subscription_plan == SubscriptionPlan.PRO:
-            return {
-                "requests_per_minute": 300,
-                "monthly_quota": 10000
-            }
-        else:  # FREE plan
-            return {
-                "requests_per_minute": 60,
-                "monthly_quota": 1000
-            }
-    
-    def check_rate_limit(self, user_id: int, db: Session) -> bool:
-        """Check if user is within rate limits"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+    def _consume(self, backend, key: str, limit: int, cost: int) -> RateLimitResult:
+        if self.algorithm == TOKEN_BUCKET:
+            return backend.token_bucket(key, limit, limit / 60, cost)
+        return backend.sliding_window(key, limit, 60, cost)
+    
+    async def hit(self, user_id: int, limit: int, cost: int = 1) -> RateLimitResult:
+        """Consume from the per-minute allowance and report what is left"""
+        key = self._key(user_id)
+        
+        if self._redis_available():
+            start = time.perf_counter()
+            try:
+                result = await self.backend.minute_limit(self.algorithm, key, limit, cost)
+                REDIS_MINUTE_DURATION.observe((time.perf_counter() - start) * 1000)
+                return result
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        start = time.perf_counter()
+        result = self._consume(self.fallback, key, limit, cost)
+        MEMORY_MINUTE_DURATION.observe((time.perf_counter() - start) * 1000)
+        return result
+    
+    def _enforce(self, result: RateLimitResult) -> RateLimitResult:
+        if not result.allowed:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded. Too many requests per minute.",
+                headers=result.headers()
             )
+        return result
+    
+    async def check_minute_limit(self, user_id: int, limit: int, cost: int = 1) -> RateLimitResult:
+        """Enforce the per-minute limit without touching the database"""
+        return self._enforce(await self.hit(user_id, limit, cost))
+    
+    async def check_rate_limit(self, principal, limits: PlanLimits, cost: int = 1) -> RateLimitResult:
+        """Check if user is within rate limits, using the already-resolved principal and plan"""
+        from app.core.quota import month_key, quota_counter, quota_exceeded
         
-        limits = self.get_rate_limits(user, db)
-        
-        # Check Redis for minute-based rate limiting
-        if self.redis_client:
-            minute_key = f"rate_limit:{user_id}:minute"
-            current_requests = self.redis_client.get(minute_key)
-            
-            if current_requests is None:
-                self.redis_client.setex(minute_key, 60, 1)
+        # With both counters in Redis, the minute limit and monthly quota are one script call
+        quota_store = quota_counter.redis_store()
+        if quota_store is not None and self._redis_available():
+            start = time.perf_counter()
+            try:
+                result, quota_allowed, _ = await self.backend.minute_limit_and_quota(
+                    self.algorithm, self._key(principal.id), limits.requests_per_minute, cost,
+                    *quota_store.consume_call(month_key(), principal.id, limits.monthly_quota)
+                )
+                REDIS_MINUTE_AND_QUOTA_DURATION.observe((time.perf_counter() - start) * 1000)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+                quota_counter._redis_failed(e)
             else:
-                current_requests = int(current_requests)
-                if current_requests >= limits["requests_per_minute"]:
-                    raise HTTPException(
-                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                        detail="Rate limit exceeded. Too many requests per minute."
-                    )
-                self.redis_client.incr(minute_key)
-        
-        # Check monthly quota in database
-        rate_limit_record = db.query(RateLimit).filter(RateLimit.user_id == user_id).first()
+                self._enforce(result)
+                if not quota_allowed:
+                    raise quota_exceeded()
+                return result
         
-        if not rate_limit_record:
-            rate_limit_record = RateLimit(
-                user_id=user_id,
-                requests_per_minute=limits["requests_per_minute"],
-                monthly_quota=limits["monthly_quota"],
-                current_monthly_usage=0,
-                last_monthly_reset=datetime.utcnow()
-            )
-            db.add(rate_limit_record)
-            db.commit()
-        
-        # Reset monthly counter if needed
-        now = datetime.utcnow()
-        if (now - rate_limit_record.last_monthly_reset).days >= 30:
-            rate_limit_record.current_monthly_usage = 0
-            rate_limit_record.last_monthly_reset = now
-            db.commit()
-        
-        # Check monthly quota
-        if rate_limit_record.current_monthly_usage >= rate_limit_record.monthly_quota:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Monthly quota exceeded. Please upgrade your plan."
-            )
+        # Per-minute limit (Redis, falling back to in-memory)
+        result = await self.check_minute_limit(principal.id, limits.requests_per_minute, cost)
         
-        # Increment usage
-        rate_limit_record.current_monthly_usage += 1
-        db.commit()
+        # Monthly quota, counted in Redis/memory and reconciled to rate_limits in the background
+        await quota_counter.check(principal.id, limits.monthly_quota, cost)
         
-        return True
+        return result
 
 
 rate_limiter = RateLimiter()
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from sqlalchemy import select
+from app.db.models import RefreshToken
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.rate_limit import REDIS_RETRY_SECONDS, get_redis_client, redis
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of revoked token families, scored by when their last access token expires
+REVOKED_FAMILIES_KEY = "revoked_token_families"
+
+# Re-read this much of the sorted set on each sync, to tolerate clock skew between workers
+SYNC_OVERLAP_SECONDS = 5.0
+
+
+def family_ttl_seconds() -> float:
+    """A revoked family only matters until the last access token issued to it expires"""
+    return settings.access_token_expire_minutes * 60
+
+
+class RevocationList:
+    """Revoked token families, checked for every access token with one in-process dict lookup
+
+    Entries expire with the access tokens they block, so the set stays small. Revocations
+    are written to a Redis sorted set and pulled incrementally by every worker each
+    sync interval; without Redis the set is per process, seeded from refresh_tokens.
+    While Redis is unreachable the sync backs off, and revocations that could not be
+    published are retried on the next successful sync.
+    """
+
+    def __init__(self, shared: bool, sync_interval: float):
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self._expiry: Dict[str, float] = {}
+        self._unpublished: Dict[str, float] = {}
+        self._synced_score = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.last_synced_at: Optional[float] = None
+        self.redis_healthy = True
+
+    @property
+    def redis_client(self):
+        return get_redis_client() if self.shared else None
+
+    def is_revoked(self, family: Optional[str]) -> bool:
+        if family is None:
+            return False
+        expires = self._expiry.get(family)
+        return expires is not None and expires > time.time()
+
+    def _redis_failed(self, action: str, e: Exception):
+        # Report once per outage rather than every interval
+        if self.redis_healthy:
+            logger.warning("Error %s token revocations: %s", action, e)
+        self.redis_healthy = False
+
+    async def add(self, families: Iterable[str]):
+        expires = time.time() + family_ttl_seconds()
+        families = {family: expires for family in families}
+        if not families:
+            return
+        self._expiry.update(families)
+        if self.redis_client:
+            try:
+                await self.redis_client.zadd(REVOKED_FAMILIES_KEY, families)
+            except redis.RedisError as e:
+                self._unpublished.update(families)
+                self._redis_failed("publishing", e)
+
+    async def sync(self):
+        """Drop expired entries and pull revocations made by other workers"""
+        now = time.time()
+        self._expiry = {family: expires for family, expires in self._expiry.items() if expires > now}
+        if not self.redis_client:
+            return
+        unpublished = {family: expires for family, expires in self._unpublished.items() if expires > now}
+        try:
+            pipe = self.redis_client.pipeline()
+            if unpublished:
+                pipe.zadd(REVOKED_FAMILIES_KEY, unpublished)
+            pipe.zremrangebyscore(REVOKED_FAMILIES_KEY, "-inf", now)
+            pipe.zrangebyscore(REVOKED_FAMILIES_KEY, max(self._synced_score - SYNC_OVERLAP_SECONDS, now), "+inf", withscores=True)
+            entries = (await pipe.execute())[-1]
+        except redis.RedisError as e:
+            self._redis_failed("syncing", e)
+            return
+        self.redis_healthy = True
+        self._unpublished.clear()
+        for family, expires in entries:
+            self._expiry[family.decode() if isinstance(family, bytes) else family] = expires
+            self._synced_score = max(self._synced_score, expires)
+        self.last_synced_at = now
+
+    async def load_from_db(self):
+        """Seed families revoked recently enough that their access tokens may still be live"""
+        since = datetime.utcnow() - timedelta(seconds=family_ttl_seconds())
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(RefreshToken.family_id, RefreshToken.revoked_at)
+                .where(RefreshToken.revoked_at >= since)
+                .distinct()
+            )).all()
+        for row in rows:
+            expires = (row.revoked_at.replace(tzinfo=None) - datetime(1970, 1, 1)).total_seconds() + family_ttl_seconds()
+            self._expiry[row.family_id] = max(self._expiry.get(row.family_id, 0.0), expires)
+
+    async def _run(self):
+        delay = self.sync_interval
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Error syncing token revocations")
+            # Retry an unreachable Redis with exponential backoff rather than every interval
+            delay = self.sync_interval if self.redis_healthy else min(delay * 2, REDIS_RETRY_SECONDS)
+            await asyncio.sleep(delay)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # Redis is first synced by the loop, off the startup path
+        await self.load_from_db()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "revoked_families": len(self._expiry),
+            "shared": self.shared,
+            "redis_healthy": self.redis_healthy,
+            "unpublished": len(self._unpublished),
+            "last_synced_at": self.last_synced_at,
+        }
+
+
+revocation_list = RevocationList(
+    shared=settings.token_revocation_redis,
+    sync_interval=settings.token_revocation_sync_seconds,
+)
+registry.gauge("revoked_token_families", "Revoked refresh token families held in memory", lambda: len(revocation_list._expiry))
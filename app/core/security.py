@@ -1,11 +1,137 @@
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from functools import lru_cache
+from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.metrics import registry, jwt_cache_hits, jwt_decode_duration, password_hash_duration
+from app.core.revocation import revocation_list
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost doubles per round; never calibrate below this
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+
+
+def build_password_context(bcrypt_rounds: Optional[int] = None) -> CryptContext:
+    """First scheme hashes new passwords; hashes in later schemes, or below the
+    configured bcrypt rounds, are reported by needs_update and upgraded on login"""
+    schemes = [scheme.strip() for scheme in settings.password_schemes.split(",") if scheme.strip()]
+    options = {}
+    if bcrypt_rounds:
+        options["bcrypt__default_rounds"] = bcrypt_rounds
+        options["bcrypt__min_rounds"] = bcrypt_rounds
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+
+pwd_context = build_password_context(settings.bcrypt_rounds)
+
+
+def calibrate_bcrypt_rounds(target_ms: float) -> int:
+    """Pick the highest bcrypt work factor whose hash time on this host stays within target_ms"""
+    from passlib.hash import bcrypt
+    
+    start = time.perf_counter()
+    bcrypt.using(rounds=BCRYPT_MIN_ROUNDS).hash("calibration")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    rounds = BCRYPT_MIN_ROUNDS
+    while rounds < BCRYPT_MAX_ROUNDS and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+def configure_password_hashing(bcrypt_rounds: int):
+    global pwd_context
+    pwd_context = build_password_context(bcrypt_rounds)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+ASYMMETRIC_ALGORITHM_PREFIXES = ("RS", "PS", "ES", "EdDSA")
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+def is_asymmetric(algorithm: str) -> bool:
+    return algorithm.startswith(ASYMMETRIC_ALGORITHM_PREFIXES)
+
+
+@lru_cache(maxsize=4)
+def load_pem_key(pem: str, private: bool):
+    """Parse a PEM key once; re-parsing an RSA private key costs tens of milliseconds"""
+    from cryptography.hazmat.primitives import serialization
+    if private:
+        return serialization.load_pem_private_key(pem.encode(), password=None)
+    return serialization.load_pem_public_key(pem.encode())
+
+
+class JoseBackend:
+    """python-jose; the original backend (re-parses PEM keys on every call)"""
+    
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        return jwt.encode(claims, key, algorithm=algorithm)
+    
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        try:
+            return jwt.decode(token, key, algorithms=[algorithm])
+        except JWTError as e:
+            raise InvalidTokenError(str(e))
+
+
+class PyJWTBackend:
+    """PyJWT; noticeably faster verification for both HMAC and asymmetric algorithms"""
+    
+    def __init__(self):
+        import jwt as pyjwt
+        self.pyjwt = pyjwt
+    
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        if is_asymmetric(algorithm):
+            key = load_pem_key(key, private=True)
+        return self.pyjwt.encode(claims, key, algorithm=algorithm)
+    
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        if is_asymmetric(algorithm):
+            key = load_pem_key(key, private=False)
+        try:
+            return self.pyjwt.decode(token, key, algorithms=[algorithm])
+        except self.pyjwt.PyJWTError as e:
+            raise InvalidTokenError(str(e))
+
+
+JWT_BACKENDS = {
+    "jose": JoseBackend,
+    "pyjwt": PyJWTBackend,
+}
+
+jwt_backend = JWT_BACKENDS[settings.jwt_backend]()
+
+# sha256(token) -> verified payload; entries never outlive the token's own exp
+verified_token_cache = TTLCache(settings.token_cache_size, settings.access_token_expire_minutes * 60)
+JWT_CACHE_HITS = jwt_cache_hits.labels()
+JWT_DECODE_DURATION = jwt_decode_duration.labels()
+
+
+def signing_key() -> str:
+    if is_asymmetric(settings.algorithm):
+        return settings.jwt_private_key
+    return settings.secret_key
+
+
+def verification_key() -> str:
+    if is_asymmetric(settings.algorithm):
+        return settings.jwt_public_key
+    return settings.secret_key
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -16,6 +142,78 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password[:72])
 
 
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so hashing never blocks the event loop
+    
+    bcrypt releases the GIL, so threads hash in parallel. Once workers + queue_limit
+    calls are in flight, further calls are rejected with 503 instead of queueing
+    without bound, so a login storm degrades instead of stalling every request.
+    """
+    
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.max_pending = workers + queue_limit
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        self.rejected = 0
+    
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+    
+    async def _run(self, fn, *args):
+        # Only touched from the event loop thread, so no lock is needed
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent authentication requests. Please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            result, elapsed_ms = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _timed, fn, *args
+            )
+        finally:
+            self.pending -= 1
+        # Observed back on the loop thread, where all metric updates happen
+        password_hash_duration.labels(fn.__name__).observe(elapsed_ms)
+        return result
+    
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+    
+    async def calibrate(self, target_ms: float) -> int:
+        """Measure on this host (in the pool) and switch new hashes to the chosen work factor"""
+        rounds = await asyncio.get_running_loop().run_in_executor(
+            self.executor, calibrate_bcrypt_rounds, target_ms
+        )
+        configure_password_hashing(rounds)
+        return rounds
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_queue_limit)
+registry.gauge("password_hash_pending", "bcrypt calls running or queued", lambda: password_hasher.pending)
+registry.gauge("password_hash_rejected", "bcrypt calls rejected with 503 (pool saturated)", lambda: password_hasher.rejected)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -24,7 +222,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     
     to_encode.update({"exp": expire, "type": "access"})
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
+    encoded_jwt = jwt_backend.encode(to_encode, signing_key(), settings.algorithm)
     return encoded_jwt
 
 
@@ -32,13 +230,32 @@ def create_refresh_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=settings.refresh_token_expire_days)
     to_encode.update({"exp": expire, "type": "refresh"})
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
+    encoded_jwt = jwt_backend.encode(to_encode, signing_key(), settings.algorithm)
     return encoded_jwt
 
 
+def decode_token(token: str) -> dict:
+    """Verify signature and claims, reusing an earlier verification of the same token"""
+    digest = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    
+    payload = verified_token_cache.get(digest)
+    if payload is not None and payload["exp"] > now:
+        JWT_CACHE_HITS.inc()
+        return payload
+    
+    start = time.perf_counter()
+    payload = jwt_backend.decode(token, verification_key(), settings.algorithm)
+    JWT_DECODE_DURATION.observe((time.perf_counter() - start) * 1000)
+    remaining = payload.get("exp", 0) - now
+    if remaining > 0:
+        verified_token_cache.set(digest, payload, ttl=remaining)
+    return payload
+
+
 def verify_token(token: str, token_type: str = "access") -> dict:
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         token_type_in_token: str = payload.get("type")
         
@@ -48,8 +265,15 @@ def verify_token(token: str, token_type: str = "access") -> dict:
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        # Access tokens outlive logout; their refresh token family is checked in memory
+        if token_type == "access" and revocation_list.is_revoked(payload.get("fam")):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         return payload
-    except JWTError:
+    except InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
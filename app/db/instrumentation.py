@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from app.core.config import settings
+from app.core.metrics import db_query_duration
+
+# First table a statement touches: SELECT ... FROM t, INSERT INTO t, UPDATE t, DELETE FROM t
+STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+
+# Response headers added while SQL profiling is enabled
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+DB_TIME_HEADER = "X-DB-Time-Ms"
+REPEATED_HEADER = "X-DB-Repeated-Statements"
+DEBUG_HEADERS = [QUERY_COUNT_HEADER, DB_TIME_HEADER, REPEATED_HEADER]
+
+
+class QueryMetrics:
+    """Times every statement on an engine into db_query_duration by (operation, table)"""
+    
+    def __init__(self, max_statements: int = 4096):
+        # SQL text repeats (compiled statements are cached), so classification is memoised
+        self.max_statements = max_statements
+        self._classes: Dict[str, object] = {}
+    
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+    
+    def classify(self, statement: str) -> Tuple[str, str]:
+        words = statement.split(None, 1)
+        operation = words[0].upper() if words else "OTHER"
+        match = STATEMENT_TABLE.search(statement)
+        return operation, match.group(1).lower() if match else "-"
+    
+    def _histogram(self, statement: str):
+        histogram = self._classes.get(statement)
+        if histogram is None:
+            histogram = db_query_duration.labels(*self.classify(statement))
+            if len(self._classes) < self.max_statements:
+                self._classes[statement] = histogram
+        return histogram
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+    
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        self._histogram(statement).observe(elapsed_ms)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record(statement, elapsed_ms)
+    
+    def _handle_error(self, exception_context):
+        # after_cursor_execute never fires for a failed statement
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+class RequestProfile:
+    """Statements executed while serving one request"""
+    
+    __slots__ = ("query_count", "db_time_ms", "statements")
+    
+    def __init__(self):
+        self.query_count = 0
+        self.db_time_ms = 0.0
+        # statement text -> [executions, total ms]
+        self.statements: Dict[str, List[float]] = {}
+    
+    def record(self, statement: str, elapsed_ms: float):
+        self.query_count += 1
+        self.db_time_ms += elapsed_ms
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed_ms]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed_ms
+    
+    def repeated(self, threshold: int) -> List[dict]:
+        """Statements run at least threshold times, the usual sign of an N+1 loop"""
+        return [
+            {"statement": statement, "count": count, "db_time_ms": round(total, 3)}
+            for statement, (count, total) in sorted(self.statements.items(), key=lambda item: -item[1][0])
+            if count >= threshold
+        ]
+
+
+# Set by the request middleware while profiling; None everywhere else (background workers)
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+class SqlProfiler:
+    """Per-request query counts and DB time (debug mode), keeping the slowest requests for the admin API"""
+    
+    def __init__(self, report_size: int = 50, repeat_threshold: int = 5):
+        self.report_size = report_size
+        self.repeat_threshold = repeat_threshold
+        self.profiled = 0
+        self.flagged = 0  # requests with at least one repeated statement
+        self._slowest: List[tuple] = []  # min-heap of (elapsed_ms, seq, entry)
+        self._seq = itertools.count()
+    
+    def start(self):
+        profile = RequestProfile()
+        return profile, current_profile.set(profile)
+    
+    def finish(self, profile: RequestProfile, token, method: str, route: str,
+               status_code: int, elapsed_ms: float) -> Dict[str, str]:
+        """Record a finished request and return its debug headers"""
+        current_profile.reset(token)
+        repeated = profile.repeated(self.repeat_threshold)
+        self.profiled += 1
+        if repeated:
+            self.flagged += 1
+        
+        if len(self._slowest) < self.report_size or elapsed_ms > self._slowest[0][0]:
+            entry = {
+                "method": method,
+                "route": route,
+                "status_code": status_code,
+                "elapsed_ms": round(elapsed_ms, 3),
+                "query_count": profile.query_count,
+                "db_time_ms": round(profile.db_time_ms, 3),
+                "distinct_statements": len(profile.statements),
+                "repeated_statements": repeated,
+                "at": time.time(),
+            }
+            item = (elapsed_ms, next(self._seq), entry)
+            if len(self._slowest) < self.report_size:
+                heapq.heappush(self._slowest, item)
+            else:
+                heapq.heapreplace(self._slowest, item)
+        
+        return {
+            QUERY_COUNT_HEADER: str(profile.query_count),
+            DB_TIME_HEADER: f"{profile.db_time_ms:.3f}",
+            REPEATED_HEADER: str(len(repeated)),
+        }
+    
+    def report(self, limit: Optional[int] = None) -> dict:
+        slowest = [entry for _, _, entry in sorted(self._slowest, reverse=True)]
+        return {
+            "enabled": settings.sql_profiling_enabled,
+            "profiled_requests": self.profiled,
+            "requests_with_repeated_statements": self.flagged,
+            "repeat_threshold": self.repeat_threshold,
+            "slowest": slowest[:limit] if limit else slowest,
+        }
+    
+    def reset(self):
+        self.profiled = 0
+        self.flagged = 0
+        self._slowest = []
+
+
+query_metrics = QueryMetrics()
+sql_profiler = SqlProfiler(settings.sql_profile_report_size, settings.sql_profile_repeat_threshold)
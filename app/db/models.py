@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Enum, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Enum, ForeignKey, Text, Float, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -44,10 +44,39 @@ class UsageLog(Base):
     endpoint = Column(String, nullable=False)
     method = Column(String, nullable=False)
     status_code = Column(Integer, nullable=False)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     response_time_ms = Column(Float, nullable=True)
     
     user = relationship("User", back_populates="usage_logs")
+    
+    # On Postgres the table is range-partitioned by month on timestamp (see migrations/)
+    __table_args__ = (
+        Index("ix_usage_logs_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_usage_logs_endpoint_timestamp", "endpoint", "timestamp"),
+    )
+
+
+class UsageRollup(Base):
+    """Pre-aggregated usage per user x endpoint x time bucket, maintained as logs are ingested"""
+    __tablename__ = "usage_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    endpoint = Column(String, nullable=False)
+    period = Column(String, nullable=False)  # hour, day, month, all
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    request_count = Column(Integer, default=0, nullable=False)
+    timed_count = Column(Integer, default=0, nullable=False)  # requests with a response time
+    response_time_sum = Column(Float, default=0.0, nullable=False)
+    response_time_sum_sq = Column(Float, default=0.0, nullable=False)
+    last_request_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "endpoint", "period", "bucket_start", name="uq_usage_rollups_bucket"),
+        Index("ix_usage_rollups_user_period_bucket", "user_id", "period", "bucket_start"),
+        # Totals for one bucket across users, walkable in request_count order
+        Index("ix_usage_rollups_ranking", "period", "endpoint", "bucket_start", "request_count", "user_id"),
+    )
 
 
 class Subscription(Base):
@@ -57,6 +86,8 @@ class Subscription(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     plan = Column(Enum(SubscriptionPlan), nullable=False)
     stripe_subscription_id = Column(String, nullable=True)
+    stripe_subscription_item_id = Column(String, nullable=True)  # metered price item usage is reported to
+    stripe_event_at = Column(DateTime(timezone=True), nullable=True)  # created time of the last webhook applied
     status = Column(String, nullable=False)  # active, canceled, past_due, etc.
     current_period_start = Column(DateTime(timezone=True), nullable=True)
     current_period_end = Column(DateTime(timezone=True), nullable=True)
@@ -64,6 +95,123 @@ class Subscription(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     user = relationship("User", back_populates="subscriptions")
+    
+    __table_args__ = (
+        # Sweeper walks due subscriptions in period-end order; lookups are by user and status
+        Index("ix_subscriptions_status_period_end", "status", "current_period_end"),
+        Index("ix_subscriptions_user_id_status", "user_id", "status"),
+        # Webhooks name the Stripe subscription they are about
+        Index("ix_subscriptions_stripe_subscription_id", "stripe_subscription_id"),
+    )
+
+
+class OutboxMessage(Base):
+    """Outbound billing-provider call, written in the caller's transaction and sent by the billing worker"""
+    __tablename__ = "outbox_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String, default="pending", nullable=False)  # pending, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        Index("ix_outbox_messages_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class WebhookEvent(Base):
+    """Inbound billing-provider webhook, stored once per event id and applied by the billing worker"""
+    __tablename__ = "webhook_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String, unique=True, nullable=False)
+    type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String, default="pending", nullable=False)  # pending, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(Text, nullable=True)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        Index("ix_webhook_events_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class Plan(Base):
+    """Limits for a subscription plan, served from the in-memory plan catalogue"""
+    __tablename__ = "plans"
+    
+    code = Column(Enum(SubscriptionPlan), primary_key=True)
+    requests_per_minute = Column(Integer, nullable=False)
+    monthly_quota = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    endpoint_costs = relationship("PlanEndpointCost", back_populates="plan_row", cascade="all, delete-orphan")
+
+
+class PlanEndpointCost(Base):
+    """Requests to an endpoint (route template) count this many times against a plan's limits"""
+    __tablename__ = "plan_endpoint_costs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    plan = Column(Enum(SubscriptionPlan), ForeignKey("plans.code", ondelete="CASCADE"), nullable=False)
+    endpoint = Column(String, nullable=False)
+    cost = Column(Integer, nullable=False)
+    
+    plan_row = relationship("Plan", back_populates="endpoint_costs")
+    
+    __table_args__ = (
+        UniqueConstraint("plan", "endpoint", name="uq_plan_endpoint_costs_plan_endpoint"),
+    )
+
+
+class UsageReport(Base):
+    """Usage of one customer in one billing window, as reported (or to be reported) to the billing provider"""
+    __tablename__ = "usage_reports"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    window_start = Column(DateTime(timezone=True), nullable=False)
+    subscription_item_id = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    reported_quantity = Column(Integer, nullable=True)
+    status = Column(String, default="pending", nullable=False)  # pending, sent, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    reported_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "window_start", name="uq_usage_reports_user_window"),
+        Index("ix_usage_reports_status_id", "status", "id"),
+    )
+
+
+class RefreshToken(Base):
+    """Issued refresh token (by jti); each login starts a family that rotation carries forward"""
+    __tablename__ = "refresh_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String, unique=True, nullable=False)
+    family_id = Column(String, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    used_at = Column(DateTime(timezone=True), nullable=True)  # exchanged for replaced_by
+    replaced_by = Column(String, nullable=True)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)  # whole family: logout or reuse
+    
+    __table_args__ = (
+        Index("ix_refresh_tokens_user_id", "user_id"),
+        Index("ix_refresh_tokens_revoked_at", "revoked_at"),
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+    )
 
 
 class RateLimit(Base):
@@ -0,0 +1,84 @@
+import re
+from datetime import datetime, timezone
+from typing import List, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Monthly range partitions are named <table>_yYYYYmMM, e.g. usage_logs_y2024m01
+PARTITION_NAME = re.compile(r"_y(\d{4})m(\d{2})$")
+
+
+def month_floor(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def months_between(start: datetime, end: datetime) -> int:
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_y{month:%Y}m{month:%m}"
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    """True if the Postgres table is declaratively partitioned"""
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = :table AND pg_table_is_visible(oid)"),
+        {"table": table}
+    ).scalar()
+    return relkind == "p"
+
+
+def ensure_monthly_partitions(conn: Connection, table: str, start: datetime, months: int) -> List[str]:
+    """Create the monthly partitions covering [start, start + months) if they are missing"""
+    created = []
+    month = month_floor(start)
+    for _ in range(months):
+        name = partition_name(table, month)
+        upper = add_months(month, 1)
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        if exists is None:
+            # Bounds are UTC, matching the naive utcnow() timestamps the app writes
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{upper:%Y-%m-%d} 00:00:00+00')"
+            ))
+            created.append(name)
+        month = upper
+    return created
+
+
+def list_partitions(conn: Connection, table: str) -> List[Tuple[str, datetime]]:
+    """Monthly partitions currently attached to the table, oldest first"""
+    names = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": table}).scalars()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def detach_partitions_before(conn: Connection, table: str, cutoff: datetime, drop: bool = True) -> List[str]:
+    """Detach (and optionally drop) every partition that ends on or before the cutoff"""
+    removed = []
+    for name, month in list_partitions(conn, table):
+        if add_months(month, 1) > cutoff:
+            break
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        if drop:
+            conn.execute(text(f"DROP TABLE {name}"))
+        removed.append(name)
+    return removed
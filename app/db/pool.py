@@ -0,0 +1,70 @@
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.core.metrics import Histogram
+
+
+class PoolStats:
+    """Connection pool counters and wait/hold-time histograms (milliseconds)"""
+    
+    def __init__(self):
+        self.wait_ms = Histogram()
+        self.held_ms = Histogram()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.timeouts = 0
+    
+    def install(self, pool):
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        event.listen(pool, "invalidate", self._on_invalidate)
+    
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connects += 1
+    
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+        connection_record.info["checked_out_at"] = time.perf_counter()
+    
+    def _on_checkin(self, dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            self.held_ms.observe((time.perf_counter() - checked_out_at) * 1000)
+    
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.invalidations += 1
+    
+    def snapshot(self, pool) -> dict:
+        state = {"pool_class": type(pool).__name__}
+        # NullPool/StaticPool have no sizing to report
+        for name in ("size", "checkedout", "checkedin", "overflow"):
+            if hasattr(pool, name):
+                state[name] = getattr(pool, name)()
+        return {
+            **state,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_ms": self.wait_ms.snapshot(),
+            "held_ms": self.held_ms.snapshot(),
+        }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long each checkout waited for a connection"""
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.wait_ms.observe((time.perf_counter() - start) * 1000)
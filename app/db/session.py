@@ -1,17 +1,87 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.db.pool import InstrumentedAsyncQueuePool, pool_stats
+from app.db.instrumentation import query_metrics
+from app.core.metrics import registry
 
-engine = create_engine(settings.database_url)
+# Async driver used for each backend when ASYNC_DATABASE_URL is not set explicitly
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def get_async_database_url() -> str:
+    if settings.async_database_url:
+        return settings.async_database_url
+    url = make_url(settings.database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'; set ASYNC_DATABASE_URL")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str) -> dict:
+    """Pool sizing from Settings; in-memory SQLite keeps SQLAlchemy's single-connection pool"""
+    options = {}
+    if is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+        if make_url(url).database in (None, "", ":memory:"):
+            return options
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    cursor.close()
+
+
+# Synchronous engine, kept for scripts and migrations
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine used by the API and background workers
+async_database_url = get_async_database_url()
+async_engine_options = engine_options(async_database_url)
+if "pool_size" in async_engine_options:
+    async_engine_options["poolclass"] = InstrumentedAsyncQueuePool
+async_engine = create_async_engine(async_database_url, **async_engine_options)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+pool_stats.install(async_engine.sync_engine.pool)
+query_metrics.install(async_engine.sync_engine)
+registry.register_histogram("db_pool_wait_milliseconds", "Time spent waiting for a pooled connection", pool_stats.wait_ms)
+registry.register_histogram("db_pool_held_milliseconds", "Time a connection was checked out", pool_stats.held_ms)
+if hasattr(async_engine.pool, "checkedout"):
+    registry.gauge("db_pool_checked_out", "Connections currently checked out", async_engine.pool.checkedout)
+if is_sqlite(settings.database_url):
+    event.listen(engine, "connect", set_sqlite_pragmas)
+if is_sqlite(async_database_url):
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,41 +1,99 @@
 from fastapi import FastAPI, Request, HTTPException, status, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Match
 from contextlib import asynccontextmanager
+import asyncio
+import logging
 import time
-from sqlalchemy.orm import Session
-
-from app.db.session import engine, get_db
-from app.db.models import Base, User, RateLimit
-from app.api import auth, users, admin
-from app.services.usage import UsageService
+from sqlalchemy import select
+
+from app.db.session import async_engine, AsyncSessionLocal
+from app.db.instrumentation import DEBUG_HEADERS, sql_profiler
+from app.db.models import Base, User
+from app.api import auth, users, admin, billing
+from app.services.usage import UNMATCHED_ROUTE, UsageService, usage_buffer
+from app.services.retention import usage_retention
+from app.services.outbox import billing_worker
+from app.services.billing import stripe_api
+from app.services.metering import metered_usage_reporter
+from app.services.subscriptions import subscription_sweeper
 from app.core.rate_limit import rate_limiter
+from app.core.plans import PlanLimits, plan_catalogue
+from app.core.quota import quota_counter, quota_reconciler
+from app.core.principals import principal_cache
 from app.core.config import settings
+from app.core.metrics import registry, http_request_duration, http_requests
+from app.core.security import verify_token, password_hasher
+from app.core.revocation import revocation_list
 from app.api.auth import get_current_active_user
+from app.core.pagination import NEXT_CURSOR_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Paths never metered or rate limited
+UNMETERED_PATHS = {"/", "/health", "/metrics", "/docs", "/redoc", "/openapi.json"}
+
+# Route label for requests rejected before routing (rate limited)
+REJECTED_ROUTE = "<rejected>"
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Create database tables
-    Base.metadata.create_all(bind=engine)
+    # Create database tables (left to migrations when disabled)
+    if settings.create_tables_on_startup:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    
+    # Tune the bcrypt work factor to this host before anything is hashed
+    if settings.password_hash_target_ms:
+        rounds = await password_hasher.calibrate(settings.password_hash_target_ms)
+        logger.info("Calibrated bcrypt to %d rounds for a %sms target", rounds, settings.password_hash_target_ms)
     
     # Create default admin user if doesn't exist
-    db = next(get_db())
-    try:
-        admin_user = db.query(User).filter(User.username == "admin").first()
-        if not admin_user:
-            from app.core.security import get_password_hash
-            admin_user = User(
-                username="admin",
-                email="admin@example.com",
-                hashed_password=get_password_hash("admin123"),
-                role="ADMIN"
-            )
-            db.add(admin_user)
-            db.commit()
-    finally:
-        db.close()
+    if settings.seed_admin_on_startup:
+        async with AsyncSessionLocal() as db:
+            admin_user = (await db.execute(select(User).where(User.username == "admin"))).scalars().first()
+            if not admin_user:
+                admin_user = User(
+                    username="admin",
+                    email="admin@example.com",
+                    hashed_password=await password_hasher.hash("admin123"),
+                    role="ADMIN"
+                )
+                db.add(admin_user)
+                await db.commit()
+    
+    # Plan limits are served from memory; load them before the first request is checked
+    await plan_catalogue.start()
+    # Likewise revoked token families, so a signed-out token is refused from the first request
+    await revocation_list.start()
+    
+    # Start the batched usage-log writer, log retention and the quota reconciler
+    await usage_retention.start()
+    usage_buffer.start()
+    await quota_reconciler.start()
+    billing_worker.start()
+    # Stripe is imported on first use; warm it up in a thread so the first webhook doesn't pay for it
+    if settings.stripe_api_key or settings.stripe_webhook_secret:
+        asyncio.get_running_loop().run_in_executor(None, stripe_api)
+    subscription_sweeper.start()
+    if settings.metered_billing_enabled:
+        metered_usage_reporter.start()
     
     yield
+    
+    # Drain pending usage logs and persist quota counters before shutdown
+    await metered_usage_reporter.stop()
+    await subscription_sweeper.stop()
+    await billing_worker.stop()
+    await quota_reconciler.stop()
+    await usage_buffer.stop()
+    await usage_retention.stop()
+    await revocation_list.stop()
+    await plan_catalogue.stop()
+    await async_engine.dispose()
+    password_hasher.shutdown()
 
 
 app = FastAPI(
@@ -52,20 +110,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, *DEBUG_HEADERS],
 )
 
 
+async def resolve_caller(request: Request):
+    """Resolve the authenticated principal once per request (cached, usually no DB lookup)"""
+    authorization = request.headers.get("authorization")
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    
+    try:
+        payload = verify_token(authorization[7:], "access")
+    except HTTPException:
+        # Let the route's own auth dependency reject the request
+        return None
+    
+    username = payload.get("sub")
+    if username is None:
+        return None
+    return await principal_cache.get(username)
+
+
+def record_request(route: str, method: str, status_code: int, start_time: float):
+    http_request_duration.labels(route, method).observe((time.perf_counter() - start_time) * 1000)
+    http_requests.labels(route, method, str(status_code)).inc()
+
+
+def endpoint_cost(request: Request, limits: PlanLimits) -> int:
+    """Weight of this request under the caller's plan; only the plan's weighted routes are matched"""
+    for endpoint, cost in limits.endpoint_costs.items():
+        for route in routes_by_path.get(endpoint, ()):
+            if route.matches(request.scope)[0] == Match.FULL:
+                return cost
+    return 1
+
+
 @app.middleware("http")
 async def usage_tracking_middleware(request: Request, call_next):
     """Middleware to track API usage and enforce rate limits"""
-    start_time = time.time()
+    start_time = time.perf_counter()
+    if settings.sql_profiling_enabled:
+        profile, profile_token = sql_profiler.start()
+    
+    caller = None
+    if settings.metering_enabled and request.url.path not in UNMETERED_PATHS:
+        caller = await resolve_caller(request)
+        # Reused by get_current_user instead of a second lookup
+        request.state.principal = caller
+        if caller is not None and not caller.is_active:
+            caller = None
+    
+    limit_result = None
+    if caller:
+        limits = plan_catalogue.get(caller.subscription_plan)
+        cost = endpoint_cost(request, limits)
+        try:
+            limit_result = await rate_limiter.check_rate_limit(caller, limits, cost)
+        except HTTPException as e:
+            # Rejected before routing, so there is no route template to label with
+            record_request(REJECTED_ROUTE, request.method, e.status_code, start_time)
+            if settings.sql_profiling_enabled:
+                sql_profiler.finish(profile, profile_token, request.method, REJECTED_ROUTE,
+                                    e.status_code, (time.perf_counter() - start_time) * 1000)
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"detail": e.detail},
+                headers=e.headers
+            )
     
     # Process request
     response = await call_next(request)
     
     # Calculate response time
-    process_time = time.time() - start_time
+    process_time = time.perf_counter() - start_time
     response.headers["X-Process-Time"] = str(process_time)
+    if limit_result:
+        response.headers.update(limit_result.headers())
+    
+    # Label by route template so /users/{id} is one series/endpoint, not one per id
+    # Unmatched paths (404 probes, typos) share one label
+    route = getattr(request.scope.get("route"), "path", None) or UNMATCHED_ROUTE
+    record_request(route, request.method, response.status_code, start_time)
+    if settings.sql_profiling_enabled:
+        response.headers.update(sql_profiler.finish(
+            profile, profile_token, request.method, route,
+            response.status_code, process_time * 1000
+        ))
+    
+    if caller and route == UNMATCHED_ROUTE:
+        # Nothing was served: the quota is given back and no usage recorded (the minute limit still counts)
+        await quota_counter.refund(caller.id, cost)
+    elif caller:
+        UsageService().log_usage(
+            user_id=caller.id,
+            endpoint=route,
+            method=request.method,
+            status_code=response.status_code,
+            response_time_ms=process_time * 1000
+        )
     
     return response
 
@@ -74,6 +217,7 @@ async def usage_tracking_middleware(request: Request, call_next):
 app.include_router(auth.router, prefix="/auth", tags=["authentication"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(admin.router, prefix="/admin", tags=["admin"])
+app.include_router(billing.router, prefix="/billing", tags=["billing"])
 
 
 @app.get("/")
@@ -90,7 +234,21 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint (keep it on an internal network)"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/protected")
 async def protected_endpoint(current_user: User = Depends(get_current_active_user)):
     """Example of a protected endpoint"""
     return {"message": "This is a protected endpoint"}
+
+
+# Route templates -> routes, for pricing a request before it is routed
+routes_by_path = {}
+for route in app.router.routes:
+    routes_by_path.setdefault(getattr(route, "path", None), []).append(route)
@@ -1,115 +1,248 @@
+import asyncio
+import json
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
-from sqlalchemy.orm import Session
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.models import User, Subscription, SubscriptionPlan
-import stripe
 from app.core.config import settings
+from app.core.principals import principal_cache
+from app.services.outbox import RetryLater, after_commit, billing_worker, enqueue, record_webhook
+
+# Period of a new subscription until Stripe's customer.subscription.updated sets the real one
+SUBSCRIPTION_PERIOD = timedelta(days=30)
+
+# Statuses that still grant the plan until the period (plus grace) runs out
+LIVE_STATUSES = ("active", "past_due")
+
+
+@lru_cache(maxsize=1)
+def stripe_api():
+    """The Stripe SDK, imported and configured on first use (the import alone takes ~0.5s)"""
+    import stripe
+    if settings.stripe_api_key:
+        stripe.api_key = settings.stripe_api_key
+    if settings.stripe_api_base:
+        # e.g. a local stripe-mock server in development
+        stripe.api_base = settings.stripe_api_base
+    return stripe
+
+
+def construct_event(payload: bytes, signature: Optional[str]) -> dict:
+    """Parse a webhook body after verifying its signature; unsigned webhooks are never accepted"""
+    if not settings.stripe_webhook_secret:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Webhooks are disabled: STRIPE_WEBHOOK_SECRET is not configured"
+        )
+    if not signature:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid webhook: missing signature")
+    stripe = stripe_api()
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode("utf-8"), signature, settings.stripe_webhook_secret, stripe.Webhook.DEFAULT_TOLERANCE
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid webhook: {e}")
+    try:
+        event = json.loads(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid webhook: {e}")
+    if not isinstance(event, dict) or not event.get("id"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid webhook: missing event id")
+    return event
 
 
 class BillingService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        if settings.stripe_api_key:
-            stripe.api_key = settings.stripe_api_key
     
-    def create_stripe_customer(self, user: User) -> Optional[str]:
-        """Create a Stripe customer for the user"""
-        if not settings.stripe_api_key:
-            return None
-        
-        try:
-            customer = stripe.Customer.create(
-                email=user.email,
-                name=user.username,
-                metadata={"user_id": user.id}
-            )
-            return customer.id
-        except Exception as e:
-            print(f"Error creating Stripe customer: {e}")
-            return None
+    async def _get_user(self, **criteria) -> Optional[User]:
+        result = await self.db.scalars(select(User).filter_by(**criteria))
+        return result.first()
     
-    def create_subscription(self, user_id: int, plan: SubscriptionPlan) -> bool:
-        """Create a subscription for a user"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return False
-        
-        # Create Stripe customer if doesn't exist
-        if not user.stripe_customer_id and settings.stripe_api_key:
-            customer_id = self.create_stripe_customer(user)
-            if customer_id:
-                user.stripe_customer_id = customer_id
-                self.db.commit()
-        
-        # Create subscription record
+    def start_subscription(self, user: User, plan: SubscriptionPlan) -> Subscription:
+        """Add a subscription and switch the user's plan, in the caller's transaction"""
+        now = datetime.utcnow()
         subscription = Subscription(
-            user_id=user_id,
+            user_id=user.id,
             plan=plan,
             status="active",
-            current_period_start=datetime.utcnow(),
-            current_period_end=datetime.utcnow() + timedelta(days=30)
+            current_period_start=now,
+            current_period_end=now + SUBSCRIPTION_PERIOD
         )
-        
         self.db.add(subscription)
-        
-        # Update user's subscription plan
         user.subscription_plan = plan
+        return subscription
+    
+    def end_subscription(self, user: Optional[User], subscription: Subscription):
+        """Cancel a subscription and downgrade its user, in the caller's transaction"""
+        subscription.status = "canceled"
+        subscription.current_period_end = datetime.utcnow()
+        if user:
+            user.subscription_plan = SubscriptionPlan.FREE
+    
+    async def create_subscription(
+        self, user_id: int, plan: SubscriptionPlan, current_period_end: Optional[datetime] = None
+    ) -> bool:
+        """Create a locally managed subscription; without a current_period_end it lasts until canceled"""
+        user = await self._get_user(id=user_id)
+        if not user:
+            return False
         
-        self.db.commit()
+        # Stripe customer is created by the billing worker, committed together with the subscription
+        queued = not user.stripe_customer_id and bool(settings.stripe_api_key)
+        if queued:
+            enqueue(self.db, "create_customer", {"user_id": user.id})
+        
+        subscription = self.start_subscription(user, plan)
+        # The sweeper never expires a subscription with no period end
+        subscription.current_period_end = current_period_end
+        await self.db.commit()
+        await principal_cache.invalidate(user.username)
+        if queued:
+            billing_worker.notify()
         return True
     
-    def cancel_subscription(self, user_id: int) -> bool:
+    async def cancel_subscription(self, user_id: int) -> bool:
         """Cancel a user's subscription"""
-        subscription = self.db.query(Subscription).filter(
-            Subscription.user_id == user_id,
-            Subscription.status == "active"
-        ).first()
+        subscription = await self.get_user_subscription(user_id)
         
         if not subscription:
             return False
         
-        subscription.status = "canceled"
-        subscription.current_period_end = datetime.utcnow()
-        
-        # Downgrade user to free plan
-        user = self.db.query(User).filter(User.id == user_id).first()
+        user = await self._get_user(id=user_id)
+        self.end_subscription(user, subscription)
+        await self.db.commit()
         if user:
-            user.subscription_plan = SubscriptionPlan.FREE
-        
-        self.db.commit()
+            await principal_cache.invalidate(user.username)
         return True
     
-    def get_user_subscription(self, user_id: int) -> Optional[Subscription]:
-        """Get active subscription for a user"""
-        return self.db.query(Subscription).filter(
-            Subscription.user_id == user_id,
-            Subscription.status == "active"
-        ).first()
+    async def get_user_subscription(self, user_id: int) -> Optional[Subscription]:
+        """Get the live (active or past due) subscription for a user"""
+        result = await self.db.scalars(
+            select(Subscription).where(
+                Subscription.user_id == user_id,
+                Subscription.status.in_(LIVE_STATUSES)
+            )
+        )
+        return result.first()
     
-    def handle_stripe_webhook(self, event_data: dict) -> bool:
-        """Handle Stripe webhook events"""
-        event_type = event_data.get("type")
-        
-        if event_type == "customer.subscription.created":
-            subscription_data = event_data["data"]["object"]
-            customer_id = subscription_data["customer"]
-            
-            user = self.db.query(User).filter(
-                User.stripe_customer_id == customer_id
-            ).first()
-            
-            if user:
-                self.create_subscription(user.id, SubscriptionPlan.PRO)
-        
-        elif event_type == "customer.subscription.deleted":
-            subscription_data = event_data["data"]["object"]
-            customer_id = subscription_data["customer"]
-            
-            user = self.db.query(User).filter(
-                User.stripe_customer_id == customer_id
-            ).first()
-            
-            if user:
-                self.cancel_subscription(user.id)
-        
-        return True
+    async def handle_stripe_webhook(self, event_data: dict) -> bool:
+        """Store a webhook event for the billing worker; returns False for a redelivered event"""
+        created = await record_webhook(self.db, event_data)
+        await self.db.commit()
+        if created:
+            billing_worker.notify()
+        return created
+
+
+@billing_worker.outbox_handler("create_customer")
+async def create_stripe_customer(db: AsyncSession, payload: dict, idempotency_key: str):
+    """Create the Stripe customer for a user; retried by the worker with the same idempotency key"""
+    user = await db.get(User, payload["user_id"])
+    if user is None or user.stripe_customer_id:
+        return
+    # The Stripe client is blocking (and slow to import); keep it off the event loop
+    stripe = await asyncio.to_thread(stripe_api)
+    customer = await asyncio.to_thread(
+        stripe.Customer.create,
+        email=user.email,
+        name=user.username,
+        metadata={"user_id": user.id},
+        idempotency_key=idempotency_key,
+    )
+    user.stripe_customer_id = customer.id
+
+
+def event_time(event: dict) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(event["created"]) if event.get("created") else None
+
+
+def is_stale(subscription: Subscription, event: dict) -> bool:
+    """Stripe delivers events out of order; never let an older one undo a newer one"""
+    created = event_time(event)
+    return created is not None and subscription.stripe_event_at is not None and created < subscription.stripe_event_at
+
+
+async def get_stripe_subscription(db: AsyncSession, stripe_subscription_id: str) -> Subscription:
+    """The subscription a webhook is about, locked; retried until its created event has been applied"""
+    subscription = (await db.scalars(
+        select(Subscription).where(Subscription.stripe_subscription_id == stripe_subscription_id).with_for_update()
+    )).first()
+    if subscription is None:
+        raise RetryLater(f"Subscription {stripe_subscription_id} has not been created yet")
+    return subscription
+
+
+async def still_subscribed(db: AsyncSession, user_id: int) -> bool:
+    return (await db.scalars(
+        select(Subscription.id).where(Subscription.user_id == user_id, Subscription.status.in_(LIVE_STATUSES))
+    )).first() is not None
+
+
+@billing_worker.webhook_handler("customer.subscription.created")
+async def subscription_created(db: AsyncSession, event: dict, event_id: str):
+    data = event["data"]["object"]
+    service = BillingService(db)
+    user = await service._get_user(stripe_customer_id=data["customer"])
+    if not user:
+        return
+    # State changes commit with the inbox row, so a retried event never applies twice
+    subscription = (await db.scalars(
+        select(Subscription).where(Subscription.stripe_subscription_id == data["id"]).with_for_update()
+    )).first()
+    if subscription is None:
+        # Link an unlinked live subscription (an admin grant being moved to Stripe), else start one
+        subscription = (await db.scalars(
+            select(Subscription).where(
+                Subscription.user_id == user.id,
+                Subscription.status.in_(LIVE_STATUSES),
+                Subscription.stripe_subscription_id.is_(None),
+            )
+        )).first()
+        if subscription is None:
+            subscription = service.start_subscription(user, SubscriptionPlan.PRO)
+            username = user.username
+            after_commit(db, lambda: principal_cache.invalidate(username))
+    elif is_stale(subscription, event):
+        return
+    # The metered price's item is what usage records are reported against
+    items = data.get("items", {}).get("data", [])
+    subscription.stripe_subscription_id = data["id"]
+    subscription.stripe_subscription_item_id = items[0]["id"] if items else None
+    subscription.stripe_event_at = event_time(event)
+
+
+@billing_worker.webhook_handler("customer.subscription.updated")
+async def subscription_updated(db: AsyncSession, event: dict, event_id: str):
+    """Renewals move the period forward; the subscription sweeper expires ones never renewed"""
+    data = event["data"]["object"]
+    subscription = await get_stripe_subscription(db, data["id"])
+    if is_stale(subscription, event) or subscription.status not in LIVE_STATUSES:
+        return
+    if data.get("current_period_start"):
+        subscription.current_period_start = datetime.utcfromtimestamp(data["current_period_start"])
+    if data.get("current_period_end"):
+        subscription.current_period_end = datetime.utcfromtimestamp(data["current_period_end"])
+    if data.get("status") in LIVE_STATUSES:
+        subscription.status = data["status"]
+    subscription.stripe_event_at = event_time(event) or subscription.stripe_event_at
+
+
+@billing_worker.webhook_handler("customer.subscription.deleted")
+async def subscription_deleted(db: AsyncSession, event: dict, event_id: str):
+    """Cancel the subscription the event names; the user keeps PRO while another one is live"""
+    subscription = await get_stripe_subscription(db, event["data"]["object"]["id"])
+    if is_stale(subscription, event) or subscription.status not in LIVE_STATUSES:
+        return
+    user = await db.get(User, subscription.user_id)
+    BillingService(db).end_subscription(None, subscription)
+    subscription.stripe_event_at = event_time(event) or subscription.stripe_event_at
+    await db.flush()
+    if user and not await still_subscribed(db, user.id):
+        user.subscription_plan = SubscriptionPlan.FREE
+        username = user.username
+        after_commit(db, lambda: principal_cache.invalidate(username))
@@ -0,0 +1,104 @@
+import csv
+import enum
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from sqlalchemy import select
+from app.db.models import UsageLog
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+
+EXPORT_COLUMNS = ("id", "user_id", "endpoint", "method", "status_code", "timestamp", "response_time_ms")
+
+# Low-cardinality string columns are dictionary-encoded in the columnar format
+DICTIONARY_COLUMNS = ("endpoint", "method")
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+    COLUMNAR = "columnar"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.COLUMNAR: "application/x-ndjson",
+}
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _ndjson(rows) -> str:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, map(_value, row))), separators=(",", ":")) + "\n"
+        for row in rows
+    )
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def _columnar(rows) -> str:
+    """One JSON line per chunk holding column arrays, like a row group in Parquet"""
+    columns = {name: [_value(value) for value in values] for name, values in zip(EXPORT_COLUMNS, zip(*rows))}
+    for name in DICTIONARY_COLUMNS:
+        dictionary = {}
+        codes = [dictionary.setdefault(value, len(dictionary)) for value in columns[name]]
+        columns[name] = {"dictionary": list(dictionary), "codes": codes}
+    return json.dumps({"rows": len(rows), "columns": columns}, separators=(",", ":")) + "\n"
+
+
+def _header(export_format: ExportFormat) -> str:
+    if export_format == ExportFormat.CSV:
+        return ",".join(EXPORT_COLUMNS) + "\r\n"
+    if export_format == ExportFormat.COLUMNAR:
+        return json.dumps(
+            {"columns": EXPORT_COLUMNS, "dictionary_encoded": DICTIONARY_COLUMNS}, separators=(",", ":")
+        ) + "\n"
+    return ""
+
+
+ENCODERS = {
+    ExportFormat.NDJSON: _ndjson,
+    ExportFormat.CSV: _csv,
+    ExportFormat.COLUMNAR: _columnar,
+}
+
+
+async def export_usage(
+    export_format: ExportFormat,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    endpoint: Optional[str] = None,
+    chunk_size: Optional[int] = None
+) -> AsyncIterator[str]:
+    """Stream usage logs in id order; memory use is bounded by chunk_size rows"""
+    query = select(*(getattr(UsageLog, name) for name in EXPORT_COLUMNS)).order_by(UsageLog.id)
+    if start is not None:
+        query = query.where(UsageLog.timestamp >= start)
+    if end is not None:
+        query = query.where(UsageLog.timestamp < end)
+    if user_id is not None:
+        query = query.where(UsageLog.user_id == user_id)
+    if endpoint is not None:
+        query = query.where(UsageLog.endpoint == endpoint)
+    
+    encode = ENCODERS[export_format]
+    header = _header(export_format)
+    if header:
+        yield header
+    
+    # Own session: the response body is produced after the request's dependencies are done
+    async with AsyncSessionLocal() as db:
+        # Server-side cursor; rows arrive in chunks of yield_per and are never all held at once
+        result = await db.stream(query.execution_options(yield_per=chunk_size or settings.usage_export_chunk_size))
+        async for rows in result.partitions():
+            yield encode(rows)
@@ -0,0 +1,140 @@
+import json
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import User
+from app.core.config import settings
+from app.services.retention import usage_retention
+from app.services.usage import UsageRecord, write_usage
+
+EVENT_FIELDS = ("user_id", "endpoint", "method", "status_code", "timestamp", "response_time_ms")
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+MAX_ENDPOINT_LENGTH = 2048
+MAX_REPORTED_ERRORS = 100
+
+# Gateways' clocks may run slightly ahead of ours
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+def parse_events(body: bytes, content_type: str) -> list:
+    """Decode a JSON array, or NDJSON (one event per line)"""
+    try:
+        if content_type.startswith(("application/x-ndjson", "application/jsonl")):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        events = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Malformed event payload: {e}"
+        )
+    if not isinstance(events, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a JSON array of usage events"
+        )
+    return events
+
+
+def _parse_timestamp(value, now: datetime):
+    """Naive UTC datetime, like the rest of usage_logs; None if unusable"""
+    if value is None:
+        return now
+    if not isinstance(value, str):
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_events(events: list) -> Tuple[List[UsageRecord], List[dict], set]:
+    """Check a batch column by column; returns (records, errors, user_ids to verify)"""
+    errors: List[dict] = []
+    
+    def reject(indexes, field, message):
+        errors.extend({"index": index, "field": field, "error": message} for index in indexes)
+    
+    reject([i for i, event in enumerate(events) if not isinstance(event, dict)], None, "event must be an object")
+    if errors:
+        return [], errors, set()
+    
+    columns = {field: [event.get(field) for event in events] for field in EVENT_FIELDS}
+    unknown = {key for event in events for key in event} - set(EVENT_FIELDS)
+    if unknown:
+        reject([i for i, event in enumerate(events) if unknown & event.keys()], None, "unknown field")
+    
+    reject([i for i, value in enumerate(columns["user_id"]) if not _is_int(value)],
+           "user_id", "must be an integer")
+    reject([i for i, value in enumerate(columns["endpoint"])
+            if not isinstance(value, str) or not value.startswith("/") or len(value) > MAX_ENDPOINT_LENGTH],
+           "endpoint", f"must be a path starting with / (at most {MAX_ENDPOINT_LENGTH} characters)")
+    reject([i for i, value in enumerate(columns["method"]) if value not in HTTP_METHODS],
+           "method", "must be an upper-case HTTP method")
+    reject([i for i, value in enumerate(columns["status_code"]) if not _is_int(value) or not 100 <= value <= 599],
+           "status_code", "must be an HTTP status code")
+    reject([i for i, value in enumerate(columns["response_time_ms"])
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0)],
+           "response_time_ms", "must be a non-negative number or null")
+    
+    now = datetime.utcnow()
+    timestamps = [_parse_timestamp(value, now) for value in columns["timestamp"]]
+    reject([i for i, value in enumerate(timestamps) if value is None],
+           "timestamp", "must be an ISO 8601 datetime")
+    reject([i for i, value in enumerate(timestamps) if value is not None and value > now + MAX_CLOCK_SKEW],
+           "timestamp", "is in the future")
+    # Older events would fail the whole COPY (no partition to go to) or be deleted by retention
+    earliest = usage_retention.earliest_timestamp(now)
+    if earliest is not None:
+        reject([i for i, value in enumerate(timestamps) if value is not None and value < earliest],
+               "timestamp", f"is older than the earliest storable time ({earliest.isoformat()})")
+    
+    if errors:
+        return [], errors, set()
+    records = [
+        UsageRecord(user_id, endpoint, method, status_code, timestamp,
+                    None if response_time is None else float(response_time))
+        for user_id, endpoint, method, status_code, timestamp, response_time in zip(
+            columns["user_id"], columns["endpoint"], columns["method"],
+            columns["status_code"], timestamps, columns["response_time_ms"]
+        )
+    ]
+    return records, errors, set(columns["user_id"])
+
+
+async def ingest_usage(db: AsyncSession, events: list) -> int:
+    """Validate and store a batch of usage events; all or nothing"""
+    if len(events) > settings.usage_ingest_max_events:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.usage_ingest_max_events} events per request"
+        )
+    
+    records, errors, user_ids = validate_events(events)
+    if not errors and user_ids:
+        known = set(await db.scalars(select(User.id).where(User.id.in_(user_ids))))
+        missing = user_ids - known
+        if missing:
+            errors = [
+                {"index": i, "field": "user_id", "error": "unknown user"}
+                for i, record in enumerate(records) if record.user_id in missing
+            ]
+    
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"invalid_events": len({error["index"] for error in errors}), "errors": errors[:MAX_REPORTED_ERRORS]}
+        )
+    
+    if records:
+        await write_usage(db, records)
+        await db.commit()
+    return len(records)
@@ -0,0 +1,261 @@
+import asyncio
+import calendar
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import bindparam, case, func, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import Subscription, UsageReport, UsageRollup
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+from app.services.billing import LIVE_STATUSES, stripe_api
+from app.services.rollups import ALL_ENDPOINTS, bucket_start
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+WINDOW_LENGTHS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+
+def capture_statement(dialect_name: str, window: str, window_start: datetime):
+    """INSERT ... SELECT of one window's per-user totals; re-captures reset changed rows to pending"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Metered billing does not support the '{dialect_name}' dialect")
+
+    # One subscription per user (the newest live one), so a user never yields two rows
+    # for the same (user_id, window_start) conflict target
+    billed = (
+        select(func.max(Subscription.id).label("id"))
+        .where(
+            Subscription.status.in_(LIVE_STATUSES),
+            Subscription.stripe_subscription_item_id.isnot(None),
+        )
+        .group_by(Subscription.user_id)
+        .subquery()
+    )
+    totals = (
+        select(
+            UsageRollup.user_id,
+            UsageRollup.bucket_start,
+            Subscription.stripe_subscription_item_id,
+            UsageRollup.request_count,
+            literal(PENDING),
+            literal(0),
+        )
+        .join(Subscription, Subscription.user_id == UsageRollup.user_id)
+        .join(billed, billed.c.id == Subscription.id)
+        .where(
+            UsageRollup.period == window,
+            UsageRollup.endpoint == ALL_ENDPOINTS,
+            UsageRollup.bucket_start == window_start,
+        )
+    )
+    table = UsageReport.__table__
+    stmt = insert(table).from_select(
+        ["user_id", "window_start", "subscription_item_id", "quantity", "status", "attempts"], totals
+    )
+    excluded = stmt.excluded
+    # Late usage for an already reported window: report the new total again ("set" semantics)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "window_start"],
+        set_={"quantity": excluded.quantity, "status": PENDING, "attempts": 0, "last_error": None},
+        where=table.c.quantity != excluded.quantity,
+    )
+
+
+def send_usage_record(record: dict) -> None:
+    """One usage record per customer per window; the key makes a resend of the same total a no-op"""
+    stripe_api().SubscriptionItem.create_usage_record(
+        record["subscription_item_id"],
+        quantity=record["quantity"],
+        timestamp=calendar.timegm(record["window_start"].utctimetuple()),
+        action="set",
+        idempotency_key=f"usage-{record['user_id']}-{record['window_start']:%Y%m%d%H}-{record['quantity']}",
+    )
+
+
+class MeteredUsageReporter:
+    """Reports per-customer usage for closed billing windows to the billing provider on a schedule
+
+    Each run captures closed windows from the usage rollups into usage_reports with one
+    INSERT ... SELECT per window, then sends pending rows in keyset-ordered chunks with
+    bounded concurrency, marking each chunk's outcome with a single executemany UPDATE.
+    In dry-run mode everything happens in a transaction that is rolled back and
+    nothing is sent.
+    """
+
+    def __init__(self, window: str, lookback_windows: int, batch_size: int, concurrency: int,
+                 max_attempts: int, interval: float, dry_run: bool, sender=send_usage_record):
+        if window not in WINDOW_LENGTHS:
+            raise ValueError(f"metered_billing_window must be one of {tuple(WINDOW_LENGTHS)}")
+        self.window = window
+        self.lookback_windows = lookback_windows
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.dry_run = dry_run
+        self.sender = sender
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_result: Optional[dict] = None
+
+    def closed_windows(self, newest_captured: Optional[datetime], now: datetime) -> List[datetime]:
+        """Closed windows to (re)capture: the recent lookback, plus any gap since the last run"""
+        length = WINDOW_LENGTHS[self.window]
+        last_closed = bucket_start(now, self.window) - length
+        first = last_closed - length * (self.lookback_windows - 1)
+        if newest_captured is not None and newest_captured < first:
+            first = newest_captured
+        windows = []
+        while first <= last_closed:
+            windows.append(first)
+            first += length
+        return windows
+
+    async def capture(self, db: AsyncSession, now: datetime) -> List[datetime]:
+        newest = await db.scalar(select(func.max(UsageReport.window_start)))
+        windows = self.closed_windows(newest, now)
+        for window_start in windows:
+            await db.execute(capture_statement(db.bind.dialect.name, self.window, window_start))
+        return windows
+
+    async def _send_chunk(self, records: List[dict]) -> Tuple[List[dict], List[dict]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        sent, failed = [], []
+
+        async def send(record):
+            async with semaphore:
+                try:
+                    # The Stripe client is blocking; keep it off the event loop
+                    await asyncio.to_thread(self.sender, record)
+                    sent.append({"rid": record["id"], "q": record["quantity"]})
+                except Exception as e:
+                    failed.append({"rid": record["id"], "error": f"{type(e).__name__}: {e}"})
+
+        await asyncio.gather(*(send(record) for record in records))
+        return sent, failed
+
+    def _pending(self, after_id: int):
+        return (
+            select(
+                UsageReport.id, UsageReport.user_id, UsageReport.window_start,
+                UsageReport.subscription_item_id, UsageReport.quantity,
+            )
+            .where(UsageReport.status == PENDING, UsageReport.id > after_id)
+            .order_by(UsageReport.id)
+            .limit(self.batch_size)
+        )
+
+    async def run_once(self, now: Optional[datetime] = None, dry_run: Optional[bool] = None) -> dict:
+        now = now or datetime.utcnow()
+        dry_run = self.dry_run if dry_run is None else dry_run
+        result = {"dry_run": dry_run, "windows": [], "records": 0, "quantity": 0, "sent": 0, "failed": 0}
+        started = datetime.utcnow()
+
+        async with AsyncSessionLocal() as db:
+            result["windows"] = await self.capture(db, now)
+            if dry_run:
+                totals = (await db.execute(
+                    select(func.count(), func.coalesce(func.sum(UsageReport.quantity), 0))
+                    .where(UsageReport.status == PENDING)
+                )).one()
+                result["records"], result["quantity"] = totals
+                await db.rollback()
+                return self._finish(result, started)
+            await db.commit()
+
+        table = UsageReport.__table__
+        mark_sent = (
+            update(table)
+            # A re-capture may have changed the quantity meanwhile; that row stays pending
+            .where(table.c.id == bindparam("rid"), table.c.quantity == bindparam("q"))
+            .values(status=SENT, reported_quantity=bindparam("q"), reported_at=now)
+        )
+        mark_failed = (
+            update(table)
+            .where(table.c.id == bindparam("rid"))
+            .values(
+                attempts=table.c.attempts + 1,
+                last_error=bindparam("error"),
+                status=case((table.c.attempts + 1 >= self.max_attempts, FAILED), else_=PENDING),
+            )
+        )
+
+        after_id = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                records = [row._asdict() for row in (await db.execute(self._pending(after_id))).all()]
+            if not records:
+                break
+            after_id = records[-1]["id"]
+            sent, failed = await self._send_chunk(records)
+            async with AsyncSessionLocal() as db:
+                if sent:
+                    await db.execute(mark_sent, sent)
+                if failed:
+                    await db.execute(mark_failed, failed)
+                await db.commit()
+            result["records"] += len(records)
+            result["quantity"] += sum(record["quantity"] for record in records)
+            result["sent"] += len(sent)
+            result["failed"] += len(failed)
+
+        return self._finish(result, started)
+
+    def _finish(self, result: dict, started: datetime) -> dict:
+        result["windows"] = [window.isoformat() for window in result["windows"]]
+        result["elapsed_seconds"] = round((datetime.utcnow() - started).total_seconds(), 3)
+        self.last_run_at = datetime.utcnow()
+        self.last_result = result
+        return result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Error reporting metered usage")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "dry_run": self.dry_run,
+            "last_run_at": self.last_run_at,
+            "last_result": self.last_result,
+        }
+
+
+metered_usage_reporter = MeteredUsageReporter(
+    window=settings.metered_billing_window,
+    lookback_windows=settings.metered_billing_lookback_windows,
+    batch_size=settings.metered_billing_batch_size,
+    concurrency=settings.metered_billing_concurrency,
+    max_attempts=settings.metered_billing_max_attempts,
+    interval=settings.metered_billing_interval_seconds,
+    dry_run=settings.metered_billing_dry_run,
+)
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import OutboxMessage, WebhookEvent
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+# handler(db, payload, idempotency_key); runs inside the session that marks the message done
+Handler = Callable[[AsyncSession, dict, str], Awaitable[None]]
+
+
+class RetryLater(Exception):
+    """Raised by a handler whose event depends on one not applied yet; retried with backoff"""
+
+
+def after_commit(db: AsyncSession, callback: Callable[[], Awaitable[None]]):
+    """Run callback once the worker has committed the handler's transaction (e.g. cache invalidation)"""
+    db.info.setdefault("after_commit", []).append(callback)
+
+
+def enqueue(db: AsyncSession, kind: str, payload: dict):
+    """Add an outbound call to the caller's transaction; sent by the billing worker after commit"""
+    db.add(OutboxMessage(kind=kind, payload=json.dumps(payload), next_attempt_at=datetime.utcnow()))
+
+
+def insert_ignore_statement(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Webhook inbox does not support the '{dialect_name}' dialect")
+    return insert(WebhookEvent).on_conflict_do_nothing(index_elements=["event_id"])
+
+
+async def record_webhook(db: AsyncSession, event: dict) -> bool:
+    """Store a webhook event once per event id; returns False for a redelivery"""
+    result = await db.execute(insert_ignore_statement(db.bind.dialect.name).values(
+        event_id=event["id"],
+        type=event.get("type", ""),
+        payload=json.dumps(event),
+        status=PENDING,
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    ))
+    return result.rowcount == 1
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before retry number `attempts`: exponential with full jitter"""
+    ceiling = min(settings.billing_retry_base_seconds * 2 ** (attempts - 1), settings.billing_retry_max_seconds)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class OutboxWorker:
+    """Delivers outbox messages and applies webhook events with a pool of concurrent tasks
+
+    Rows are claimed by pushing next_attempt_at forward by a lease (one conditional
+    UPDATE per batch, so several processes can poll the same tables); a worker that dies
+    mid-message leaves it to be picked up again once the lease runs out.
+    """
+
+    def __init__(self, concurrency: int, poll_interval: float, batch_size: int,
+                 lease_seconds: float, max_attempts: int):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.outbox_handlers: Dict[str, Handler] = {}
+        self.webhook_handlers: Dict[str, Handler] = {}
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def outbox_handler(self, kind: str):
+        def register(fn: Handler) -> Handler:
+            self.outbox_handlers[kind] = fn
+            return fn
+        return register
+
+    def webhook_handler(self, event_type: str):
+        def register(fn: Handler) -> Handler:
+            self.webhook_handlers[event_type] = fn
+            return fn
+        return register
+
+    def notify(self):
+        """Poll now instead of at the next interval (call after committing new messages)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def claim(self, model) -> List[int]:
+        """Lease up to batch_size due rows in one UPDATE; returns their ids"""
+        now = datetime.utcnow()
+        due = (
+            select(model.id)
+            .where(model.status == PENDING, model.next_attempt_at <= now)
+            .order_by(model.next_attempt_at)
+            .limit(self.batch_size)
+            # Postgres: rows another poller is claiming are skipped rather than waited on
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as db:
+            claimed = (await db.execute(
+                update(model)
+                .where(model.id.in_(due), model.status == PENDING, model.next_attempt_at <= now)
+                .values(next_attempt_at=now + timedelta(seconds=self.lease_seconds), attempts=model.attempts + 1)
+                .returning(model.id)
+                .execution_options(synchronize_session=False)
+            )).scalars().all()
+            await db.commit()
+        return list(claimed)
+
+    async def process(self, model, row_id: int):
+        handlers = self.outbox_handlers if model is OutboxMessage else self.webhook_handlers
+        async with AsyncSessionLocal() as db:
+            row = await db.get(model, row_id)
+            if row is None or row.status != PENDING:
+                return
+            kind = row.kind if model is OutboxMessage else row.type
+            handler = handlers.get(kind)
+            try:
+                if handler is not None:
+                    key = f"outbox-{row.id}" if model is OutboxMessage else row.event_id
+                    await handler(db, json.loads(row.payload), key)
+                elif model is OutboxMessage:
+                    raise ValueError(f"No outbox handler for '{kind}'")
+                # Webhook types without a handler are acknowledged and ignored
+                row.status = DONE
+                row.processed_at = datetime.utcnow()
+                row.last_error = None
+                await db.commit()
+                self.processed += 1
+                for callback in db.info.pop("after_commit", []):
+                    await callback()
+                return
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                attempts = row.attempts
+                db.info.pop("after_commit", None)
+                await db.rollback()
+
+        logger.warning("Error processing %s %s (%s): %s", model.__tablename__, row_id, kind, error)
+        async with AsyncSessionLocal() as db:
+            if attempts >= self.max_attempts:
+                values = {"status": FAILED, "last_error": error}
+                self.failed += 1
+            else:
+                values = {"next_attempt_at": datetime.utcnow() + timedelta(seconds=backoff(attempts)), "last_error": error}
+                self.retried += 1
+            await db.execute(update(model).where(model.id == row_id).values(**values))
+            await db.commit()
+
+    async def _poll(self):
+        while True:
+            try:
+                for model in (WebhookEvent, OutboxMessage):
+                    for row_id in await self.claim(model):
+                        await self._queue.put((model, row_id))
+            except Exception:
+                logger.exception("Error polling billing outbox")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _work(self):
+        while True:
+            model, row_id = await self._queue.get()
+            try:
+                await self.process(model, row_id)
+            except Exception:
+                logger.exception("Error processing %s %s", model.__tablename__, row_id)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        if self._tasks:
+            return
+        # Bounded so the poller stops claiming (and leasing) more than the pool can work through
+        self._queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._poll())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Anything claimed but not processed becomes due again when its lease expires
+        self._tasks = []
+
+    async def stats(self) -> dict:
+        counts = {}
+        async with AsyncSessionLocal() as db:
+            for model in (OutboxMessage, WebhookEvent):
+                rows = (await db.execute(
+                    select(model.status, func.count()).group_by(model.status)
+                )).all()
+                counts[model.__tablename__] = {status: count for status, count in rows}
+        return {
+            "running": bool(self._tasks),
+            "concurrency": self.concurrency,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "backlog": counts,
+        }
+
+
+billing_worker = OutboxWorker(
+    concurrency=settings.billing_worker_concurrency,
+    poll_interval=settings.billing_worker_poll_seconds,
+    batch_size=settings.billing_worker_batch_size,
+    lease_seconds=settings.billing_worker_lease_seconds,
+    max_attempts=settings.billing_worker_max_attempts,
+)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, or_, select
+from app.db.models import RefreshToken, UsageLog
+from app.db.partitions import (
+    detach_partitions_before, ensure_monthly_partitions, is_partitioned, list_partitions, month_floor
+)
+from app.db.session import async_engine
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ACTIONS = ("drop", "detach")
+
+
+class UsageRetention:
+    """Background job that keeps monthly usage_logs partitions ahead of time and expires old usage
+
+    On a partitioned Postgres table whole partitions are detached or dropped, which is
+    instant and leaves no bloat. Elsewhere (SQLite, or before the migration has run)
+    old rows are deleted in small batches so writers are never blocked for long.
+    Rollups are left alone, so lifetime stats survive raw-log retention.
+
+    The same job deletes refresh tokens that expired more than refresh_token_retention
+    ago. Spent tokens are kept until then so reuse is still detected, and revoked ones
+    for at least an access token lifetime so the revocation list can seed from them.
+    """
+
+    def __init__(self, retention_days: Optional[int], action: str, batch_size: int,
+                 premake_months: int, interval: float, refresh_token_retention: timedelta):
+        if action not in RETENTION_ACTIONS:
+            raise ValueError(f"usage_retention_action must be one of {RETENTION_ACTIONS}")
+        self.retention_days = retention_days
+        self.action = action
+        self.batch_size = batch_size
+        self.premake_months = premake_months
+        self.interval = interval
+        self.refresh_token_retention = max(
+            refresh_token_retention, timedelta(minutes=settings.access_token_expire_minutes)
+        )
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_result: Optional[dict] = None
+        self.oldest_partition: Optional[datetime] = None
+
+    def earliest_timestamp(self, now: datetime) -> Optional[datetime]:
+        """Oldest usage timestamp that can still be stored, or None when there is no bound
+
+        Older rows would be deleted on the next run, or have no partition to go to.
+        """
+        bounds = [self.oldest_partition] if self.oldest_partition is not None else []
+        if self.retention_days is not None:
+            bounds.append(now - timedelta(days=self.retention_days))
+        return max(bounds) if bounds else None
+
+    async def _partitioned(self) -> bool:
+        if async_engine.dialect.name != "postgresql":
+            return False
+        async with async_engine.connect() as conn:
+            return await conn.run_sync(is_partitioned, "usage_logs")
+
+    async def _delete_before(self, cutoff: datetime) -> int:
+        deleted = 0
+        oldest = (
+            select(UsageLog.id)
+            .where(UsageLog.timestamp < cutoff)
+            .order_by(UsageLog.id)
+            .limit(self.batch_size)
+        )
+        while True:
+            async with async_engine.begin() as conn:
+                result = await conn.execute(delete(UsageLog).where(UsageLog.id.in_(oldest)))
+            deleted += result.rowcount
+            if result.rowcount < self.batch_size:
+                return deleted
+            # Let request handlers and the usage flusher in between batches
+            await asyncio.sleep(0)
+
+    async def _delete_refresh_tokens(self, cutoff: datetime) -> int:
+        deleted = 0
+        expired = (
+            select(RefreshToken.id)
+            .where(
+                RefreshToken.expires_at < cutoff,
+                or_(RefreshToken.revoked_at.is_(None), RefreshToken.revoked_at < cutoff),
+            )
+            .order_by(RefreshToken.expires_at)
+            .limit(self.batch_size)
+        )
+        while True:
+            async with async_engine.begin() as conn:
+                result = await conn.execute(delete(RefreshToken).where(RefreshToken.id.in_(expired)))
+            deleted += result.rowcount
+            if result.rowcount < self.batch_size:
+                return deleted
+            await asyncio.sleep(0)
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.utcnow()
+        result = {"partitions_created": [], "partitions_removed": [], "rows_deleted": 0, "refresh_tokens_deleted": 0}
+        partitioned = await self._partitioned()
+        
+        if partitioned:
+            async with async_engine.begin() as conn:
+                result["partitions_created"] = await conn.run_sync(
+                    ensure_monthly_partitions, "usage_logs", now, self.premake_months + 1
+                )
+        
+        if self.retention_days is not None:
+            cutoff = now - timedelta(days=self.retention_days)
+            if partitioned:
+                # Only whole months older than the cutoff go; the boundary month is kept
+                async with async_engine.begin() as conn:
+                    result["partitions_removed"] = await conn.run_sync(
+                        detach_partitions_before, "usage_logs", month_floor(cutoff), self.action == "drop"
+                    )
+            else:
+                result["rows_deleted"] = await self._delete_before(cutoff)
+        
+        if partitioned:
+            async with async_engine.connect() as conn:
+                partitions = await conn.run_sync(list_partitions, "usage_logs")
+            self.oldest_partition = partitions[0][1] if partitions else None
+        
+        result["refresh_tokens_deleted"] = await self._delete_refresh_tokens(now - self.refresh_token_retention)
+        
+        self.last_run_at = now
+        self.last_result = result
+        return result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Error maintaining usage logs")
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # Make sure this month's partition exists before the usage flusher writes to it
+        try:
+            await self.run_once()
+        except Exception:
+            logger.exception("Error maintaining usage logs")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "retention_days": self.retention_days,
+            "action": self.action,
+            "last_run_at": self.last_run_at,
+            "last_result": self.last_result,
+        }
+
+
+usage_retention = UsageRetention(
+    retention_days=settings.usage_retention_days,
+    action=settings.usage_retention_action,
+    batch_size=settings.usage_retention_batch_size,
+    premake_months=settings.usage_partition_premake_months,
+    interval=settings.usage_maintenance_interval_seconds,
+    refresh_token_retention=timedelta(hours=settings.refresh_token_retention_hours),
+)
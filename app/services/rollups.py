@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import case, delete, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import UsageLog, UsageRollup
+
+ROLLUP_PERIODS = ("hour", "day", "month", "all")
+
+# bucket_start of the single lifetime ("all") bucket
+ALL_TIME = datetime(1970, 1, 1)
+
+# Pseudo-endpoint of the per-user total rows kept alongside the per-endpoint ones
+ALL_ENDPOINTS = "*"
+
+
+def bucket_start(timestamp: datetime, period: str) -> datetime:
+    if period == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "month":
+        return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return ALL_TIME
+
+
+def aggregate(records: Iterable) -> List[dict]:
+    """Fold usage records (anything with user_id/endpoint/timestamp/response_time_ms) into rollup rows"""
+    buckets: Dict[Tuple, list] = {}
+    for record in records:
+        response_time = record.response_time_ms
+        for period in ROLLUP_PERIODS:
+            start = bucket_start(record.timestamp, period)
+            for endpoint in (record.endpoint, ALL_ENDPOINTS):
+                key = (record.user_id, endpoint, period, start)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = [0, 0, 0.0, 0.0, record.timestamp]
+                bucket[0] += 1
+                if response_time is not None:
+                    bucket[1] += 1
+                    bucket[2] += response_time
+                    bucket[3] += response_time * response_time
+                if record.timestamp > bucket[4]:
+                    bucket[4] = record.timestamp
+    
+    # Sorted so concurrent upserts from several workers lock rows in the same order
+    return [
+        {
+            "user_id": user_id,
+            "endpoint": endpoint,
+            "period": period,
+            "bucket_start": start,
+            "request_count": count,
+            "timed_count": timed,
+            "response_time_sum": total,
+            "response_time_sum_sq": total_sq,
+            "last_request_at": last,
+        }
+        for (user_id, endpoint, period, start), (count, timed, total, total_sq, last)
+        in sorted(buckets.items(), key=lambda item: item[0])
+    ]
+
+
+def upsert_statement(dialect_name: str):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Usage rollups do not support the '{dialect_name}' dialect")
+    
+    table = UsageRollup.__table__
+    stmt = insert(table)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "endpoint", "period", "bucket_start"],
+        set_={
+            "request_count": table.c.request_count + excluded.request_count,
+            "timed_count": table.c.timed_count + excluded.timed_count,
+            "response_time_sum": table.c.response_time_sum + excluded.response_time_sum,
+            "response_time_sum_sq": table.c.response_time_sum_sq + excluded.response_time_sum_sq,
+            "last_request_at": case(
+                (table.c.last_request_at.is_(None), excluded.last_request_at),
+                (excluded.last_request_at > table.c.last_request_at, excluded.last_request_at),
+                else_=table.c.last_request_at
+            ),
+        }
+    )
+
+
+async def apply_rollups(db: AsyncSession, records: Iterable) -> int:
+    """Add a batch of usage records to the rollups inside the caller's transaction"""
+    rows = aggregate(records)
+    if rows:
+        await db.execute(upsert_statement(db.get_bind().dialect.name), rows)
+    return len(rows)
+
+
+async def rebuild_rollups(db: AsyncSession, chunk_size: int = 10000, user_id: Optional[int] = None) -> int:
+    """Recompute rollups from usage_logs (backfill after deploying, or repair)
+
+    The delete and the re-apply commit as one transaction. Writers fold their logs
+    into the rollups in the same transaction that inserts them, so holding the rollups
+    write lock means every log is either committed (and counted here) or still waiting
+    to upsert (and counted on top of the rebuilt rows once this commits), never both.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # Readers are unaffected; concurrent upserts wait for the commit below
+        await db.execute(text(f"LOCK TABLE {UsageRollup.__tablename__} IN EXCLUSIVE MODE"))
+    criteria = [UsageLog.user_id == user_id] if user_id is not None else []
+    # On SQLite this takes the database write lock, which serializes writers the same way
+    await db.execute(delete(UsageRollup).where(*[UsageRollup.user_id == user_id] if user_id is not None else []))
+    
+    processed = 0
+    last_id = 0
+    while True:
+        chunk = (await db.execute(
+            select(
+                UsageLog.id,
+                UsageLog.user_id,
+                UsageLog.endpoint,
+                UsageLog.timestamp,
+                UsageLog.response_time_ms
+            ).where(UsageLog.id > last_id, *criteria).order_by(UsageLog.id).limit(chunk_size)
+        )).all()
+        if not chunk:
+            break
+        await apply_rollups(db, chunk)
+        processed += len(chunk)
+        last_id = chunk[-1].id
+    await db.commit()
+    return processed
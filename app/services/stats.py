@@ -0,0 +1,51 @@
+from datetime import datetime
+from sqlalchemy import and_, case, func, or_, select
+from app.db.models import User, UsageRollup, SubscriptionPlan
+from app.db.session import AsyncSessionLocal
+from app.core.cache import StaleWhileRevalidate
+from app.core.config import settings
+from app.services.rollups import ALL_ENDPOINTS, bucket_start
+
+
+async def load_system_stats() -> dict:
+    """Dashboard totals with one conditional-aggregate query per table"""
+    now = datetime.utcnow()
+    today_start = bucket_start(now, "day")
+    month_start = bucket_start(now, "month")
+    
+    async with AsyncSessionLocal() as db:
+        users = (await db.execute(
+            select(
+                func.count().label("total"),
+                func.count(case((User.is_active == True, 1))).label("active"),
+                func.count(case((User.subscription_plan == SubscriptionPlan.FREE, 1))).label("free"),
+                func.count(case((User.subscription_plan == SubscriptionPlan.PRO, 1))).label("pro")
+            ).select_from(User)
+        )).one()
+        
+        # Per-user totals for today's and this month's buckets only, via the ranking index
+        usage = (await db.execute(
+            select(
+                func.coalesce(func.sum(case((UsageRollup.period == "day", UsageRollup.request_count), else_=0)), 0).label("today"),
+                func.coalesce(func.sum(case((UsageRollup.period == "month", UsageRollup.request_count), else_=0)), 0).label("month")
+            ).where(UsageRollup.endpoint == ALL_ENDPOINTS, or_(
+                and_(UsageRollup.period == "day", UsageRollup.bucket_start == today_start),
+                and_(UsageRollup.period == "month", UsageRollup.bucket_start == month_start)
+            ))
+        )).one()
+    
+    return {
+        "total_users": users.total,
+        "active_users": users.active,
+        "total_requests_today": usage.today,
+        "total_requests_this_month": usage.month,
+        "free_plan_users": users.free,
+        "pro_plan_users": users.pro,
+    }
+
+
+system_stats = StaleWhileRevalidate(
+    load_system_stats,
+    ttl=settings.admin_stats_ttl_seconds,
+    max_stale=settings.admin_stats_max_stale_seconds,
+)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import exists, select, update
+from app.db.models import Subscription, SubscriptionPlan, User
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+from app.core.principals import principal_cache
+from app.services.billing import LIVE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionSweeper:
+    """Background job acting on current_period_end, so the request path never checks subscriptions
+
+    Stripe subscriptions are renewed by the customer.subscription.updated webhook;
+    locally managed ones (admin grants) are never renewed. Any subscription still past
+    its period end once the grace period has lapsed is expired, and its user
+    downgraded to FREE; grants with no period end are never due. Each chunk is one
+    UPDATE over the (status, current_period_end) index, followed by one UPDATE of the
+    affected users and one bulk cache invalidation.
+    """
+
+    def __init__(self, batch_size: int, grace_seconds: float, interval: float):
+        self.batch_size = batch_size
+        self.grace = timedelta(seconds=grace_seconds)
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[datetime] = None
+        self.last_result: Optional[dict] = None
+
+    def _due(self, *criteria):
+        return (
+            select(Subscription.id)
+            .where(*criteria)
+            .order_by(Subscription.current_period_end)
+            .limit(self.batch_size)
+        )
+
+    async def expire(self, now: datetime) -> dict:
+        expired = downgraded = 0
+        due = self._due(
+            Subscription.status.in_(LIVE_STATUSES),
+            Subscription.current_period_end <= now - self.grace,
+        )
+        still_subscribed = exists().where(
+            Subscription.user_id == User.id, Subscription.status.in_(LIVE_STATUSES)
+        )
+        while True:
+            async with AsyncSessionLocal() as db:
+                user_ids = (await db.execute(
+                    update(Subscription)
+                    .where(Subscription.id.in_(due))
+                    .values(status="expired")
+                    .returning(Subscription.user_id)
+                    .execution_options(synchronize_session=False)
+                )).scalars().all()
+                usernames = []
+                if user_ids:
+                    usernames = (await db.execute(
+                        update(User)
+                        .where(User.id.in_(set(user_ids)), ~still_subscribed)
+                        .values(subscription_plan=SubscriptionPlan.FREE)
+                        .returning(User.username)
+                        .execution_options(synchronize_session=False)
+                    )).scalars().all()
+                await db.commit()
+            await principal_cache.invalidate_many(usernames)
+            expired += len(user_ids)
+            downgraded += len(usernames)
+            if len(user_ids) < self.batch_size:
+                return {"expired": expired, "downgraded": downgraded}
+            await asyncio.sleep(0)
+
+    async def run_once(self, now: Optional[datetime] = None) -> dict:
+        now = now or datetime.utcnow()
+        result = await self.expire(now)
+        self.last_run_at = datetime.utcnow()
+        self.last_result = result
+        return result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Error sweeping subscriptions")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"last_run_at": self.last_run_at, "last_result": self.last_result}
+
+
+subscription_sweeper = SubscriptionSweeper(
+    batch_size=settings.subscription_sweep_batch_size,
+    grace_seconds=settings.subscription_grace_seconds,
+    interval=settings.subscription_sweep_interval_seconds,
+)
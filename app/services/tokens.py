@@ -0,0 +1,112 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from fastapi import HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import RefreshToken, User
+from app.core.config import settings
+from app.core.revocation import revocation_list
+from app.core.security import create_access_token, create_refresh_token, verify_token
+
+
+def invalid_refresh_token(detail: str = "Invalid refresh token") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+class RefreshTokenService:
+    """Single-use refresh tokens, tracked by jti and grouped into families
+
+    Each login starts a family; every refresh spends the presented token and issues
+    its successor in the same family. Presenting a spent token again means it was
+    copied, so the whole family is revoked, which also cuts off its access tokens.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    def issue(self, user: User, family_id: Optional[str] = None, jti: Optional[str] = None) -> dict:
+        """Token pair for a new (or continuing) family; the caller commits"""
+        family_id = family_id or uuid.uuid4().hex
+        jti = jti or uuid.uuid4().hex
+        self.db.add(RefreshToken(
+            jti=jti,
+            family_id=family_id,
+            user_id=user.id,
+            expires_at=datetime.utcnow() + timedelta(days=settings.refresh_token_expire_days),
+        ))
+        return {
+            "access_token": create_access_token(data={"sub": user.username, "fam": family_id}),
+            "refresh_token": create_refresh_token(data={"sub": user.username, "jti": jti, "fam": family_id}),
+            "token_type": "bearer",
+        }
+
+    async def rotate(self, refresh_token: str) -> dict:
+        payload = verify_token(refresh_token, "refresh")
+        jti = payload.get("jti")
+        if jti is None:
+            # Issued before rotation existed; sign in again
+            raise invalid_refresh_token()
+
+        now = datetime.utcnow()
+        successor = uuid.uuid4().hex
+        # Spending the token is one conditional UPDATE, so two concurrent refreshes cannot both win
+        spent = (await self.db.execute(
+            update(RefreshToken)
+            .where(
+                RefreshToken.jti == jti,
+                RefreshToken.used_at.is_(None),
+                RefreshToken.revoked_at.is_(None),
+                RefreshToken.expires_at > now,
+            )
+            .values(used_at=now, replaced_by=successor)
+            .returning(RefreshToken.user_id, RefreshToken.family_id)
+            .execution_options(synchronize_session=False)
+        )).first()
+
+        if spent is None:
+            token = (await self.db.scalars(select(RefreshToken).where(RefreshToken.jti == jti))).first()
+            if token is not None and token.used_at is not None and token.revoked_at is None:
+                await self.revoke_families([token.family_id])
+                raise invalid_refresh_token("Refresh token reuse detected")
+            raise invalid_refresh_token()
+
+        user = await self.db.get(User, spent.user_id)
+        if user is None or not user.is_active:
+            await self.db.rollback()
+            raise invalid_refresh_token("User not found or inactive")
+
+        tokens = self.issue(user, family_id=spent.family_id, jti=successor)
+        await self.db.commit()
+        return tokens
+
+    async def revoke_families(self, family_ids: Iterable[str]) -> int:
+        family_ids = set(family_ids)
+        if not family_ids:
+            return 0
+        await self.db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.family_id.in_(family_ids), RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await self.db.commit()
+        await revocation_list.add(family_ids)
+        return len(family_ids)
+
+    async def revoke_user(self, user_id: int) -> int:
+        """Sign a user out everywhere: every family that can still mint access tokens"""
+        family_ids = (await self.db.execute(
+            select(RefreshToken.family_id)
+            .where(
+                RefreshToken.user_id == user_id,
+                RefreshToken.revoked_at.is_(None),
+                RefreshToken.expires_at > datetime.utcnow(),
+            )
+            .distinct()
+        )).scalars().all()
+        return await self.revoke_families(family_ids)
@@ -1,13 +1,203 @@
-from datetime import datetime
-from typing import Optional
-from sqlalchemy.orm import Session
-from app.db.models import UsageLog, User
+import asyncio
+import enum
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, List, NamedTuple, Optional, Tuple
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import UsageLog, UsageRollup, User, SubscriptionPlan
+from app.db.session import AsyncSessionLocal
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.pagination import decode_cursor, paginate
+from app.services.rollups import ALL_ENDPOINTS, ALL_TIME, apply_rollups, bucket_start
+
+logger = logging.getLogger(__name__)
+
+# Route label for requests that matched no route (404 probes, typos); never stored as usage
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class UsageSort(str, enum.Enum):
+    USER_ID = "user_id"
+    REQUESTS = "requests"
+
+
+class UsageRecord(NamedTuple):
+    user_id: int
+    endpoint: str
+    method: str
+    status_code: int
+    timestamp: datetime
+    response_time_ms: Optional[float] = None
+
+
+async def write_usage(db: AsyncSession, records: List[UsageRecord]):
+    """Bulk-insert usage records and fold them into the rollups, in the caller's transaction"""
+    if db.get_bind().dialect.name == "postgresql":
+        # COPY is several times faster than a multi-row INSERT for large batches
+        connection = await db.connection()
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            UsageLog.__tablename__,
+            columns=UsageRecord._fields,
+            records=[
+                record._replace(timestamp=record.timestamp.replace(tzinfo=timezone.utc))
+                for record in records
+            ]
+        )
+    else:
+        await db.execute(insert(UsageLog), [record._asdict() for record in records])
+    # Rollups commit with the raw rows so they never drift from usage_logs
+    await apply_rollups(db, records)
+
+
+class UsageBuffer:
+    """Bounded in-process queue of usage records, bulk-inserted by a background flusher"""
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Deque[UsageRecord] = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.last_flush_at: Optional[datetime] = None
+
+    def push(self, record: UsageRecord) -> bool:
+        """Queue a record without blocking; returns False if it was dropped"""
+        with self._lock:
+            accepted = len(self._queue) < self.max_size
+            if accepted:
+                self._queue.append(record)
+                self.enqueued += 1
+            else:
+                self.dropped += 1
+            depth = len(self._queue)
+
+        # Wake the flusher early once a full batch is waiting (or we are shedding load)
+        if depth >= self.batch_size or not accepted:
+            self._notify()
+        return accepted
+
+    def _notify(self):
+        if self._loop is None or self._wakeup is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    def _take_batch(self) -> List[UsageRecord]:
+        with self._lock:
+            count = min(self.batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _requeue(self, batch: List[UsageRecord]):
+        with self._lock:
+            room = self.max_size - len(self._queue)
+            keep = batch[:max(room, 0)]
+            self.dropped += len(batch) - len(keep)
+            self._queue.extendleft(reversed(keep))
+
+    async def _write_batch(self, batch: List[UsageRecord]):
+        async with AsyncSessionLocal() as db:
+            await write_usage(db, batch)
+            await db.commit()
+
+    async def flush(self) -> int:
+        """Write out everything currently queued, one bulk INSERT per batch"""
+        written = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                break
+            try:
+                await self._write_batch(batch)
+            except Exception:
+                logger.exception("Error flushing usage logs")
+                self.failed_batches += 1
+                self._requeue(batch)
+                break
+            written += len(batch)
+            self.flushed += len(batch)
+            self.last_flush_at = datetime.utcnow()
+        return written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and drain whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self._loop = None
+        self._wakeup = None
+
+    def stats(self) -> dict:
+        now = datetime.utcnow()
+        with self._lock:
+            pending = len(self._queue)
+            oldest = self._queue[0].timestamp if pending else None
+            lagging = sum(
+                1 for record in self._queue
+                if (now - record.timestamp).total_seconds() > self.flush_interval
+            )
+        return {
+            "pending": pending,
+            "lagging": lagging,
+            "oldest_pending_age_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+            "last_flush_at": self.last_flush_at,
+        }
+
+
+usage_buffer = UsageBuffer(
+    max_size=settings.usage_queue_max_size,
+    batch_size=settings.usage_flush_batch_size,
+    flush_interval=settings.usage_flush_interval_seconds,
+)
+registry.gauge("usage_queue_pending", "Usage records waiting to be written", lambda: len(usage_buffer._queue))
+registry.gauge("usage_queue_dropped", "Usage records dropped because the queue was full", lambda: usage_buffer.dropped)
 
 
 class UsageService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Optional[AsyncSession] = None):
         self.db = db
-    
+
     def log_usage(
         self,
         user_id: int,
@@ -15,34 +205,154 @@ class UsageService:
         method: str,
         status_code: int,
         response_time_ms: Optional[float] = None
-    ):
-        """Log API usage for tracking and billing"""
-        usage_log = UsageLog(
+    ) -> bool:
+        """Queue API usage for tracking and billing; written in batches by the flusher"""
+        return usage_buffer.push(UsageRecord(
             user_id=user_id,
             endpoint=endpoint,
             method=method,
             status_code=status_code,
             timestamp=datetime.utcnow(),
             response_time_ms=response_time_ms
-        )
+        ))
+
+    async def get_usage_summary(self, user_id: int) -> dict:
+        """Lifetime and current-month totals for a user, read from the rollups"""
+        lifetime = (await self.db.execute(
+            select(
+                UsageRollup.endpoint,
+                UsageRollup.request_count,
+                UsageRollup.timed_count,
+                UsageRollup.response_time_sum
+            ).where(
+                UsageRollup.user_id == user_id,
+                UsageRollup.period == "all",
+                UsageRollup.bucket_start == ALL_TIME
+            )
+        )).all()
         
-        self.db.add(usage_log)
-        self.db.commit()
+        requests_this_month = await self.db.scalar(
+            select(UsageRollup.request_count).where(
+                UsageRollup.user_id == user_id,
+                UsageRollup.endpoint == ALL_ENDPOINTS,
+                UsageRollup.period == "month",
+                UsageRollup.bucket_start == bucket_start(datetime.utcnow(), "month")
+            )
+        ) or 0
         
-        return usage_log
-    
-    def get_user_usage(self, user_id: int, limit: int = 100):
-        """Get recent usage logs for a specific user"""
-        return self.db.query(UsageLog).filter(
-            UsageLog.user_id == user_id
-        ).order_by(
-            UsageLog.timestamp.desc()
-        ).limit(limit).all()
-    
-    def get_endpoint_usage(self, endpoint: str, limit: int = 100):
-        """Get recent usage logs for a specific endpoint"""
-        return self.db.query(UsageLog).filter(
-            UsageLog.endpoint == endpoint
-        ).order_by(
-            UsageLog.timestamp.desc()
-        ).limit(limit).all()
+        total = next((row for row in lifetime if row.endpoint == ALL_ENDPOINTS), None)
+        # Rows recorded for unmatched paths before they stopped being stored are not an endpoint
+        per_endpoint = [row for row in lifetime if row.endpoint not in (ALL_ENDPOINTS, UNMATCHED_ROUTE)]
+        most_used = max(per_endpoint, key=lambda row: (row.request_count, row.endpoint), default=None)
+        return {
+            "total_requests": total.request_count if total else 0,
+            "requests_this_month": requests_this_month,
+            "most_used_endpoint": most_used.endpoint if most_used else "N/A",
+            "average_response_time": total.response_time_sum / total.timed_count if total and total.timed_count else 0.0,
+        }
+
+    async def list_user_usage(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        plan: Optional[SubscriptionPlan] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        sort: UsageSort = UsageSort.USER_ID
+    ) -> Tuple[List[dict], Optional[str]]:
+        """A page of per-user totals from the rollups; returns (rows, next_cursor)
+        
+        Totals are lifetime unless start/end are given, in which case whole days from
+        start's day up to end are counted. Sorting by requests (busiest first) only
+        lists users with recorded usage in that range.
+        """
+        if start is None and end is None:
+            # One lifetime row per user: no grouping, so the ranking index gives the order
+            totals = select(
+                UsageRollup.user_id,
+                UsageRollup.request_count.label("total_requests"),
+                UsageRollup.last_request_at.label("last_request")
+            ).where(
+                UsageRollup.endpoint == ALL_ENDPOINTS,
+                UsageRollup.period == "all",
+                UsageRollup.bucket_start == ALL_TIME
+            )
+        else:
+            buckets = [UsageRollup.period == "day"]
+            if start is not None:
+                buckets.append(UsageRollup.bucket_start >= bucket_start(start, "day"))
+            if end is not None:
+                buckets.append(UsageRollup.bucket_start < end)
+            totals = select(
+                UsageRollup.user_id,
+                func.sum(UsageRollup.request_count).label("total_requests"),
+                func.max(UsageRollup.last_request_at).label("last_request")
+            ).where(UsageRollup.endpoint == ALL_ENDPOINTS, *buckets).group_by(UsageRollup.user_id)
+        
+        columns = (User.id, User.username, User.email, User.subscription_plan)
+        if sort == UsageSort.REQUESTS:
+            totals = totals.subquery()
+            query = select(*columns, totals.c.total_requests, totals.c.last_request).join(
+                totals, totals.c.user_id == User.id
+            ).order_by(totals.c.total_requests.desc(), User.id.desc())
+            if cursor:
+                total_requests, user_id = decode_cursor(cursor, (int, int))
+                query = query.where(tuple_(totals.c.total_requests, User.id) < (total_requests, user_id))
+            key = lambda row: (row["total_requests"], row["user_id"])
+        else:
+            query = select(*columns).order_by(User.id)
+            if cursor:
+                (user_id,) = decode_cursor(cursor, (int,))
+                query = query.where(User.id > user_id)
+            key = lambda row: (row["user_id"],)
+        if plan is not None:
+            query = query.where(User.subscription_plan == plan)
+        
+        users = (await self.db.execute(query.limit(limit + 1))).all()
+        user_ids = [user.id for user in users]
+        if sort == UsageSort.USER_ID:
+            page_totals = {
+                row.user_id: row
+                for row in await self.db.execute(totals.where(UsageRollup.user_id.in_(user_ids)))
+            }
+        this_month = dict((await self.db.execute(
+            select(UsageRollup.user_id, UsageRollup.request_count).where(
+                UsageRollup.user_id.in_(user_ids),
+                UsageRollup.endpoint == ALL_ENDPOINTS,
+                UsageRollup.period == "month",
+                UsageRollup.bucket_start == bucket_start(datetime.utcnow(), "month")
+            )
+        )).all())
+        
+        rows = []
+        for user in users:
+            total = user if sort == UsageSort.REQUESTS else page_totals.get(user.id)
+            rows.append({
+                "user_id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "subscription_plan": user.subscription_plan,
+                "total_requests": total.total_requests if total else 0,
+                "requests_this_month": this_month.get(user.id, 0),
+                "last_request": total.last_request if total else None,
+            })
+        return paginate(rows, limit, key)
+
+    async def _recent_logs(self, criterion, limit: int, cursor: Optional[str]) -> Tuple[List[UsageLog], Optional[str]]:
+        # Keyset on (timestamp, id): each page is an index range scan, however deep
+        query = select(UsageLog).where(criterion)
+        if cursor:
+            timestamp, log_id = decode_cursor(cursor, (datetime, int))
+            query = query.where(tuple_(UsageLog.timestamp, UsageLog.id) < (timestamp, log_id))
+        result = await self.db.scalars(
+            query.order_by(UsageLog.timestamp.desc(), UsageLog.id.desc()).limit(limit + 1)
+        )
+        return paginate(result.all(), limit, lambda log: (log.timestamp, log.id))
+
+    async def get_user_usage(self, user_id: int, limit: int = 100, cursor: Optional[str] = None):
+        """Get a page of a user's usage logs, newest first; returns (logs, next_cursor)"""
+        return await self._recent_logs(UsageLog.user_id == user_id, limit, cursor)
+
+    async def get_endpoint_usage(self, endpoint: str, limit: int = 100, cursor: Optional[str] = None):
+        """Get a page of an endpoint's usage logs, newest first; returns (logs, next_cursor)"""
+        return await self._recent_logs(UsageLog.endpoint == endpoint, limit, cursor)
@@ -0,0 +1,110 @@
+"""Baseline schema
+
+Tables as originally created by Base.metadata.create_all. Each table is
+skipped if it already exists, so databases created before migrations were
+introduced can simply run `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-01-15 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+ENUMS = {
+    "userrole": ("USER", "ADMIN"),
+    "subscriptionplan": ("FREE", "PRO"),
+}
+
+
+def enum(name):
+    # Postgres types are created once up front; two tables share subscriptionplan
+    return sa.Enum(*ENUMS[name], name=name).with_variant(
+        postgresql.ENUM(*ENUMS[name], name=name, create_type=False), "postgresql"
+    )
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+    
+    if bind.dialect.name == "postgresql":
+        for name, values in ENUMS.items():
+            postgresql.ENUM(*values, name=name).create(bind, checkfirst=True)
+    
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("username", sa.String(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("hashed_password", sa.String(), nullable=False),
+            sa.Column("role", enum("userrole"), nullable=False),
+            sa.Column("is_active", sa.Boolean(), nullable=False),
+            sa.Column("subscription_plan", enum("subscriptionplan"), nullable=False),
+            sa.Column("stripe_customer_id", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True)),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+    
+    if "usage_logs" not in existing:
+        op.create_table(
+            "usage_logs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("endpoint", sa.String(), nullable=False),
+            sa.Column("method", sa.String(), nullable=False),
+            sa.Column("status_code", sa.Integer(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("response_time_ms", sa.Float(), nullable=True),
+        )
+        op.create_index("ix_usage_logs_id", "usage_logs", ["id"])
+    
+    if "subscriptions" not in existing:
+        op.create_table(
+            "subscriptions",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("plan", enum("subscriptionplan"), nullable=False),
+            sa.Column("stripe_subscription_id", sa.String(), nullable=True),
+            sa.Column("status", sa.String(), nullable=False),
+            sa.Column("current_period_start", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("current_period_end", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True)),
+        )
+        op.create_index("ix_subscriptions_id", "subscriptions", ["id"])
+    
+    if "rate_limits" not in existing:
+        op.create_table(
+            "rate_limits",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("requests_per_minute", sa.Integer(), nullable=False),
+            sa.Column("monthly_quota", sa.Integer(), nullable=False),
+            sa.Column("current_monthly_usage", sa.Integer(), nullable=False),
+            sa.Column("last_minute_reset", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("last_monthly_reset", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("user_id_unique", sa.Integer(), sa.ForeignKey("users.id"), nullable=False, unique=True),
+        )
+        op.create_index("ix_rate_limits_id", "rate_limits", ["id"])
+
+
+def downgrade():
+    op.drop_table("rate_limits")
+    op.drop_table("subscriptions")
+    op.drop_table("usage_logs")
+    op.drop_table("users")
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        for name, values in ENUMS.items():
+            postgresql.ENUM(*values, name=name).drop(bind, checkfirst=True)
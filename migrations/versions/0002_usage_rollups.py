@@ -0,0 +1,38 @@
+"""Usage rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-01-22 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "usage_rollups" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "usage_rollups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("endpoint", sa.String(), nullable=False),
+        sa.Column("period", sa.String(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("request_count", sa.Integer(), nullable=False),
+        sa.Column("timed_count", sa.Integer(), nullable=False),
+        sa.Column("response_time_sum", sa.Float(), nullable=False),
+        sa.Column("response_time_sum_sq", sa.Float(), nullable=False),
+        sa.Column("last_request_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("user_id", "endpoint", "period", "bucket_start", name="uq_usage_rollups_bucket"),
+    )
+    op.create_index("ix_usage_rollups_id", "usage_rollups", ["id"])
+    op.create_index("ix_usage_rollups_user_period_bucket", "usage_rollups", ["user_id", "period", "bucket_start"])
+
+
+def downgrade():
+    op.drop_table("usage_rollups")
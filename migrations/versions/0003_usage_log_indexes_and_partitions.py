@@ -0,0 +1,105 @@
+"""Composite usage_logs indexes; monthly range partitions on Postgres
+
+On Postgres the existing table is rebuilt as a table partitioned by month on
+timestamp (the primary key becomes (id, timestamp), as Postgres requires the
+partition key in it) and existing rows are copied into their partitions.
+This rewrites usage_logs once, so run it in a maintenance window on large
+installations. Later partitions are created by the usage retention job.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-01-29 00:00:00
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+from app.core.config import settings
+from app.db.partitions import ensure_monthly_partitions, is_partitioned, month_floor, months_between
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "ix_usage_logs_user_id_timestamp": ["user_id", "timestamp"],
+    "ix_usage_logs_endpoint_timestamp": ["endpoint", "timestamp"],
+}
+
+COLUMNS = """
+    id INTEGER NOT NULL DEFAULT nextval('usage_logs_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    endpoint VARCHAR NOT NULL,
+    method VARCHAR NOT NULL,
+    status_code INTEGER NOT NULL,
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    response_time_ms DOUBLE PRECISION
+"""
+
+
+def set_aside(old_name):
+    """Rename the current usage_logs and its named objects out of the way"""
+    op.execute(f"ALTER TABLE usage_logs RENAME TO {old_name}")
+    op.execute(f"ALTER TABLE {old_name} RENAME CONSTRAINT usage_logs_pkey TO {old_name}_pkey")
+    op.execute(f"ALTER INDEX IF EXISTS ix_usage_logs_id RENAME TO ix_{old_name}_id")
+
+
+def take_over(old_name):
+    """Move the id sequence and rows to the new usage_logs and drop the old table"""
+    op.execute("ALTER SEQUENCE usage_logs_id_seq OWNED BY usage_logs.id")
+    op.execute("CREATE INDEX ix_usage_logs_id ON usage_logs (id)")
+    op.execute(
+        "INSERT INTO usage_logs (id, user_id, endpoint, method, status_code, timestamp, response_time_ms) "
+        f"SELECT id, user_id, endpoint, method, status_code, COALESCE(timestamp, now()), response_time_ms FROM {old_name}"
+    )
+    op.execute(f"DROP TABLE {old_name}")
+
+
+def partition_usage_logs(bind):
+    oldest = bind.execute(sa.text("SELECT min(timestamp) FROM usage_logs")).scalar()
+    set_aside("usage_logs_unpartitioned")
+    op.execute(f"CREATE TABLE usage_logs ({COLUMNS}, PRIMARY KEY (id, timestamp)) PARTITION BY RANGE (timestamp)")
+    
+    # One partition per month from the oldest row through the pre-created future months
+    now = month_floor(datetime.utcnow())
+    start = month_floor(oldest) if oldest is not None else now
+    months = months_between(start, now) + 1 + settings.usage_partition_premake_months
+    ensure_monthly_partitions(bind, "usage_logs", start, months)
+    
+    take_over("usage_logs_unpartitioned")
+
+
+def unpartition_usage_logs():
+    set_aside("usage_logs_partitioned")
+    op.execute(f"CREATE TABLE usage_logs ({COLUMNS}, PRIMARY KEY (id))")
+    take_over("usage_logs_partitioned")
+    op.execute("ALTER TABLE usage_logs ALTER COLUMN timestamp DROP NOT NULL")
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        if not is_partitioned(bind, "usage_logs"):
+            partition_usage_logs(bind)
+    else:
+        op.execute("UPDATE usage_logs SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL")
+        with op.batch_alter_table("usage_logs") as batch:
+            batch.alter_column("timestamp", existing_type=sa.DateTime(timezone=True), nullable=False)
+    
+    existing = {index["name"] for index in sa.inspect(bind).get_indexes("usage_logs")}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, "usage_logs", columns)
+
+
+def downgrade():
+    for name in INDEXES:
+        op.drop_index(name, table_name="usage_logs")
+    
+    bind = op.get_bind()
+    if bind.dialect.name == "postgresql":
+        if is_partitioned(bind, "usage_logs"):
+            unpartition_usage_logs()
+    else:
+        with op.batch_alter_table("usage_logs") as batch:
+            batch.alter_column("timestamp", existing_type=sa.DateTime(timezone=True), nullable=True)
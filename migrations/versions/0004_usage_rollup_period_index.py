@@ -0,0 +1,25 @@
+"""Index usage rollups by period and bucket for system-wide totals
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-02-05 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("usage_rollups")}
+    # A database built by create_all already has the index that replaces this one in 0005
+    if existing & {"ix_usage_rollups_period_bucket", "ix_usage_rollups_ranking"}:
+        return
+    op.create_index("ix_usage_rollups_period_bucket", "usage_rollups", ["period", "bucket_start"])
+
+
+def downgrade():
+    op.drop_index("ix_usage_rollups_period_bucket", table_name="usage_rollups")
@@ -0,0 +1,31 @@
+"""Rank usage rollups by request count within a bucket
+
+Replaces the (period, bucket_start) index; the new one also serves the
+system-wide totals, which now read the per-user total rows only.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-02-12 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("usage_rollups")}
+    if "ix_usage_rollups_period_bucket" in existing:
+        op.drop_index("ix_usage_rollups_period_bucket", table_name="usage_rollups")
+    if "ix_usage_rollups_ranking" not in existing:
+        op.create_index(
+            "ix_usage_rollups_ranking", "usage_rollups", ["period", "endpoint", "bucket_start", "request_count", "user_id"]
+        )
+
+
+def downgrade():
+    op.drop_index("ix_usage_rollups_ranking", table_name="usage_rollups")
+    op.create_index("ix_usage_rollups_period_bucket", "usage_rollups", ["period", "bucket_start"])
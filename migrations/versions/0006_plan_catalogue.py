@@ -0,0 +1,55 @@
+"""Plan catalogue
+
+Plan limits move from code into the plans table, with optional per-endpoint
+request costs. Seeded with the previously hardcoded FREE and PRO limits.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-02-19 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def plan_enum():
+    # The subscriptionplan type already exists on Postgres (created by 0001)
+    return sa.Enum("FREE", "PRO", name="subscriptionplan").with_variant(
+        postgresql.ENUM("FREE", "PRO", name="subscriptionplan", create_type=False), "postgresql"
+    )
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "plans" not in existing:
+        plans = op.create_table(
+            "plans",
+            sa.Column("code", plan_enum(), primary_key=True),
+            sa.Column("requests_per_minute", sa.Integer(), nullable=False),
+            sa.Column("monthly_quota", sa.Integer(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.bulk_insert(plans, [
+            {"code": "FREE", "requests_per_minute": 60, "monthly_quota": 1000},
+            {"code": "PRO", "requests_per_minute": 300, "monthly_quota": 10000},
+        ])
+    if "plan_endpoint_costs" not in existing:
+        op.create_table(
+            "plan_endpoint_costs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("plan", plan_enum(), sa.ForeignKey("plans.code", ondelete="CASCADE"), nullable=False),
+            sa.Column("endpoint", sa.String(), nullable=False),
+            sa.Column("cost", sa.Integer(), nullable=False),
+            sa.UniqueConstraint("plan", "endpoint", name="uq_plan_endpoint_costs_plan_endpoint"),
+        )
+        op.create_index("ix_plan_endpoint_costs_id", "plan_endpoint_costs", ["id"])
+
+
+def downgrade():
+    op.drop_table("plan_endpoint_costs")
+    op.drop_table("plans")
@@ -0,0 +1,53 @@
+"""Billing outbox and webhook inbox
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-02-26 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "outbox_messages" not in existing:
+        op.create_table(
+            "outbox_messages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("kind", sa.String(), nullable=False),
+            sa.Column("payload", sa.Text(), nullable=False),
+            sa.Column("status", sa.String(), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_outbox_messages_id", "outbox_messages", ["id"])
+        op.create_index("ix_outbox_messages_status_next_attempt", "outbox_messages", ["status", "next_attempt_at"])
+    if "webhook_events" not in existing:
+        op.create_table(
+            "webhook_events",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("event_id", sa.String(), nullable=False, unique=True),
+            sa.Column("type", sa.String(), nullable=False),
+            sa.Column("payload", sa.Text(), nullable=False),
+            sa.Column("status", sa.String(), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("received_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_webhook_events_id", "webhook_events", ["id"])
+        op.create_index("ix_webhook_events_status_next_attempt", "webhook_events", ["status", "next_attempt_at"])
+
+
+def downgrade():
+    op.drop_table("webhook_events")
+    op.drop_table("outbox_messages")
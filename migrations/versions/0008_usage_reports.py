@@ -0,0 +1,44 @@
+"""Metered usage reports
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-03-04 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "stripe_subscription_item_id" not in {c["name"] for c in inspector.get_columns("subscriptions")}:
+        op.add_column("subscriptions", sa.Column("stripe_subscription_item_id", sa.String(), nullable=True))
+    if "usage_reports" in inspector.get_table_names():
+        return
+    op.create_table(
+        "usage_reports",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("window_start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("subscription_item_id", sa.String(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column("reported_quantity", sa.Integer(), nullable=True),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("reported_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("user_id", "window_start", name="uq_usage_reports_user_window"),
+    )
+    op.create_index("ix_usage_reports_id", "usage_reports", ["id"])
+    op.create_index("ix_usage_reports_status_id", "usage_reports", ["status", "id"])
+
+
+def downgrade():
+    op.drop_table("usage_reports")
+    with op.batch_alter_table("subscriptions") as batch:
+        batch.drop_column("stripe_subscription_item_id")
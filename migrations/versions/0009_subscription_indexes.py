@@ -0,0 +1,31 @@
+"""Subscription sweep and lookup indexes
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-03-11 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+INDEXES = {
+    "ix_subscriptions_status_period_end": ["status", "current_period_end"],
+    "ix_subscriptions_user_id_status": ["user_id", "status"],
+}
+
+
+def upgrade():
+    existing = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("subscriptions")}
+    for name, columns in INDEXES.items():
+        if name not in existing:
+            op.create_index(name, "subscriptions", columns)
+
+
+def downgrade():
+    op.drop_index("ix_subscriptions_user_id_status", table_name="subscriptions")
+    op.drop_index("ix_subscriptions_status_period_end", table_name="subscriptions")
@@ -0,0 +1,48 @@
+"""Default admin account
+
+Seeds the admin account the app used to create on every startup, so
+deployments that run migrations can turn startup seeding off
+(SEED_ADMIN_ON_STARTUP=false). The hash is bcrypt (12 rounds) of the
+documented default password; it is upgraded on first login like any other.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2024-03-25 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+ADMIN_PASSWORD_HASH = "$2b$12$S9D8nnClOWDDTDIjf8YUFO7TC.pezjZ2NYtss6xf4/VkOzj/AUzC2"
+
+
+def upgrade():
+    users = sa.table(
+        "users",
+        sa.column("username", sa.String),
+        sa.column("email", sa.String),
+        sa.column("hashed_password", sa.String),
+        sa.column("role", sa.String),
+        sa.column("is_active", sa.Boolean),
+        sa.column("subscription_plan", sa.String),
+    )
+    bind = op.get_bind()
+    if bind.execute(sa.select(users.c.username).where(users.c.username == "admin")).first() is not None:
+        return
+    op.bulk_insert(users, [{
+        "username": "admin",
+        "email": "admin@example.com",
+        "hashed_password": ADMIN_PASSWORD_HASH,
+        "role": "ADMIN",
+        "is_active": True,
+        "subscription_plan": "FREE",
+    }])
+
+
+def downgrade():
+    # The account may have been used (and its password changed) since; leave it
+    pass
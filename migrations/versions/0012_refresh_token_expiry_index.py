@@ -0,0 +1,23 @@
+"""Refresh token expiry index, used to delete expired tokens in batches
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2024-04-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("refresh_tokens")}
+    if "ix_refresh_tokens_expires_at" not in existing:
+        op.create_index("ix_refresh_tokens_expires_at", "refresh_tokens", ["expires_at"])
+
+
+def downgrade():
+    op.drop_index("ix_refresh_tokens_expires_at", table_name="refresh_tokens")
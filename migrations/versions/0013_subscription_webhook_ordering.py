@@ -0,0 +1,27 @@
+"""Subscription webhook ordering: last applied event time and a Stripe subscription id index
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2024-04-08 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "stripe_event_at" not in {c["name"] for c in inspector.get_columns("subscriptions")}:
+        op.add_column("subscriptions", sa.Column("stripe_event_at", sa.DateTime(timezone=True), nullable=True))
+    if "ix_subscriptions_stripe_subscription_id" not in {i["name"] for i in inspector.get_indexes("subscriptions")}:
+        op.create_index("ix_subscriptions_stripe_subscription_id", "subscriptions", ["stripe_subscription_id"])
+
+
+def downgrade():
+    op.drop_index("ix_subscriptions_stripe_subscription_id", table_name="subscriptions")
+    with op.batch_alter_table("subscriptions") as batch:
+        batch.drop_column("stripe_event_at")
@@ -0,0 +1,141 @@
+"""Fill the database with synthetic users and usage logs for benchmarking the usage queries
+
+Logs go through write_usage, so the rollups stay consistent with them (COPY on
+Postgres, monthly partitions created as needed). Users and endpoints are skewed
+so a few are busy and most are quiet, like real traffic. Reruns reuse the
+users already created with the same --prefix and add more logs, e.g.
+
+    python scripts/generate_usage_dataset.py --users 20000 --logs 1000000
+    DATABASE_URL=sqlite:///./bench.db python scripts/generate_usage_dataset.py --create-tables --logs 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import insert, select  # noqa: E402
+from app.core.security import get_password_hash  # noqa: E402
+from app.db.models import Base, SubscriptionPlan, User  # noqa: E402
+from app.db.partitions import ensure_monthly_partitions, is_partitioned, month_floor, months_between  # noqa: E402
+from app.db.session import AsyncSessionLocal, async_engine  # noqa: E402
+from app.services.usage import UsageRecord, write_usage  # noqa: E402
+
+ENDPOINTS = [
+    ("/protected", "GET"), ("/users/me", "GET"), ("/users/usage", "GET"), ("/users/usage/logs", "GET"),
+    ("/auth/refresh", "POST"), ("/auth/login", "POST"), ("/billing/subscription", "GET"),
+] + [(f"/v1/resource{n}", method) for n in range(20) for method in ("GET", "POST")]
+
+PLANS = [SubscriptionPlan.FREE] * 9 + [SubscriptionPlan.PRO]
+
+
+def skewed_weights(count: int, exponent: float) -> list:
+    """Cumulative Zipf-like weights: item n is picked in proportion to 1 / (n + 1) ** exponent"""
+    return list(accumulate(1 / (n + 1) ** exponent for n in range(count)))
+
+
+async def prepare_schema(create_tables: bool, start: datetime, now: datetime):
+    async with async_engine.begin() as conn:
+        if create_tables:
+            await conn.run_sync(Base.metadata.create_all)
+        if async_engine.dialect.name == "postgresql" and await conn.run_sync(is_partitioned, "usage_logs"):
+            created = await conn.run_sync(
+                ensure_monthly_partitions, "usage_logs", month_floor(start), months_between(start, now) + 1
+            )
+            if created:
+                print(f"Created partitions: {', '.join(created)}")
+
+
+async def ensure_users(count: int, prefix: str, batch: int, rng: random.Random) -> list:
+    """Ids of the --prefix users, creating the missing ones"""
+    async with AsyncSessionLocal() as db:
+        existing = (await db.execute(
+            select(User.id).where(User.username.like(f"{prefix}%")).order_by(User.id)
+        )).scalars().all()
+        missing = range(len(existing), count)
+        if missing:
+            # One hash for all of them: bcrypt per user would dominate the run
+            hashed = get_password_hash(f"{prefix}-password")
+            rows = [{
+                "username": f"{prefix}{n}",
+                "email": f"{prefix}{n}@example.com",
+                "hashed_password": hashed,
+                "subscription_plan": rng.choice(PLANS),
+            } for n in missing]
+            for offset in range(0, len(rows), batch):
+                await db.execute(insert(User), rows[offset:offset + batch])
+            await db.commit()
+            existing = (await db.execute(
+                select(User.id).where(User.username.like(f"{prefix}%")).order_by(User.id)
+            )).scalars().all()
+    return list(existing[:count])
+
+
+async def generate(args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=args.days)
+    await prepare_schema(args.create_tables, start, now)
+
+    began = time.perf_counter()
+    user_ids = await ensure_users(args.users, args.prefix, args.batch, rng)
+    print(f"{len(user_ids)} users ready in {time.perf_counter() - began:.1f}s")
+
+    user_weights = skewed_weights(len(user_ids), 0.8)
+    endpoint_weights = skewed_weights(len(ENDPOINTS), 1.0)
+    span = (now - start).total_seconds()
+    written = 0
+    began = time.perf_counter()
+    while written < args.logs:
+        size = min(args.batch, args.logs - written)
+        users = rng.choices(user_ids, cum_weights=user_weights, k=size)
+        endpoints = rng.choices(ENDPOINTS, cum_weights=endpoint_weights, k=size)
+        records = [
+            UsageRecord(
+                user_id=user_id,
+                endpoint=endpoint,
+                method=method,
+                status_code=rng.choices((200, 201, 400, 404, 429, 500), (80, 8, 4, 4, 3, 1))[0],
+                timestamp=start + timedelta(seconds=rng.random() * span),
+                response_time_ms=round(rng.lognormvariate(3, 0.6), 2),
+            )
+            for user_id, (endpoint, method) in zip(users, endpoints)
+        ]
+        async with AsyncSessionLocal() as db:
+            await write_usage(db, records)
+            await db.commit()
+        written += size
+        elapsed = time.perf_counter() - began
+        print(f"{written}/{args.logs} logs  {written / elapsed:.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--logs", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90, help="spread the logs over the last N days")
+    parser.add_argument("--batch", type=int, default=10000, help="rows per transaction")
+    parser.add_argument("--prefix", default="load", help="username prefix of the generated users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--create-tables", action="store_true", help="create missing tables first (no migrations)")
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+
+    async def run():
+        try:
+            await generate(args)
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cold start benchmark: `import app.main` time and time to the first 200 from /health
+
+Each sample is a fresh interpreter, so nothing is warm but the OS page cache.
+Startup settings are taken from the environment, e.g.
+
+    python scripts/startup_benchmark.py --runs 9
+    CREATE_TABLES_ON_STARTUP=false SEED_ADMIN_ON_STARTUP=false python scripts/startup_benchmark.py
+
+Exits non-zero when a median exceeds --max-import-ms / --max-ready-ms, for CI.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = "import time; t = time.perf_counter(); import app.main; print((time.perf_counter() - t) * 1000)"
+
+
+def import_ms() -> float:
+    out = subprocess.check_output([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT)
+    return float(out.split()[-1])
+
+
+def ready_ms(port: int, timeout: float = 60.0) -> float:
+    """From spawning uvicorn to the first 200 on /health"""
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"/health did not return 200 within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-ready-ms", type=float)
+    args = parser.parse_args()
+
+    imports = [import_ms() for _ in range(args.runs)]
+    readies = [ready_ms(args.port) for _ in range(args.runs)]
+    results = {"import_ms": imports, "ready_ms": readies}
+    for name, samples in results.items():
+        print(f"{name}: median {statistics.median(samples):.0f}  min {min(samples):.0f}  max {max(samples):.0f}")
+
+    failed = False
+    for name, limit in (("import_ms", args.max_import_ms), ("ready_ms", args.max_ready_ms)):
+        if limit is not None and statistics.median(results[name]) > limit:
+            print(f"{name} median over the {limit:.0f}ms budget")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Local Stripe stand-in for exercising the billing outbox and metered usage reporting
+
+Answers the calls the app makes (customer creation and usage records), can add
+latency and fail the first N requests to show the worker's retries, and replays
+the stored response for a repeated Idempotency-Key like Stripe does. Point the
+app at it with STRIPE_API_BASE, e.g.
+
+    python scripts/stripe_stub.py --delay 0.3 --fail-first 2
+    STRIPE_API_KEY=sk_test_stub STRIPE_API_BASE=http://127.0.0.1:12111 uvicorn app.main:app
+
+GET /__calls returns what was received; DELETE /__calls resets it.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubState:
+    def __init__(self, delay: float, fail_first: int):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.calls = []
+            self.responses = {}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "calls": list(self.calls)}
+
+
+def stripe_object(path: str, form: dict) -> dict:
+    """The minimal response body the Stripe SDK needs for each endpoint the app calls"""
+    parts = path.strip("/").split("/")
+    if parts[-1] == "customers":
+        return {"id": f"cus_{uuid.uuid4().hex[:14]}", "object": "customer", "email": form.get("email")}
+    if parts[-1] == "usage_records":
+        return {
+            "id": f"mbur_{uuid.uuid4().hex[:14]}",
+            "object": "usage_record",
+            "subscription_item": parts[-2],
+            "quantity": int(form.get("quantity", 0)),
+            "timestamp": int(form.get("timestamp", 0)),
+        }
+    return {"id": f"obj_{uuid.uuid4().hex[:14]}", "object": parts[-1]}
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/__calls":
+                return self._send(200, state.snapshot())
+            self._send(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+        def do_DELETE(self):
+            if self.path == "/__calls":
+                state.reset()
+                return self._send(200, {"reset": True})
+            self._send(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+            path = urlparse(self.path).path
+            key = self.headers.get("Idempotency-Key")
+            with state.lock:
+                state.requests += 1
+                failing = state.requests <= state.fail_first
+                state.calls.append({"path": path, "idempotency_key": key, "form": form, "failed": failing})
+                replay = state.responses.get(key) if key else None
+            if state.delay:
+                time.sleep(state.delay)
+            if failing:
+                return self._send(500, {"error": {"type": "api_error", "message": "Stub failure"}})
+            if replay is None:
+                replay = stripe_object(path, form)
+                if key:
+                    with state.lock:
+                        replay = state.responses.setdefault(key, replay)
+            self._send(200, replay)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every POST")
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N POSTs with a 500")
+    args = parser.parse_args()
+
+    state = StubState(args.delay, args.fail_first)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Stripe stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""JWT micro-benchmarks: tokens created and verified per second for each backend and algorithm
+
+Keys for the asymmetric algorithms are generated for the run. "verify" is a full
+signature and claims check by the backend; "verify cached" goes through
+decode_token, which skips it for a token it has already verified, e.g.
+
+    python scripts/token_benchmark.py
+    python scripts/token_benchmark.py --backend pyjwt --algorithm HS256 --algorithm ES256 --json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa  # noqa: E402
+from app.core import security  # noqa: E402
+from app.core.config import settings  # noqa: E402
+
+ALGORITHMS = ("HS256", "RS256", "PS256", "ES256", "EdDSA")
+
+KEY_FACTORIES = {
+    "RS": lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    "PS": lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    "ES": lambda: ec.generate_private_key(ec.SECP256R1()),
+    "Ed": ed25519.Ed25519PrivateKey.generate,
+}
+
+
+def pem_keys(algorithm: str):
+    """(signing key, verification key) for an algorithm"""
+    if not security.is_asymmetric(algorithm):
+        return settings.secret_key, settings.secret_key
+    private = KEY_FACTORIES[algorithm[:2]]()
+    private_pem = private.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private_pem, public_pem
+
+
+def per_second(fn, duration: float) -> float:
+    """Calls of fn per second, measured over about `duration` seconds"""
+    fn()
+    calls = 0
+    batch = 1
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            fn()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return calls / elapsed
+        batch = min(batch * 2, 1000)
+
+
+def bench(backend_name: str, algorithm: str, duration: float) -> dict:
+    backend = security.JWT_BACKENDS[backend_name]()
+    private_key, public_key = pem_keys(algorithm)
+    claims = {"sub": "bench", "fam": "bench-family", "type": "access", "exp": datetime.utcnow() + timedelta(hours=1)}
+    token = backend.encode(claims, private_key, algorithm)
+    results = {
+        "create": per_second(lambda: backend.encode(claims, private_key, algorithm), duration),
+        "verify": per_second(lambda: backend.decode(token, public_key, algorithm), duration),
+    }
+
+    # decode_token reads the backend, algorithm and keys from module state
+    saved = security.jwt_backend, settings.algorithm, settings.jwt_private_key, settings.jwt_public_key
+    security.jwt_backend = backend
+    settings.algorithm, settings.jwt_private_key, settings.jwt_public_key = algorithm, private_key, public_key
+    try:
+        security.verified_token_cache.clear()
+        results["verify cached"] = per_second(lambda: security.decode_token(token), duration)
+    finally:
+        security.jwt_backend, settings.algorithm, settings.jwt_private_key, settings.jwt_public_key = saved
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", action="append", choices=sorted(security.JWT_BACKENDS))
+    parser.add_argument("--algorithm", action="append", choices=ALGORITHMS)
+    parser.add_argument("--duration", type=float, default=0.5, help="seconds per measurement")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for backend_name in args.backend or sorted(security.JWT_BACKENDS):
+        for algorithm in args.algorithm or ALGORITHMS:
+            try:
+                rates = bench(backend_name, algorithm, args.duration)
+            except Exception as e:
+                print(f"{backend_name} {algorithm}: skipped ({type(e).__name__}: {e})")
+                continue
+            results[f"{backend_name} {algorithm}"] = rates
+            if not args.json:
+                print(f"{backend_name:>5} {algorithm:<6} " + "  ".join(
+                    f"{name} {rate:>9,.0f}/s" for name, rate in rates.items()
+                ))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
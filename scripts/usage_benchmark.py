@@ -0,0 +1,142 @@
+"""Page latency of the usage listings: does the Nth page cost the same as the first?
+
+Walks each listing page by page through the service layer (one session per page,
+like one request per page) and reports the first, median, slowest and last page.
+The deprecated `skip` offset on /admin/users is walked too, for comparison.
+Run it against a database filled by generate_usage_dataset.py, e.g.
+
+    python scripts/generate_usage_dataset.py --users 20000 --logs 1000000
+    python scripts/usage_benchmark.py
+    python scripts/usage_benchmark.py --only pages --limit 10   # out to page 10,000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import func, select  # noqa: E402
+from app.api.admin import user_page  # noqa: E402
+from app.core.pagination import paginate  # noqa: E402
+from app.db.models import SubscriptionPlan, UsageRollup, User  # noqa: E402
+from app.db.session import AsyncSessionLocal, async_engine  # noqa: E402
+from app.services.rollups import ALL_ENDPOINTS  # noqa: E402
+from app.services.usage import UsageService, UsageSort  # noqa: E402
+
+
+async def walk(fetch, max_pages: int) -> list:
+    """Milliseconds per page, following next cursors until the listing or max_pages runs out"""
+    async with AsyncSessionLocal() as db:
+        await fetch(db, None)  # warm up: connection, statement caches
+    times = []
+    cursor = None
+    while len(times) < max_pages:
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            _, cursor = await fetch(db, cursor)
+            times.append((time.perf_counter() - start) * 1000)
+        if not cursor:
+            break
+    return times
+
+
+async def admin_usage_cases(limit: int):
+    """GET /admin/usage: every page of each sort and filter combination"""
+    month_ago = datetime.utcnow() - timedelta(days=30)
+
+    def listing(**filters):
+        return lambda db, cursor: UsageService(db).list_user_usage(limit, cursor, **filters)
+
+    return {
+        "admin-usage lifetime by user_id": listing(),
+        "admin-usage lifetime by requests": listing(sort=UsageSort.REQUESTS),
+        "admin-usage plan=PRO by user_id": listing(plan=SubscriptionPlan.PRO),
+        "admin-usage last 30 days by user_id": listing(start=month_ago),
+        "admin-usage last 30 days by requests": listing(start=month_ago, sort=UsageSort.REQUESTS),
+    }
+
+
+async def busiest(column) -> str:
+    """The user id or endpoint with the most logged requests, from the lifetime rollups"""
+    async with AsyncSessionLocal() as db:
+        query = select(column).where(UsageRollup.period == "all")
+        if column is UsageRollup.endpoint:
+            query = query.where(UsageRollup.endpoint != ALL_ENDPOINTS)
+        else:
+            query = query.where(UsageRollup.endpoint == ALL_ENDPOINTS)
+        return (await db.execute(
+            query.group_by(column).order_by(func.sum(UsageRollup.request_count).desc()).limit(1)
+        )).scalar()
+
+
+async def pagination_cases(limit: int):
+    """Keyset pages of /admin/users and the log listings, against the legacy offset"""
+    def admin_users(db, cursor):
+        return admin_user_rows(db, user_page(cursor, 0), limit)
+
+    page = 0
+
+    def admin_users_skip(db, cursor):
+        nonlocal page
+        page = page + 1 if cursor else 0
+        return admin_user_rows(db, user_page(None, page * limit), limit)
+
+    user_id = await busiest(UsageRollup.user_id)
+    endpoint = await busiest(UsageRollup.endpoint)
+    return {
+        "admin-users cursor": admin_users,
+        "admin-users skip (deprecated)": admin_users_skip,
+        f"user-logs cursor (user {user_id})": lambda db, cursor: UsageService(db).get_user_usage(user_id, limit, cursor),
+        f"endpoint-logs cursor ({endpoint})": lambda db, cursor: UsageService(db).get_endpoint_usage(endpoint, limit, cursor),
+    }
+
+
+async def admin_user_rows(db, query, limit: int):
+    """What GET /admin/users runs for one page"""
+    page = query.limit(limit + 1).subquery()
+    users = await db.scalars(select(User).join(page, page.c.id == User.id).order_by(User.id))
+    return paginate(users.all(), limit, lambda user: (user.id,))
+
+
+SUITES = {
+    "admin-usage": admin_usage_cases,
+    "pages": pagination_cases,
+}
+
+
+async def run(args):
+    results = {}
+    for suite in args.only or SUITES:
+        for name, fetch in (await SUITES[suite](args.limit)).items():
+            times = await walk(fetch, args.max_pages)
+            results[name] = times
+            print(
+                f"{name}: {len(times)} pages  first {times[0]:.1f}ms  median {statistics.median(times):.1f}ms"
+                f"  max {max(times):.1f}ms  last {times[-1]:.1f}ms"
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", action="append", choices=sorted(SUITES), help="run only this suite (repeatable)")
+    parser.add_argument("--limit", type=int, default=100, help="page size")
+    parser.add_argument("--max-pages", type=int, default=10000)
+    args = parser.parse_args()
+
+    async def main_async():
+        try:
+            await run(args)
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import uuid
+
+# Settings are read when app modules are first imported, so the environment is set up before any of them
+TEST_DIR = tempfile.mkdtemp(prefix="saas-auth-tests-")
+WEBHOOK_SECRET = "whsec_test"
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    "RATE_LIMIT_BACKEND": "memory",
+    "PRINCIPAL_CACHE_REDIS": "false",
+    "TOKEN_REVOCATION_REDIS": "false",
+    "BCRYPT_ROUNDS": "4",
+    "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+})
+os.environ.pop("PASSWORD_HASH_TARGET_MS", None)
+os.environ.pop("STRIPE_API_KEY", None)
+
+import pytest  # noqa: E402
+import pytest_asyncio  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from app.db.models import Base, User  # noqa: E402
+from app.db.session import AsyncSessionLocal, async_engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    """The app with its lifespan running (tables, default admin, background workers)"""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest_asyncio.fixture
+async def db():
+    """A session for service-level tests, outside the app's lifespan"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        yield session
+    # Pooled aiosqlite connections belong to this test's event loop
+    await async_engine.dispose()
+
+
+@pytest.fixture
+def make_user(db):
+    """await make_user(prefix, **fields) adds a user with a unique name directly in the database"""
+    async def add_user(prefix: str = "user", **fields) -> User:
+        name = f"{prefix}_{uuid.uuid4().hex[:10]}"
+        user = User(username=name, email=f"{name}@example.com", hashed_password="x", **fields)
+        db.add(user)
+        await db.commit()
+        return user
+    return add_user
+
+
+@pytest.fixture
+def register(client):
+    """register(**fields) creates a user with a unique name and returns (username, password, user json)"""
+    def register_user(**fields):
+        username = fields.pop("username", f"user_{uuid.uuid4().hex[:10]}")
+        password = fields.pop("password", "correct-horse")
+        response = client.post("/auth/register", json={
+            "username": username, "email": f"{username}@example.com", "password": password, **fields
+        })
+        assert response.status_code == 200, response.text
+        return username, password, response.json()
+    return register_user
+
+
+@pytest.fixture
+def login(client):
+    """login(username, password) returns the token pair"""
+    def login_user(username, password):
+        response = client.post("/auth/login", data={"username": username, "password": password})
+        assert response.status_code == 200, response.text
+        return response.json()
+    return login_user
+
+
+@pytest.fixture
+def user_tokens(register, login):
+    """A fresh user's token pair, plus its username"""
+    username, password, _ = register()
+    return {"username": username, **login(username, password)}
+
+
+@pytest.fixture
+def admin_headers(login):
+    tokens = login("admin", "admin123")
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
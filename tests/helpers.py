@@ -0,0 +1,19 @@
+from app.core.pagination import NEXT_CURSOR_HEADER
+
+
+def bearer(tokens) -> dict:
+    """Authorization header for a token pair (or a bare access token)"""
+    access_token = tokens["access_token"] if isinstance(tokens, dict) else tokens
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+def walk_pages(client, path, headers, **params) -> list:
+    """Follow X-Next-Cursor from the first page to the last; returns every page's JSON"""
+    pages = []
+    while True:
+        response = client.get(path, params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        pages.append(response.json())
+        if NEXT_CURSOR_HEADER not in response.headers:
+            return pages
+        params["cursor"] = response.headers[NEXT_CURSOR_HEADER]
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app.db.models import SubscriptionPlan, User
+from app.db.session import AsyncSessionLocal
+from app.services.usage import UsageRecord, write_usage
+from helpers import bearer, walk_pages
+
+
+def days(month):
+    """The first nine days of a month in 2019; each test uses its own, where nothing else records usage"""
+    return {"start": datetime(2019, month, 1).isoformat(), "end": datetime(2019, month, 10).isoformat()}
+
+
+def record_usage(client, usage, pro=()):
+    """usage maps user id to a list of (timestamp, request count)"""
+    async def record():
+        async with AsyncSessionLocal() as db:
+            records = []
+            for user_id, days in usage.items():
+                for stamp, count in days:
+                    records += [UsageRecord(user_id, "/protected", "GET", 200, stamp)] * count
+            await write_usage(db, records)
+            if pro:
+                await db.execute(update(User).where(User.id.in_(pro)).values(subscription_plan=SubscriptionPlan.PRO))
+            await db.commit()
+    client.portal.call(record)
+
+
+def usage_pages(client, headers, **params):
+    """(user id, total requests) on each page of /admin/usage"""
+    return [[(row["user_id"], row["total_requests"]) for row in page]
+            for page in walk_pages(client, "/admin/usage", headers, **params)]
+
+
+def test_busiest_users_in_a_range_come_first(client, admin_headers, register):
+    a, b, c = (register()[2]["id"] for _ in range(3))
+    record_usage(client, {
+        a: [(datetime(2019, 1, 2), 3), (datetime(2019, 1, 5), 1)],
+        b: [(datetime(2019, 1, 3), 5)],
+        # Outside the range on both sides
+        c: [(datetime(2018, 12, 31, 23), 2), (datetime(2019, 1, 10), 1)],
+    })
+
+    pages = usage_pages(client, admin_headers, sort="requests", limit=1, **days(1))
+    assert pages == [[(b, 5)], [(a, 4)]]
+
+
+def test_ties_are_broken_by_user_id_across_pages(client, admin_headers, register):
+    ids = sorted(register()[2]["id"] for _ in range(3))
+    record_usage(client, {user_id: [(datetime(2019, 2, 7), 100)] for user_id in ids})
+
+    pages = usage_pages(client, admin_headers, sort="requests", limit=2, **days(2))
+    assert pages == [[(ids[2], 100), (ids[1], 100)], [(ids[0], 100)]]
+
+
+def test_user_order_lists_users_without_usage_and_filters_by_plan(client, admin_headers, register):
+    free, pro, idle = (register()[2]["id"] for _ in range(3))
+    record_usage(client, {free: [(datetime(2019, 3, 4), 2)], pro: [(datetime(2019, 3, 4), 3)]}, pro=[pro])
+
+    rows = dict(row for page in usage_pages(client, admin_headers, limit=50, **days(3)) for row in page)
+    assert (rows[free], rows[pro], rows[idle]) == (2, 3, 0)
+    assert list(rows) == sorted(rows)
+
+    pro_rows = [row for page in usage_pages(client, admin_headers, plan="PRO", **days(3)) for row in page]
+    assert (pro, 3) in pro_rows
+    assert free not in dict(pro_rows)
+
+
+def test_lifetime_totals_include_this_month(client, admin_headers, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    record_usage(client, {user["id"]: [(datetime(2019, 4, 4), 2), (datetime.utcnow() - timedelta(minutes=1), 3)]})
+
+    rows = [row for row in client.get("/admin/usage", params={"limit": 1000}, headers=admin_headers).json()
+            if row["user_id"] == user["id"]]
+    assert [(row["total_requests"], row["requests_this_month"]) for row in rows] == [(5, 3)]
+    assert client.get("/admin/usage", headers=bearer(tokens)).status_code == 403
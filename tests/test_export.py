@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+import pytest_asyncio
+from app.services.export import EXPORT_COLUMNS, ExportFormat, export_usage
+from app.services.usage import UsageRecord, write_usage
+from helpers import bearer
+
+START = datetime(2024, 3, 1, 12, 0)
+ENDPOINTS = ["/protected", "/auth/me", "/protected", "/protected", "/users/usage"]
+
+
+@pytest_asyncio.fixture
+async def exported_user(db, make_user):
+    """A user with one log a minute from START"""
+    user = await make_user("export")
+    await write_usage(db, [
+        UsageRecord(user.id, endpoint, "GET", 200, START + timedelta(minutes=n), float(n))
+        for n, endpoint in enumerate(ENDPOINTS)
+    ])
+    await db.commit()
+    return user
+
+
+async def collect(export_format, **filters):
+    return [chunk async for chunk in export_usage(export_format, **filters)]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_has_one_object_per_log(exported_user):
+    chunks = await collect(ExportFormat.NDJSON, user_id=exported_user.id)
+    rows = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert [row["endpoint"] for row in rows] == ENDPOINTS
+    assert list(rows[0]) == list(EXPORT_COLUMNS)
+    assert rows[1]["timestamp"].startswith("2024-03-01T12:01:00")
+    assert rows[1]["response_time_ms"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_csv_starts_with_a_header_row(exported_user):
+    chunks = await collect(ExportFormat.CSV, user_id=exported_user.id)
+    rows = list(csv.reader(io.StringIO("".join(chunks))))
+    assert tuple(rows[0]) == EXPORT_COLUMNS
+    assert [row[2] for row in rows[1:]] == ENDPOINTS
+
+
+@pytest.mark.asyncio
+async def test_columnar_chunks_dictionary_encode_endpoints(exported_user):
+    chunks = await collect(ExportFormat.COLUMNAR, user_id=exported_user.id, chunk_size=2)
+    header, *groups = [json.loads(chunk) for chunk in chunks]
+    assert header["dictionary_encoded"] == ["endpoint", "method"]
+    assert [group["rows"] for group in groups] == [2, 2, 1]
+
+    endpoints = []
+    for group in groups:
+        encoded = group["columns"]["endpoint"]
+        endpoints += [encoded["dictionary"][code] for code in encoded["codes"]]
+    assert endpoints == ENDPOINTS
+    assert groups[1]["columns"]["endpoint"] == {"dictionary": ["/protected"], "codes": [0, 0]}
+
+
+@pytest.mark.asyncio
+async def test_start_is_inclusive_and_end_exclusive(exported_user):
+    chunks = await collect(ExportFormat.NDJSON, user_id=exported_user.id,
+                           start=START + timedelta(minutes=1), end=START + timedelta(minutes=3))
+    assert [json.loads(line)["endpoint"] for line in "".join(chunks).splitlines()] == ENDPOINTS[1:3]
+
+
+def test_the_endpoint_streams_an_attachment(client, admin_headers, user_tokens):
+    response = client.get("/admin/usage/export", headers=admin_headers, params={
+        "format": "csv", "start": "2024-03-01T00:00:00", "end": "2024-04-01T00:00:00", "user_id": 10 ** 9,
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="usage_20240301_20240401.csv"'
+    assert response.text.splitlines() == [",".join(EXPORT_COLUMNS)]
+
+    assert client.get("/admin/usage/export", headers=bearer(user_tokens)).status_code == 403
@@ -0,0 +1,82 @@
+import json
+from datetime import datetime, timedelta
+from app.core.pagination import encode_cursor
+from app.services.retention import usage_retention
+from helpers import bearer
+
+
+def ndjson(events):
+    return "\n".join(json.dumps(event) for event in events)
+
+
+def event(user_id, **fields):
+    return {"user_id": user_id, "endpoint": "/v1/search", "method": "GET", "status_code": 200, **fields}
+
+
+def post_events(client, headers, events):
+    return client.post(
+        "/admin/usage/events",
+        content=ndjson(events),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+
+
+def total_requests(client, headers, user_id):
+    """The user's lifetime total from GET /admin/usage"""
+    response = client.get(f"/admin/usage?limit=1&cursor={encode_cursor(user_id - 1)}", headers=headers)
+    assert response.status_code == 200, response.text
+    (row,) = response.json()
+    assert row["user_id"] == user_id
+    return row["total_requests"]
+
+
+def test_events_are_stored_and_rolled_up(client, admin_headers, register):
+    _, _, user = register()
+    now = datetime.utcnow()
+    response = post_events(client, admin_headers, [
+        event(user["id"], timestamp=(now - timedelta(minutes=n)).isoformat() + "Z", response_time_ms=12.5)
+        for n in range(3)
+    ])
+
+    assert response.status_code == 200, response.text
+    assert response.json() == {"accepted": 3}
+    assert total_requests(client, admin_headers, user["id"]) == 3
+
+
+def test_one_invalid_event_rejects_the_batch(client, admin_headers, register):
+    _, _, user = register()
+    response = post_events(client, admin_headers, [event(user["id"]), event(user["id"], method="get")])
+
+    assert response.status_code == 422
+    detail = response.json()["detail"]
+    assert detail["invalid_events"] == 1
+    assert detail["errors"] == [{"index": 1, "field": "method", "error": "must be an upper-case HTTP method"}]
+    assert total_requests(client, admin_headers, user["id"]) == 0
+
+
+def test_unknown_users_are_rejected(client, admin_headers):
+    response = post_events(client, admin_headers, [event(10 ** 9)])
+    assert response.status_code == 422
+    assert response.json()["detail"]["errors"][0]["error"] == "unknown user"
+
+
+def test_timestamps_must_be_storable(client, admin_headers, register, monkeypatch):
+    _, _, user = register()
+    monkeypatch.setattr(usage_retention, "retention_days", 30)
+    now = datetime.utcnow()
+    response = post_events(client, admin_headers, [
+        event(user["id"], timestamp=(now - timedelta(days=29)).isoformat()),
+        event(user["id"], timestamp=(now - timedelta(days=31)).isoformat()),
+        event(user["id"], timestamp=(now + timedelta(hours=1)).isoformat()),
+    ])
+
+    assert response.status_code == 422
+    errors = {error["index"]: error["error"] for error in response.json()["detail"]["errors"]}
+    assert errors[1].startswith("is older than the earliest storable time")
+    assert errors[2] == "is in the future"
+    assert 0 not in errors
+
+
+def test_ingest_requires_an_admin(client, user_tokens):
+    response = post_events(client, bearer(user_tokens), [])
+    assert response.status_code == 403
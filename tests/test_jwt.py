@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi import HTTPException
+from app.core import security
+from app.core.config import settings
+from app.core.security import (
+    InvalidTokenError, JoseBackend, PyJWTBackend, create_access_token, create_refresh_token,
+    decode_token, verify_token,
+)
+
+
+def es256_keys():
+    key = ec.generate_private_key(ec.SECP256R1())
+    private = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private, public
+
+
+@pytest.mark.parametrize("algorithm", ["HS256", "ES256"])
+def test_the_backends_verify_each_others_tokens(algorithm):
+    if algorithm == "HS256":
+        signing = verifying = "secret"
+    else:
+        signing, verifying = es256_keys()
+    claims = {"sub": "ada", "exp": int(time.time()) + 60}
+    for encoder, decoder in [(JoseBackend(), PyJWTBackend()), (PyJWTBackend(), JoseBackend())]:
+        token = encoder.encode(claims, signing, algorithm)
+        assert decoder.decode(token, verifying, algorithm)["sub"] == "ada"
+        with pytest.raises(InvalidTokenError):
+            decoder.decode(token[:-4] + "AAAA", verifying, algorithm)
+
+
+@pytest.fixture
+def backend_calls(monkeypatch):
+    calls = []
+    decode = security.jwt_backend.decode
+
+    def counting_decode(*args):
+        calls.append(args[0])
+        return decode(*args)
+
+    monkeypatch.setattr(security.jwt_backend, "decode", counting_decode)
+    return calls
+
+
+def test_verified_tokens_are_not_verified_again(backend_calls):
+    token = create_access_token({"sub": "cached"})
+    assert decode_token(token)["sub"] == "cached"
+    assert decode_token(token)["sub"] == "cached"
+    assert backend_calls == [token]
+
+
+def test_tokens_past_their_expiry_are_verified_again(backend_calls, monkeypatch):
+    token = create_access_token({"sub": "expiring"}, expires_delta=timedelta(seconds=30))
+    decode_token(token)
+
+    now = time.time()
+    monkeypatch.setattr(security.time, "time", lambda: now + 31)
+    decode_token(token)
+    # The cached payload is not trusted past its exp, whatever the cache TTL
+    assert backend_calls == [token, token]
+
+
+def test_verify_token_checks_the_type_and_signature():
+    refresh = create_refresh_token({"sub": "ada"})
+    with pytest.raises(HTTPException) as excinfo:
+        verify_token(refresh, "access")
+    assert excinfo.value.status_code == 401
+    assert verify_token(refresh, "refresh")["sub"] == "ada"
+
+    with pytest.raises(HTTPException):
+        verify_token(create_access_token({"sub": "ada"}) + "x")
+
+
+def test_tokens_signed_with_another_key_are_refused(monkeypatch):
+    token = create_access_token({"sub": "ada"})
+    monkeypatch.setattr(settings, "secret_key", "rotated")
+    security.verified_token_cache.clear()
+    with pytest.raises(HTTPException):
+        verify_token(token)
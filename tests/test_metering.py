@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app.db.models import Subscription, SubscriptionPlan, UsageReport
+from app.services.metering import FAILED, PENDING, SENT, MeteredUsageReporter
+from app.services.usage import UsageRecord, write_usage
+
+# Runs capture the two days before this
+NOW = datetime(2024, 3, 10, 12)
+WINDOW = datetime(2024, 3, 9)
+
+
+class Sender:
+    """Stands in for the Stripe call, recording what would be sent"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.sent = []
+
+    def __call__(self, record: dict):
+        if self.fail:
+            raise RuntimeError("provider unavailable")
+        self.sent.append((record["user_id"], record["subscription_item_id"], record["quantity"]))
+
+
+def make_reporter(sender, max_attempts: int = 3) -> MeteredUsageReporter:
+    return MeteredUsageReporter(
+        window="day", lookback_windows=2, batch_size=2, concurrency=2,
+        max_attempts=max_attempts, interval=3600, dry_run=False, sender=sender,
+    )
+
+
+@pytest.fixture
+def billed_user(db, make_user):
+    """await billed_user(*(status, item id)) adds a PRO user with those subscriptions, oldest first"""
+    async def add_billed_user(*subscriptions) -> int:
+        user = await make_user("metered", subscription_plan=SubscriptionPlan.PRO)
+        for status, item_id in subscriptions:
+            db.add(Subscription(user_id=user.id, plan=SubscriptionPlan.PRO, status=status,
+                                stripe_subscription_item_id=item_id))
+            await db.flush()
+        await db.commit()
+        return user.id
+    return add_billed_user
+
+
+async def use(db, user_id: int, count: int, day: datetime = WINDOW):
+    await write_usage(db, [
+        UsageRecord(user_id, "/protected", "GET", 200, day + timedelta(minutes=n), 5.0) for n in range(count)
+    ])
+    await db.commit()
+
+
+async def reports(db, user_id: int):
+    return (await db.scalars(
+        select(UsageReport).where(UsageReport.user_id == user_id).order_by(UsageReport.window_start)
+        .execution_options(populate_existing=True)
+    )).all()
+
+
+@pytest.mark.asyncio
+async def test_one_report_per_user_and_window_from_the_newest_live_subscription(db, billed_user):
+    user_id = await billed_user(("active", "si_old"), ("past_due", "si_new"), ("canceled", "si_gone"))
+    await use(db, user_id, 7)
+
+    await make_reporter(Sender()).capture(db, NOW)
+    await db.commit()
+
+    (report,) = await reports(db, user_id)
+    assert (report.window_start, report.subscription_item_id, report.quantity) == (WINDOW, "si_new", 7)
+
+
+@pytest.mark.asyncio
+async def test_users_without_a_billable_subscription_are_not_captured(db, billed_user):
+    canceled = await billed_user(("canceled", "si_canceled"))
+    unmetered = await billed_user(("active", None))
+    for user_id in (canceled, unmetered):
+        await use(db, user_id, 3)
+
+    await make_reporter(Sender()).capture(db, NOW)
+    await db.commit()
+
+    assert await reports(db, canceled) == []
+    assert await reports(db, unmetered) == []
+
+
+@pytest.mark.asyncio
+async def test_reports_are_sent_once_and_resent_after_late_usage(db, billed_user):
+    user_id = await billed_user(("active", "si_metered"))
+    await use(db, user_id, 4)
+    sender = Sender()
+    reporter = make_reporter(sender)
+
+    await reporter.run_once(NOW)
+    await reporter.run_once(NOW)
+    assert [sent for sent in sender.sent if sent[0] == user_id] == [(user_id, "si_metered", 4)]
+
+    # Usage that arrives after the window was reported updates the total
+    await use(db, user_id, 2)
+    await reporter.run_once(NOW)
+    assert [sent for sent in sender.sent if sent[0] == user_id] == [
+        (user_id, "si_metered", 4), (user_id, "si_metered", 6)
+    ]
+    (report,) = await reports(db, user_id)
+    assert (report.status, report.reported_quantity) == (SENT, 6)
+
+
+@pytest.mark.asyncio
+async def test_failed_sends_are_retried_until_max_attempts(db, billed_user):
+    user_id = await billed_user(("active", "si_failing"))
+    await use(db, user_id, 1)
+    reporter = make_reporter(Sender(fail=True), max_attempts=2)
+
+    await reporter.run_once(NOW)
+    (report,) = await reports(db, user_id)
+    assert (report.status, report.attempts) == (PENDING, 1)
+    assert report.last_error == "RuntimeError: provider unavailable"
+
+    await reporter.run_once(NOW)
+    (report,) = await reports(db, user_id)
+    assert (report.status, report.attempts) == (FAILED, 2)
+
+
+@pytest.mark.asyncio
+async def test_dry_run_captures_nothing(db, billed_user):
+    user_id = await billed_user(("active", "si_dry"))
+    await use(db, user_id, 5, day=WINDOW - timedelta(days=1))
+    sender = Sender()
+
+    result = await make_reporter(sender).run_once(NOW, dry_run=True)
+
+    assert result["dry_run"] and result["records"] >= 1
+    assert sender.sent == []
+    assert await reports(db, user_id) == []
@@ -0,0 +1,57 @@
+from app.core.config import settings
+from app.core.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram(buckets=(1, 10))
+    for value in (0.5, 1, 3, 50):
+        histogram.observe(value)
+
+    assert histogram.snapshot() == {"count": 4, "sum": 54.5, "buckets": {"1": 2, "10": 3, "+Inf": 4}}
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests", "Requests served", ("route",))
+    latency = registry.histogram("latency_ms", "Latency", buckets=(5,))
+    registry.gauge("queue_depth", "Queued items", lambda: 3)
+    # The same name gives back the same metric
+    assert registry.counter("requests", "Requests served", ("route",)) is requests
+
+    requests.labels('/say "hi"\n').inc()
+    requests.labels('/say "hi"\n').inc(2)
+    latency.labels().observe(7.5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests Requests served",
+        "# TYPE requests counter",
+        'requests_total{route="/say \\"hi\\"\\n"} 3',
+        "# HELP latency_ms Latency",
+        "# TYPE latency_ms histogram",
+        'latency_ms_bucket{le="5"} 0',
+        'latency_ms_bucket{le="+Inf"} 1',
+        "latency_ms_sum 7.5",
+        "latency_ms_count 1",
+        "# HELP queue_depth Queued items",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3",
+    ]
+
+
+def test_a_failing_gauge_is_left_out_of_the_scrape():
+    registry = MetricsRegistry()
+    registry.gauge("broken", "Raises", lambda: 1 / 0)
+    registry.gauge("working", "Fine", lambda: 1.5)
+
+    assert registry.render().splitlines() == ["# HELP working Fine", "# TYPE working gauge", "working 1.5"]
+
+
+def test_the_endpoint_exposes_request_latency(client, monkeypatch):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_milliseconds_count{route="/health",method="GET"}' in response.text
+    assert "password_hash_pending " in response.text
+
+    monkeypatch.setattr(settings, "metrics_enabled", False)
+    assert client.get("/metrics").status_code == 404
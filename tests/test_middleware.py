@@ -0,0 +1,119 @@
+from datetime import datetime
+from sqlalchemy import func, select
+from app.core.plans import PlanLimits, plan_catalogue
+from app.core.quota import quota_counter
+from app.db.models import SubscriptionPlan, UsageLog
+from app.services.usage import UNMATCHED_ROUTE, UsageRecord, usage_buffer, write_usage
+from app.db.session import AsyncSessionLocal
+from helpers import bearer
+
+
+def quota_used(client, user_id):
+    # A zero-cost consume reports usage without changing it
+    return client.portal.call(quota_counter.consume, user_id, 10 ** 9, 0)[1]
+
+
+def usage(client, tokens):
+    client.portal.call(usage_buffer.flush)
+    response = client.get("/users/usage", headers=bearer(tokens))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def usage_logs(client, tokens):
+    client.portal.call(usage_buffer.flush)
+    response = client.get("/users/usage/logs", headers=bearer(tokens))
+    assert response.status_code == 200, response.text
+    return [(log["endpoint"], log["method"], log["status_code"]) for log in response.json()]
+
+
+def test_requests_are_recorded_under_their_route_template(client, admin_headers, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    client.get("/protected", headers=bearer(tokens))
+    # An admin's request to a templated path
+    client.put(f"/admin/users/{10 ** 9}/role?new_role=USER", headers=admin_headers)
+
+    assert usage_logs(client, tokens) == [("/protected", "GET", 200)]
+    client.portal.call(usage_buffer.flush)
+    metrics = client.get("/metrics").text
+    assert 'route="/admin/users/{user_id}/role",method="PUT",status="404"' in metrics
+
+
+def test_weighted_endpoints_cost_more_of_the_allowance(client, user_tokens, monkeypatch):
+    limits = PlanLimits(SubscriptionPlan.FREE, requests_per_minute=60, monthly_quota=1000,
+                        endpoint_costs={"/protected": 5})
+    monkeypatch.setattr(plan_catalogue, "get", lambda plan: limits)
+
+    first = client.get("/protected", headers=bearer(user_tokens))
+    other = client.get("/auth/me", headers=bearer(user_tokens))
+    assert first.headers["X-RateLimit-Remaining"] == "55"
+    assert other.headers["X-RateLimit-Remaining"] == "54"
+
+
+def test_requests_rejected_by_the_limiter_are_not_routed_or_recorded(client, register, login, monkeypatch):
+    username, password, user = register()
+    tokens = login(username, password)
+    limits = PlanLimits(SubscriptionPlan.FREE, requests_per_minute=1, monthly_quota=1000)
+    monkeypatch.setattr(plan_catalogue, "get", lambda plan: limits)
+    client.get("/protected", headers=bearer(tokens))
+    assert client.get("/protected", headers=bearer(tokens)).status_code == 429
+    monkeypatch.undo()
+
+    assert usage_logs(client, tokens) == [("/protected", "GET", 200)]
+    assert 'route="<rejected>",method="GET",status="429"' in client.get("/metrics").text
+
+
+def test_anonymous_and_suspended_callers_are_neither_limited_nor_metered(client, admin_headers, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    client.put(f"/admin/users/{user['id']}/suspend", headers=admin_headers)
+
+    response = client.get("/protected", headers=bearer(tokens))
+    assert response.status_code in (400, 401)
+    assert "X-RateLimit-Limit" not in response.headers
+    assert "X-RateLimit-Limit" not in client.get("/protected", headers=bearer("not-a-token")).headers
+
+    async def logged():
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(func.count()).select_from(UsageLog).where(UsageLog.user_id == user["id"]))
+
+    client.portal.call(usage_buffer.flush)
+    assert client.portal.call(logged) == 0
+
+
+def test_unmatched_routes_are_not_charged_or_recorded(client, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    client.get("/protected", headers=bearer(tokens))
+    for path in ("/no-such-route", "/users/999/nothing", "/protected/typo"):
+        assert client.get(path, headers=bearer(tokens)).status_code == 404
+
+    assert quota_used(client, user["id"]) == 1
+    summary = usage(client, tokens)
+    # /users/usage itself is recorded only after it has been answered
+    assert summary["total_requests"] == 1
+    assert summary["most_used_endpoint"] == "/protected"
+
+
+def test_unmatched_routes_still_count_against_the_minute_limit(client, user_tokens):
+    response = client.get("/no-such-route", headers=bearer(user_tokens))
+    assert response.status_code == 404
+    second = client.get("/protected", headers=bearer(user_tokens))
+    assert int(second.headers["X-RateLimit-Remaining"]) == int(response.headers["X-RateLimit-Remaining"]) - 1
+
+
+def test_previously_recorded_unmatched_usage_is_not_the_most_used_endpoint(client, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+
+    async def record_unmatched():
+        async with AsyncSessionLocal() as db:
+            await write_usage(db, [
+                UsageRecord(user["id"], endpoint, "GET", 404 if endpoint == UNMATCHED_ROUTE else 200, datetime.utcnow())
+                for endpoint in [UNMATCHED_ROUTE] * 3 + ["/protected"]
+            ])
+            await db.commit()
+
+    client.portal.call(record_unmatched)
+    assert usage(client, tokens)["most_used_endpoint"] == "/protected"
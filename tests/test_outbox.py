@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from datetime import datetime
+import pytest
+from sqlalchemy import select, update
+from app.core.config import settings
+from app.db.models import OutboxMessage, Subscription, SubscriptionPlan, User, WebhookEvent
+from app.db.session import AsyncSessionLocal
+from app.services.billing import billing_worker
+from app.services.outbox import DONE, FAILED, PENDING, OutboxWorker, after_commit, enqueue, record_webhook
+from helpers import bearer
+
+
+def signature(payload: bytes, secret: str = None, timestamp: int = None) -> str:
+    """A Stripe-Signature header for payload"""
+    timestamp = timestamp or int(time.time())
+    digest = hmac.new(
+        (secret or settings.stripe_webhook_secret).encode(), f"{timestamp}.".encode() + payload, hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def webhook_event(event_type: str, data: dict) -> bytes:
+    return json.dumps({"id": f"evt_{uuid.uuid4().hex}", "type": event_type, "data": {"object": data}}).encode()
+
+
+def post_webhook(client, payload: bytes, header=None):
+    headers = {"Content-Type": "application/json"}
+    if header is not None:
+        headers["Stripe-Signature"] = header
+    return client.post("/billing/webhook", content=payload, headers=headers)
+
+
+def make_worker(max_attempts: int = 3) -> OutboxWorker:
+    return OutboxWorker(concurrency=1, poll_interval=1.0, batch_size=100, lease_seconds=60.0, max_attempts=max_attempts)
+
+
+async def make_due(db, message_id: int):
+    """Skip the retry backoff"""
+    await db.execute(update(OutboxMessage).where(OutboxMessage.id == message_id).values(next_attempt_at=datetime.utcnow()))
+    await db.commit()
+
+
+async def enqueue_message(db, kind: str, payload: dict) -> int:
+    enqueue(db, kind, payload)
+    await db.commit()
+    return (await db.scalars(
+        select(OutboxMessage.id).where(OutboxMessage.kind == kind).order_by(OutboxMessage.id.desc())
+    )).first()
+
+
+async def message(message_id: int) -> OutboxMessage:
+    async with AsyncSessionLocal() as db:
+        return await db.get(OutboxMessage, message_id)
+
+
+def test_unsigned_webhooks_are_rejected(client, monkeypatch):
+    payload = webhook_event("customer.subscription.created", {"customer": "cus_nobody"})
+    assert post_webhook(client, payload).status_code == 400
+    assert post_webhook(client, payload, "t=1,v1=deadbeef").status_code == 400
+    assert post_webhook(client, payload, signature(payload, secret="whsec_other")).status_code == 400
+
+    monkeypatch.setattr(settings, "stripe_webhook_secret", None)
+    assert post_webhook(client, payload, signature(payload, secret="whsec_test")).status_code == 503
+
+
+def test_redelivered_webhooks_are_reported_as_duplicates(client):
+    payload = webhook_event("invoice.paid", {"customer": "cus_nobody"})
+    first = post_webhook(client, payload, signature(payload))
+    second = post_webhook(client, payload, signature(payload))
+
+    assert first.status_code == 200
+    assert first.json() == {"received": True, "duplicate": False}
+    assert second.json() == {"received": True, "duplicate": True}
+
+
+def test_subscription_webhooks_are_applied_by_the_worker(client, user_tokens):
+    customer_id = f"cus_{uuid.uuid4().hex[:14]}"
+
+    async def set_customer():
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(User).where(User.username == user_tokens["username"]).values(stripe_customer_id=customer_id)
+            )
+            await db.commit()
+
+    client.portal.call(set_customer)
+    headers = bearer(user_tokens)
+    assert client.get("/auth/me", headers=headers).json()["subscription_plan"] == "FREE"
+
+    payload = webhook_event("customer.subscription.created", {
+        "id": "sub_test", "customer": customer_id, "items": {"data": [{"id": "si_test"}]}
+    })
+    assert post_webhook(client, payload, signature(payload)).status_code == 200
+
+    deadline = time.monotonic() + 5
+    plan = None
+    while time.monotonic() < deadline and plan != "PRO":
+        time.sleep(0.05)
+        plan = client.get("/auth/me", headers=headers).json()["subscription_plan"]
+    # The worker invalidates the cached principal once the change is committed
+    assert plan == "PRO"
+
+
+@pytest.mark.asyncio
+async def test_webhook_events_are_recorded_once(db):
+    event = {"id": f"evt_{uuid.uuid4().hex}", "type": "invoice.paid"}
+    assert await record_webhook(db, event)
+    assert not await record_webhook(db, event)
+    await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_failed_messages_are_retried_with_the_same_idempotency_key(db):
+    kind = f"test_retry_{uuid.uuid4().hex[:8]}"
+    worker = make_worker()
+    keys = []
+
+    @worker.outbox_handler(kind)
+    async def flaky(session, payload, idempotency_key):
+        keys.append(idempotency_key)
+        if len(keys) == 1:
+            raise RuntimeError("provider timed out")
+
+    message_id = await enqueue_message(db, kind, {"n": 1})
+    assert message_id in await worker.claim(OutboxMessage)
+    await worker.process(OutboxMessage, message_id)
+
+    row = await message(message_id)
+    assert row.status == PENDING
+    assert row.last_error == "RuntimeError: provider timed out"
+    # Backed off rather than retried straight away
+    assert row.next_attempt_at > datetime.utcnow()
+    assert message_id not in await worker.claim(OutboxMessage)
+
+    await make_due(db, message_id)
+    assert message_id in await worker.claim(OutboxMessage)
+    await worker.process(OutboxMessage, message_id)
+
+    row = await message(message_id)
+    assert row.status == DONE
+    assert row.attempts == 2
+    assert row.last_error is None
+    assert keys == [f"outbox-{message_id}"] * 2
+    assert (worker.retried, worker.processed) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_messages_fail_after_max_attempts(db):
+    kind = f"test_fail_{uuid.uuid4().hex[:8]}"
+    worker = make_worker(max_attempts=2)
+
+    @worker.outbox_handler(kind)
+    async def broken(session, payload, idempotency_key):
+        raise ValueError("rejected")
+
+    message_id = await enqueue_message(db, kind, {})
+    for _ in range(2):
+        await make_due(db, message_id)
+        assert message_id in await worker.claim(OutboxMessage)
+        await worker.process(OutboxMessage, message_id)
+
+    row = await message(message_id)
+    assert row.status == FAILED
+    assert worker.failed == 1
+    # Failed messages are not claimed again
+    await make_due(db, message_id)
+    assert message_id not in await worker.claim(OutboxMessage)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_polls_claim_each_message_once(db):
+    kind = f"test_claim_{uuid.uuid4().hex[:8]}"
+    message_ids = {await enqueue_message(db, kind, {"n": n}) for n in range(5)}
+    workers = [make_worker() for _ in range(3)]
+
+    claims = await asyncio.gather(*(worker.claim(OutboxMessage) for worker in workers))
+
+    claimed = [message_id for batch in claims for message_id in batch if message_id in message_ids]
+    assert sorted(claimed) == sorted(message_ids)
+    async with AsyncSessionLocal() as session:
+        attempts = (await session.scalars(
+            select(OutboxMessage.attempts).where(OutboxMessage.id.in_(message_ids))
+        )).all()
+    assert attempts == [1] * 5
+
+
+@pytest.mark.asyncio
+async def test_after_commit_callbacks_run_only_when_the_handler_commits(db):
+    kind = f"test_callback_{uuid.uuid4().hex[:8]}"
+    worker = make_worker(max_attempts=1)
+    message_ids = {}
+    seen = []
+
+    @worker.outbox_handler(kind)
+    async def handler(session, payload, idempotency_key):
+        async def callback():
+            # By now the message is committed as done
+            seen.append((payload["n"], (await message(message_ids[payload["n"]])).status))
+        after_commit(session, callback)
+        if payload["n"] == 1:
+            raise RuntimeError("handler failed")
+
+    for n in (0, 1):
+        message_ids[n] = await enqueue_message(db, kind, {"n": n})
+    claimed = await worker.claim(OutboxMessage)
+    for message_id in message_ids.values():
+        assert message_id in claimed
+        await worker.process(OutboxMessage, message_id)
+
+    assert seen == [(0, DONE)]
+    assert (await message(message_ids[1])).status == FAILED
+
+
+async def deliver(db, event_type: str, subscription_id: str, customer: str, created: int, **data) -> int:
+    """Store a webhook and apply it with the billing worker's handlers; returns its row id
+
+    Subscription ids are suffixed with the customer, so tests sharing the database never collide.
+    """
+    event = {
+        "id": f"evt_{uuid.uuid4().hex}", "type": event_type, "created": created,
+        "data": {"object": {"id": f"{subscription_id}_{customer}", "customer": customer, **data}},
+    }
+    await record_webhook(db, event)
+    await db.commit()
+    row_id = (await db.scalars(select(WebhookEvent.id).where(WebhookEvent.event_id == event["id"]))).one()
+    await billing_worker.process(WebhookEvent, row_id)
+    return row_id
+
+
+async def webhook_row(row_id: int) -> WebhookEvent:
+    async with AsyncSessionLocal() as db:
+        return await db.get(WebhookEvent, row_id)
+
+
+async def plan_and_subscriptions(user_id: int):
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, user_id)
+        subscriptions = (await db.execute(
+            select(Subscription.stripe_subscription_id, Subscription.status)
+            .where(Subscription.user_id == user_id).order_by(Subscription.id)
+        )).all()
+        suffix = f"_{user.stripe_customer_id}"
+        return user.subscription_plan, [(row[0].removesuffix(suffix), row[1]) for row in subscriptions]
+
+
+@pytest.mark.asyncio
+async def test_a_delete_delivered_before_its_create_is_applied_after_it(db, make_user):
+    user = await make_user("stripe", stripe_customer_id=f"cus_{uuid.uuid4().hex[:14]}")
+    customer = user.stripe_customer_id
+
+    deleted = await deliver(db, "customer.subscription.deleted", "sub_1", customer, created=200)
+    row = await webhook_row(deleted)
+    # Left pending for a retry rather than acknowledged
+    assert row.status == PENDING
+    assert row.last_error.startswith("RetryLater")
+
+    await deliver(db, "customer.subscription.created", "sub_1", customer, created=100)
+    assert await plan_and_subscriptions(user.id) == (SubscriptionPlan.PRO, [("sub_1", "active")])
+
+    await billing_worker.process(WebhookEvent, deleted)
+    assert (await webhook_row(deleted)).status == DONE
+    assert await plan_and_subscriptions(user.id) == (SubscriptionPlan.FREE, [("sub_1", "canceled")])
+
+
+@pytest.mark.asyncio
+async def test_events_older_than_the_last_applied_are_ignored(db, make_user):
+    user = await make_user("stripe", stripe_customer_id=f"cus_{uuid.uuid4().hex[:14]}")
+    customer = user.stripe_customer_id
+    await deliver(db, "customer.subscription.created", "sub_1", customer, created=100)
+    await deliver(db, "customer.subscription.updated", "sub_1", customer, created=300, status="past_due")
+
+    stale = await deliver(db, "customer.subscription.updated", "sub_1", customer, created=200, status="active")
+    assert (await webhook_row(stale)).status == DONE
+    assert await plan_and_subscriptions(user.id) == (SubscriptionPlan.PRO, [("sub_1", "past_due")])
+
+
+@pytest.mark.asyncio
+async def test_a_late_delete_only_cancels_the_subscription_it_names(db, make_user):
+    user = await make_user("stripe", stripe_customer_id=f"cus_{uuid.uuid4().hex[:14]}")
+    customer = user.stripe_customer_id
+    await deliver(db, "customer.subscription.created", "sub_old", customer, created=100)
+    await deliver(db, "customer.subscription.created", "sub_new", customer, created=200)
+
+    await deliver(db, "customer.subscription.deleted", "sub_old", customer, created=300)
+    assert await plan_and_subscriptions(user.id) == (
+        SubscriptionPlan.PRO, [("sub_old", "canceled"), ("sub_new", "active")]
+    )
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from app.core.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, page_size
+from app.db.session import AsyncSessionLocal
+from app.services.usage import UsageRecord, write_usage
+from helpers import bearer, walk_pages
+
+
+def test_cursors_round_trip_their_sort_key():
+    stamp = datetime(2024, 5, 1, 12, 30)
+    assert decode_cursor(encode_cursor(stamp, 7), (datetime, int)) == (stamp, 7)
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor("7"), encode_cursor(True), encode_cursor(1, 2)])
+def test_malformed_cursors_are_a_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor, (int,))
+    assert excinfo.value.status_code == 400
+
+
+def test_page_sizes_are_bounded():
+    assert page_size(MAX_PAGE_SIZE) == MAX_PAGE_SIZE
+    for limit in (0, MAX_PAGE_SIZE + 1):
+        with pytest.raises(HTTPException):
+            page_size(limit)
+
+
+def test_admin_user_pages_cover_every_user_once(client, admin_headers, register):
+    registered = {register()[2]["id"] for _ in range(3)}
+
+    pages = walk_pages(client, "/admin/users", admin_headers, limit=2)
+    ids = [user["id"] for page in pages for user in page]
+    assert all(len(page) <= 2 for page in pages)
+    assert ids == sorted(set(ids))
+    assert registered <= set(ids)
+    # The legacy offset still works
+    offset = client.get("/admin/users", params={"skip": 1, "limit": 2}, headers=admin_headers).json()
+    assert [user["id"] for user in offset] == ids[1:3]
+
+
+def test_usage_log_pages_run_newest_first_across_equal_timestamps(client, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    now = datetime.utcnow().replace(microsecond=0)
+    # Two requests in the same instant are ordered by id
+    stamps = [now - timedelta(seconds=2), now - timedelta(seconds=1), now, now, now - timedelta(seconds=3)]
+
+    async def record():
+        async with AsyncSessionLocal() as db:
+            await write_usage(db, [UsageRecord(user["id"], f"/e{n}", "GET", 200, stamp) for n, stamp in enumerate(stamps)])
+            await db.commit()
+
+    client.portal.call(record)
+    pages = walk_pages(client, "/users/usage/logs", bearer(tokens), limit=2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [log["endpoint"] for page in pages for log in page] == ["/e3", "/e2", "/e1", "/e0", "/e4"]
+
+
+def test_bad_cursors_and_limits_are_rejected(client, user_tokens):
+    for params in ({"cursor": "garbage"}, {"limit": 0}, {"limit": MAX_PAGE_SIZE + 1}):
+        assert client.get("/users/usage/logs", params=params, headers=bearer(user_tokens)).status_code == 400
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from app.core import security
+from app.core.security import PasswordHasher
+
+
+@pytest.mark.asyncio
+async def test_hashing_runs_on_the_worker_pool(monkeypatch):
+    hasher = PasswordHasher(workers=2, queue_limit=2)
+    threads = []
+    hash_password = security.get_password_hash
+
+    def get_password_hash(password):
+        threads.append(threading.current_thread().name)
+        return hash_password(password)
+
+    monkeypatch.setattr(security, "get_password_hash", get_password_hash)
+    try:
+        hashed = await hasher.hash("correct-horse")
+        assert await hasher.verify("correct-horse", hashed)
+        assert not await hasher.verify("wrong-horse", hashed)
+    finally:
+        hasher.shutdown()
+    assert threads[0].startswith("password-hash")
+    assert hasher.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_calls_beyond_the_queue_limit_are_rejected_with_503(monkeypatch):
+    hasher = PasswordHasher(workers=1, queue_limit=1)
+    release = threading.Event()
+
+    def get_password_hash(password):
+        release.wait(5)
+        return password
+
+    monkeypatch.setattr(security, "get_password_hash", get_password_hash)
+    try:
+        # One running, one queued behind it
+        in_flight = [asyncio.create_task(hasher.hash(str(n))) for n in range(2)]
+        await asyncio.sleep(0)
+        assert hasher.pending == 2
+
+        with pytest.raises(HTTPException) as excinfo:
+            await hasher.hash("third")
+        assert excinfo.value.status_code == 503
+        assert excinfo.value.headers["Retry-After"] == "1"
+        assert hasher.rejected == 1
+
+        release.set()
+        assert await asyncio.gather(*in_flight) == ["0", "1"]
+        assert hasher.pending == 0
+        assert await hasher.hash("fourth") == "fourth"
+    finally:
+        release.set()
+        hasher.shutdown()
@@ -0,0 +1,45 @@
+from itertools import count
+from types import SimpleNamespace
+from sqlalchemy import select
+from app.core import security
+from app.core.security import BCRYPT_MAX_ROUNDS, BCRYPT_MIN_ROUNDS, calibrate_bcrypt_rounds, configure_password_hashing
+from app.db.models import User
+from app.db.session import AsyncSessionLocal
+
+
+def stored_hash(client, user_id):
+    async def load():
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(User.hashed_password).where(User.id == user_id))
+    return client.portal.call(load)
+
+
+def test_calibration_picks_the_highest_cost_within_the_target(monkeypatch):
+    # Every hash at the minimum cost appears to take 10ms
+    ticks = count()
+    monkeypatch.setattr(security, "time", SimpleNamespace(perf_counter=lambda: next(ticks) * 0.010))
+
+    assert calibrate_bcrypt_rounds(80) == BCRYPT_MIN_ROUNDS + 3
+    ticks = count()
+    assert calibrate_bcrypt_rounds(79) == BCRYPT_MIN_ROUNDS + 2
+    ticks = count()
+    assert calibrate_bcrypt_rounds(5) == BCRYPT_MIN_ROUNDS
+    ticks = count()
+    assert calibrate_bcrypt_rounds(10 ** 9) == BCRYPT_MAX_ROUNDS
+
+
+def test_login_upgrades_hashes_below_the_configured_cost(client, register, login, monkeypatch):
+    username, password, user = register()
+    old_hash = stored_hash(client, user["id"])
+    assert old_hash.startswith("$2b$04$")
+
+    monkeypatch.setattr(security, "pwd_context", security.pwd_context)
+    configure_password_hashing(5)
+    assert security.password_needs_rehash(old_hash)
+    login(username, password)
+
+    # Re-hashed after the response, with the same password
+    new_hash = stored_hash(client, user["id"])
+    assert new_hash.startswith("$2b$05$")
+    login(username, password)
+    assert stored_hash(client, user["id"]) == new_hash
@@ -0,0 +1,65 @@
+import pytest
+from app.core.plans import DEFAULT_PLANS, PlanCatalogue, plan_catalogue
+from app.db.models import SubscriptionPlan
+from helpers import bearer
+
+
+@pytest.fixture
+def restore_plans(client):
+    """Put the default PRO limits back; the plans table is shared by every test"""
+    yield
+    defaults = DEFAULT_PLANS[SubscriptionPlan.PRO]
+    client.portal.call(plan_catalogue.update_plan, SubscriptionPlan.PRO, defaults["requests_per_minute"],
+                       defaults["monthly_quota"], {})
+
+
+def pro_tokens(client, admin_headers, register, login):
+    username, password, user = register()
+    assert client.post(f"/admin/users/{user['id']}/subscription", headers=admin_headers).status_code == 200
+    return login(username, password)
+
+
+def test_the_defaults_apply_until_the_catalogue_is_loaded():
+    catalogue = PlanCatalogue(refresh_interval=60)
+    assert {limits.plan: (limits.requests_per_minute, limits.monthly_quota) for limits in catalogue.all()} == {
+        plan: (limits["requests_per_minute"], limits["monthly_quota"]) for plan, limits in DEFAULT_PLANS.items()
+    }
+    assert catalogue.get(SubscriptionPlan.PRO).cost("/protected") == 1
+
+
+def test_plan_changes_apply_to_the_next_request(client, admin_headers, register, login, restore_plans):
+    tokens = pro_tokens(client, admin_headers, register, login)
+    response = client.put("/admin/plans/PRO", headers=admin_headers, json={
+        "requests_per_minute": 120, "monthly_quota": 5000, "endpoint_costs": {"/protected": 4},
+    })
+    assert response.status_code == 200
+    assert response.json() == {"plan": "PRO", "requests_per_minute": 120, "monthly_quota": 5000,
+                               "endpoint_costs": {"/protected": 4}}
+
+    first = client.get("/protected", headers=bearer(tokens))
+    assert first.headers["X-RateLimit-Limit"] == "120"
+    assert first.headers["X-RateLimit-Remaining"] == "116"
+    plans = {plan["plan"]: plan for plan in client.get("/admin/plans", headers=admin_headers).json()["plans"]}
+    assert plans["PRO"]["monthly_quota"] == 5000
+
+    # Limits alone leave the endpoint costs as they were
+    client.put("/admin/plans/PRO", headers=admin_headers, json={"requests_per_minute": 100, "monthly_quota": 5000})
+    assert plan_catalogue.get(SubscriptionPlan.PRO).endpoint_costs == {"/protected": 4}
+
+
+def test_other_workers_see_a_change_once_they_reload(client, admin_headers, restore_plans):
+    other_worker = PlanCatalogue(refresh_interval=60)
+    client.portal.call(other_worker.load)
+    client.put("/admin/plans/PRO", headers=admin_headers, json={"requests_per_minute": 7, "monthly_quota": 70})
+
+    assert other_worker.get(SubscriptionPlan.PRO).requests_per_minute != 7
+    client.portal.call(other_worker.load)
+    assert other_worker.get(SubscriptionPlan.PRO).requests_per_minute == 7
+
+
+def test_invalid_limits_are_rejected(client, admin_headers, user_tokens):
+    for body in ({"requests_per_minute": 0, "monthly_quota": 10},
+                 {"requests_per_minute": 10, "monthly_quota": 10, "endpoint_costs": {"/protected": 0}}):
+        assert client.put("/admin/plans/PRO", headers=admin_headers, json=body).status_code == 422
+    assert client.put("/admin/plans/FREE", headers=bearer(user_tokens),
+                      json={"requests_per_minute": 1, "monthly_quota": 1}).status_code == 403
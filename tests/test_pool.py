@@ -0,0 +1,62 @@
+import os
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.core.config import settings
+from app.db.pool import InstrumentedAsyncQueuePool, PoolStats, pool_stats
+from app.db.session import engine_options
+from conftest import TEST_DIR
+from helpers import bearer
+
+
+def test_file_databases_are_pooled_from_settings():
+    options = engine_options("sqlite+aiosqlite:///./app.db")
+    assert options["pool_size"] == settings.db_pool_size
+    assert options["max_overflow"] == settings.db_max_overflow
+    assert options["pool_pre_ping"] == settings.db_pool_pre_ping
+    assert options["connect_args"] == {"check_same_thread": False}
+
+    # In-memory SQLite keeps its single shared connection
+    assert "pool_size" not in engine_options("sqlite+aiosqlite://")
+    assert "connect_args" not in engine_options("postgresql+asyncpg://db/saas")
+
+
+@pytest.mark.asyncio
+async def test_sqlite_connections_get_the_configured_pragmas(db):
+    assert (await db.scalar(text("PRAGMA journal_mode"))).upper() == settings.sqlite_journal_mode.upper()
+    assert await db.scalar(text("PRAGMA busy_timeout")) == settings.sqlite_busy_timeout_ms
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_count_checkouts_and_timeouts():
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{os.path.join(TEST_DIR, 'pool.db')}",
+        poolclass=InstrumentedAsyncQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05,
+    )
+    stats = PoolStats()
+    stats.install(engine.sync_engine.pool)
+    timeouts = pool_stats.timeouts
+    try:
+        async with engine.connect() as held:
+            await held.execute(text("SELECT 1"))
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect():
+                    pass
+        snapshot = stats.snapshot(engine.sync_engine.pool)
+    finally:
+        await engine.dispose()
+
+    assert pool_stats.timeouts == timeouts + 1
+    assert (snapshot["pool_class"], snapshot["size"], snapshot["checkedout"]) == ("InstrumentedAsyncQueuePool", 1, 0)
+    assert snapshot["checkouts"] == 1
+    assert snapshot["held_ms"]["count"] == 1
+
+
+def test_pool_usage_is_reported_to_admins(client, admin_headers, user_tokens):
+    response = client.get("/admin/db/pool", headers=admin_headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["config"]["pool_size"] == settings.db_pool_size
+    assert body["stats"]["checkouts"] >= 1
+
+    assert client.get("/admin/db/pool", headers=bearer(user_tokens)).status_code == 403
@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import update
+from app.core import principals
+from app.core.principals import Principal, PrincipalCache
+from app.db.models import SubscriptionPlan, User, UserRole
+from helpers import bearer
+
+
+async def set_role(db, user_id: int, role: UserRole):
+    await db.execute(update(User).where(User.id == user_id).values(role=role))
+    await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_principals_are_served_from_the_cache_until_invalidated(db, make_user):
+    user = await make_user("principal")
+    cache = PrincipalCache()
+    assert (await cache.get(user.username)).role == UserRole.USER
+
+    # Changes made without invalidating are not seen...
+    await set_role(db, user.id, UserRole.ADMIN)
+    assert (await cache.get(user.username)).role == UserRole.USER
+    # ...until the snapshot is dropped
+    await cache.invalidate(user.username)
+    assert (await cache.get(user.username)).role == UserRole.ADMIN
+
+
+@pytest.mark.asyncio
+async def test_unknown_users_are_not_cached(db):
+    cache = PrincipalCache()
+    assert await cache.get("nobody-by-that-name") is None
+    assert cache.local.get("nobody-by-that-name") is None
+
+
+def test_principals_round_trip_through_json():
+    principal = Principal(7, "ada", "ada@example.com", UserRole.ADMIN, True, SubscriptionPlan.PRO)
+    assert Principal.from_json(principal.to_json()) == principal
+
+
+@pytest.mark.asyncio
+async def test_the_shared_tier_spares_other_workers_the_database(db, make_user, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    redis_client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(principals, "get_redis_client", lambda: redis_client)
+    user = await make_user("principal")
+    first, second = PrincipalCache(shared=True), PrincipalCache(shared=True)
+    loaded = await first.get(user.username)
+
+    def no_database():
+        raise AssertionError("loaded from the database")
+
+    monkeypatch.setattr(principals, "AsyncSessionLocal", no_database)
+    assert await second.get(user.username) == loaded
+
+    # Invalidation on one worker removes the shared copy for all of them
+    await first.invalidate(user.username)
+    assert await redis_client.get(f"principal:{user.username}") is None
+
+
+def test_admin_changes_apply_to_the_next_request(client, admin_headers, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    assert client.get("/admin/stats", headers=bearer(tokens)).status_code == 403
+
+    client.put(f"/admin/users/{user['id']}/role?new_role=ADMIN", headers=admin_headers)
+    assert client.get("/admin/stats", headers=bearer(tokens)).status_code == 200
+
+    client.put(f"/admin/users/{user['id']}/suspend", headers=admin_headers)
+    assert client.get("/auth/me", headers=bearer(tokens)).status_code in (400, 401)
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from app.core.quota import QuotaCounter, ShardedQuotaStore, month_key, month_start
+from app.db.models import RateLimit
+
+
+async def stored_usage(db, user_id: int):
+    return (await db.execute(
+        select(RateLimit.current_monthly_usage, RateLimit.last_monthly_reset)
+        .where(RateLimit.user_id == user_id).execution_options(populate_existing=True)
+    )).one()
+
+
+async def add_rate_limit(db, user_id: int, used: int, reset: datetime):
+    db.add(RateLimit(user_id=user_id, user_id_unique=user_id, requests_per_minute=60, monthly_quota=1000,
+                     current_monthly_usage=used, last_monthly_reset=reset))
+    await db.commit()
+
+
+def test_requests_over_the_quota_are_refused_without_being_counted():
+    store = ShardedQuotaStore(shards=4)
+    assert store.consume("202401", 1, 3, cost=2) == (True, 2)
+    assert store.consume("202401", 1, 3, cost=2) == (False, 2)
+    assert store.consume("202401", 1, 3) == (True, 3)
+    # Counted per month and per user
+    assert store.consume("202402", 1, 3) == (True, 1)
+    assert store.consume("202401", 2, 3) == (True, 1)
+
+
+@pytest.mark.asyncio
+async def test_check_raises_403_once_the_quota_is_used():
+    # Without Redis, as here, the counter uses its in-process store
+    counter = QuotaCounter()
+    assert await counter.check(1, 2) == 1
+    assert await counter.check(1, 2) == 2
+    with pytest.raises(HTTPException) as excinfo:
+        await counter.check(1, 2)
+    assert excinfo.value.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_reconcile_adds_what_was_counted_since_the_last_run(db, make_user):
+    user = await make_user("quota")
+    counter = QuotaCounter()
+    for _ in range(3):
+        await counter.consume(user.id, 100)
+
+    assert await counter.reconcile() >= 1
+    usage, reset = await stored_usage(db, user.id)
+    assert (usage, reset) == (3, month_start(month_key()))
+
+    await counter.consume(user.id, 100, cost=2)
+    await counter.reconcile()
+    assert (await stored_usage(db, user.id))[0] == 5
+    # Nothing new to write
+    await counter.reconcile()
+    assert (await stored_usage(db, user.id))[0] == 5
+
+
+@pytest.mark.asyncio
+async def test_usage_stored_for_an_earlier_month_is_replaced(db, make_user):
+    user = await make_user("quota")
+    last_month = month_start(month_key()) - timedelta(days=1)
+    await add_rate_limit(db, user.id, 500, month_start(month_key(last_month)))
+    counter = QuotaCounter()
+
+    await counter.consume(user.id, 100)
+    await counter.reconcile()
+    assert await stored_usage(db, user.id) == (1, month_start(month_key()))
+
+
+@pytest.mark.asyncio
+async def test_counts_are_kept_when_persisting_fails(db, make_user, monkeypatch):
+    user = await make_user("quota")
+    counter = QuotaCounter()
+    await counter.consume(user.id, 100, cost=4)
+    persist = counter._persist
+
+    async def fail_once(*args):
+        monkeypatch.setattr(counter, "_persist", persist)
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(counter, "_persist", fail_once)
+    await counter.reconcile()
+    await counter.reconcile()
+    assert (await stored_usage(db, user.id))[0] == 4
+
+
+@pytest.mark.asyncio
+async def test_counters_start_from_the_reconciled_usage(db, make_user):
+    user = await make_user("quota")
+    await add_rate_limit(db, user.id, 998, month_start(month_key()))
+    counter = QuotaCounter()
+
+    await counter.load_from_db()
+    assert await counter.consume(user.id, 1000, cost=2) == (True, 1000)
+    assert await counter.consume(user.id, 1000) == (False, 1000)
@@ -0,0 +1,90 @@
+import pytest
+from fastapi import HTTPException
+from app.core.plans import plan_catalogue
+from app.core.rate_limit import SLIDING_WINDOW, TOKEN_BUCKET, MemoryBackend, RateLimiter
+from app.db.models import SubscriptionPlan
+from helpers import bearer
+
+
+def test_responses_carry_rate_limit_headers(client, user_tokens):
+    limit = plan_catalogue.get(SubscriptionPlan.FREE).requests_per_minute
+    first = client.get("/protected", headers=bearer(user_tokens))
+    second = client.get("/protected", headers=bearer(user_tokens))
+
+    assert first.status_code == 200
+    assert first.headers["X-RateLimit-Limit"] == str(limit)
+    assert int(first.headers["X-RateLimit-Remaining"]) == limit - 1
+    assert int(second.headers["X-RateLimit-Remaining"]) == limit - 2
+    assert int(first.headers["X-RateLimit-Reset"]) <= 60
+    assert "Retry-After" not in first.headers
+
+
+def test_anonymous_and_unmetered_requests_are_not_limited(client):
+    assert "X-RateLimit-Limit" not in client.get("/health").headers
+    assert "X-RateLimit-Limit" not in client.get("/protected").headers
+
+
+def test_over_the_minute_limit_is_429_with_retry_after(client, user_tokens):
+    limit = plan_catalogue.get(SubscriptionPlan.FREE).requests_per_minute
+    for _ in range(limit):
+        assert client.get("/protected", headers=bearer(user_tokens)).status_code == 200
+
+    response = client.get("/protected", headers=bearer(user_tokens))
+    assert response.status_code == 429
+    assert response.headers["X-RateLimit-Remaining"] == "0"
+    assert 1 <= int(response.headers["Retry-After"]) <= 60
+
+
+def test_limits_are_per_user(client, user_tokens, register, login):
+    limit = plan_catalogue.get(SubscriptionPlan.FREE).requests_per_minute
+    for _ in range(limit + 1):
+        client.get("/protected", headers=bearer(user_tokens))
+
+    username, password, _ = register()
+    response = client.get("/protected", headers=bearer(login(username, password)))
+    assert response.status_code == 200
+
+
+def test_sliding_window_counts_cost_and_recovers():
+    backend = MemoryBackend()
+    assert backend.sliding_window("k", 5, 60, cost=3).remaining == 2
+    assert backend.sliding_window("k", 5, 60, cost=2).allowed
+    denied = backend.sliding_window("k", 5, 60)
+    assert not denied.allowed
+    assert 0 < denied.retry_after <= 60
+
+    # A window that has already passed no longer counts
+    assert backend.sliding_window("short", 1, 0.0).allowed
+    assert backend.sliding_window("short", 1, 0.0).allowed
+
+
+def test_token_bucket_refills_over_time():
+    backend = MemoryBackend()
+    assert backend.token_bucket("k", 2, 1.0).remaining == 1
+    assert backend.token_bucket("k", 2, 1.0).allowed
+    denied = backend.token_bucket("k", 2, 1.0)
+    assert not denied.allowed
+    assert 0 < denied.retry_after <= 1.0
+    assert denied.headers()["Retry-After"] == "1"
+
+
+def test_memory_backend_caps_its_keys():
+    backend = MemoryBackend(max_keys=10)
+    for n in range(25):
+        backend.sliding_window(f"k{n}", 1, 60)
+    assert len(backend._windows) <= 10
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("algorithm", [SLIDING_WINDOW, TOKEN_BUCKET])
+async def test_check_minute_limit_raises_429(algorithm):
+    limiter = RateLimiter(algorithm=algorithm)
+    for _ in range(3):
+        await limiter.check_minute_limit(1, 3)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await limiter.check_minute_limit(1, 3)
+    assert excinfo.value.status_code == 429
+    assert "Retry-After" in excinfo.value.headers
+    # Other users have their own allowance
+    assert (await limiter.check_minute_limit(2, 3)).allowed
@@ -0,0 +1,170 @@
+import time
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from app.core import quota, rate_limit
+from app.core.plans import PlanLimits
+from app.core.quota import QuotaCounter, RedisQuotaStore, month_key, month_start
+from app.core.rate_limit import SLIDING_WINDOW, TOKEN_BUCKET, RateLimiter, RedisBackend
+from app.db.models import RateLimit, SubscriptionPlan
+
+fakeredis = pytest.importorskip("fakeredis")
+# The limits are Lua scripts, which fakeredis runs with lupa
+pytest.importorskip("lupa")
+from fakeredis import aioredis  # noqa: E402
+
+
+class Clock:
+    """Stands in for both Redis TIME and the limiter's monotonic clock"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # fakeredis reads time.time for TIME and key expiry
+    monkeypatch.setattr(time, "time", lambda: clock.now)
+    fake_time = SimpleNamespace(monotonic=lambda: clock.now, perf_counter=time.perf_counter)
+    monkeypatch.setattr(rate_limit, "time", fake_time)
+    monkeypatch.setattr(quota, "time", fake_time)
+    return clock
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_client(server):
+    return aioredis.FakeRedis(server=server)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_refills_at_the_per_minute_rate(clock, redis_client):
+    backend = RedisBackend(redis_client)
+    for _ in range(60):
+        assert (await backend.minute_limit(TOKEN_BUCKET, "bucket", 60)).allowed
+
+    denied = await backend.minute_limit(TOKEN_BUCKET, "bucket", 60)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(1.0)
+
+    # 60 a minute is one token a second
+    clock.advance(2)
+    assert (await backend.minute_limit(TOKEN_BUCKET, "bucket", 60)).remaining == 1
+    assert (await backend.minute_limit(TOKEN_BUCKET, "bucket", 60)).allowed
+    assert not (await backend.minute_limit(TOKEN_BUCKET, "bucket", 60)).allowed
+
+
+@pytest.mark.asyncio
+async def test_sliding_window_admits_again_once_requests_leave_the_window(clock, redis_client):
+    backend = RedisBackend(redis_client)
+    assert (await backend.minute_limit(SLIDING_WINDOW, "window", 3, cost=2)).remaining == 1
+    clock.advance(30)
+    assert (await backend.minute_limit(SLIDING_WINDOW, "window", 3)).allowed
+
+    denied = await backend.minute_limit(SLIDING_WINDOW, "window", 3)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(30)
+
+    # The first two have expired, the third is still inside the window
+    clock.advance(31)
+    assert (await backend.minute_limit(SLIDING_WINDOW, "window", 3)).remaining == 1
+    assert (await backend.minute_limit(SLIDING_WINDOW, "window", 3)).allowed
+    assert not (await backend.minute_limit(SLIDING_WINDOW, "window", 3)).allowed
+
+
+@pytest.mark.asyncio
+async def test_quota_rejections_do_not_increment_the_counter(clock, redis_client):
+    store = RedisQuotaStore(redis_client)
+    month = month_key()
+    assert await store.consume(month, 7, 3, cost=2) == (True, 2)
+    assert await store.consume(month, 7, 3, cost=2) == (False, 2)
+    assert await store.consume(month, 7, 3) == (True, 3)
+    assert await store.consume(month, 7, 3) == (False, 3)
+    assert int(await redis_client.get(f"quota:{month}:7")) == 3
+
+
+@pytest.mark.asyncio
+async def test_refunds_give_back_quota_and_mark_the_counter_for_reconciling(clock, redis_client):
+    store = RedisQuotaStore(redis_client)
+    month = month_key()
+    await store.consume(month, 9, 10, cost=3)
+    await store.collect(month)
+
+    await store.refund(month, 9, 2)
+    assert await store.collect(month) == {9: 1}
+    # Never below zero, and an expired counter is not recreated
+    await store.refund(month, 9, 5)
+    await store.refund(month, 10, 1)
+    assert await store.collect(month) == {9: 0}
+    assert await redis_client.ttl(f"quota:{month}:9") > 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("algorithm", [SLIDING_WINDOW, TOKEN_BUCKET])
+async def test_one_script_checks_the_minute_limit_and_the_quota(clock, redis_client, monkeypatch, algorithm):
+    monkeypatch.setattr(quota, "quota_counter", QuotaCounter(store=RedisQuotaStore(redis_client)))
+    limiter = RateLimiter(backend=RedisBackend(redis_client), algorithm=algorithm)
+    principal = SimpleNamespace(id=8)
+    used = f"quota:{month_key()}:8"
+
+    # Requests over the minute limit are not charged to the quota
+    for _ in range(2):
+        await limiter.check_rate_limit(principal, PlanLimits(SubscriptionPlan.PRO, requests_per_minute=2, monthly_quota=3))
+    with pytest.raises(HTTPException) as excinfo:
+        await limiter.check_rate_limit(principal, PlanLimits(SubscriptionPlan.PRO, requests_per_minute=2, monthly_quota=3))
+    assert excinfo.value.status_code == 429
+    assert int(await redis_client.get(used)) == 2
+
+    # Nor are requests over the quota
+    clock.advance(60)
+    limits = PlanLimits(SubscriptionPlan.PRO, requests_per_minute=100, monthly_quota=3)
+    await limiter.check_rate_limit(principal, limits)
+    for _ in range(2):
+        with pytest.raises(HTTPException) as excinfo:
+            await limiter.check_rate_limit(principal, limits)
+        assert excinfo.value.status_code == 403
+    assert int(await redis_client.get(used)) == 3
+
+
+@pytest.mark.asyncio
+async def test_redis_failures_fall_back_to_memory_for_30_seconds(clock, server, redis_client):
+    limiter = RateLimiter(backend=RedisBackend(redis_client), algorithm=SLIDING_WINDOW)
+    assert (await limiter.hit(1, 5)).remaining == 4
+
+    server.connected = False
+    # Served from the in-memory fallback, which has not seen the first request
+    assert (await limiter.hit(1, 5)).remaining == 4
+    server.connected = True
+
+    clock.advance(29)
+    assert (await limiter.hit(1, 5)).remaining == 3
+    assert await redis_client.zcard("rate_limit:sliding_window:1") == 1
+
+    # Redis is tried again once the retry interval has passed
+    clock.advance(2)
+    assert (await limiter.hit(1, 5)).remaining == 3
+    assert await redis_client.zcard("rate_limit:sliding_window:1") == 2
+
+
+@pytest.mark.asyncio
+async def test_the_quota_fallback_starts_from_the_last_reconciled_usage(server, redis_client, db, make_user):
+    user = await make_user("failover")
+    month = month_key()
+    db.add(RateLimit(user_id=user.id, user_id_unique=user.id, requests_per_minute=60, monthly_quota=100,
+                     current_monthly_usage=98, last_monthly_reset=month_start(month)))
+    await db.commit()
+    counter = QuotaCounter(store=RedisQuotaStore(redis_client))
+    await redis_client.set(f"quota:{month}:{user.id}", 98)
+
+    server.connected = False
+    assert await counter.consume(user.id, 100) == (True, 99)
+    assert await counter.consume(user.id, 100) == (True, 100)
+    assert await counter.consume(user.id, 100) == (False, 100)
@@ -0,0 +1,80 @@
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app.db.models import RefreshToken, UsageLog
+from app.services.retention import UsageRetention
+from app.services.usage import UsageRecord, UsageService, write_usage
+
+
+def retention(retention_days=30, batch_size=2, refresh_token_retention=timedelta(days=1)):
+    return UsageRetention(retention_days=retention_days, action="drop", batch_size=batch_size, premake_months=1,
+                          interval=3600, refresh_token_retention=refresh_token_retention)
+
+
+async def log_timestamps(db, user_id: int):
+    return (await db.scalars(
+        select(UsageLog.timestamp).where(UsageLog.user_id == user_id).order_by(UsageLog.timestamp)
+    )).all()
+
+
+def test_unknown_actions_are_refused():
+    with pytest.raises(ValueError):
+        UsageRetention(30, "truncate", 100, 1, 3600, timedelta(days=1))
+
+
+def test_the_earliest_storable_timestamp_follows_the_retention_period():
+    now = datetime(2024, 6, 15)
+    assert retention().earliest_timestamp(now) == datetime(2024, 5, 16)
+    assert retention(retention_days=None).earliest_timestamp(now) is None
+
+
+@pytest.mark.asyncio
+async def test_logs_older_than_the_retention_period_are_deleted_in_batches(db, make_user):
+    user = await make_user("retention")
+    now = datetime.utcnow()
+    stamps = [now - timedelta(days=days) for days in (90, 60, 45, 31, 29, 1)]
+    await write_usage(db, [UsageRecord(user.id, "/protected", "GET", 200, stamp) for stamp in stamps])
+    await db.commit()
+
+    result = await retention(batch_size=2).run_once(now)
+    assert result["rows_deleted"] >= 4
+    assert [stamp.replace(tzinfo=None) for stamp in await log_timestamps(db, user.id)] == stamps[-2:]
+    # Lifetime totals come from the rollups, which are kept
+    summary = await UsageService(db).get_usage_summary(user.id)
+    assert summary["total_requests"] == 6
+
+
+@pytest.mark.asyncio
+async def test_without_a_retention_period_logs_are_kept(db, make_user):
+    user = await make_user("retention")
+    now = datetime.utcnow()
+    await write_usage(db, [UsageRecord(user.id, "/protected", "GET", 200, now - timedelta(days=3650))])
+    await db.commit()
+
+    result = await retention(retention_days=None).run_once(now)
+    assert result["rows_deleted"] == 0
+    assert len(await log_timestamps(db, user.id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_are_deleted_once_expired_and_revoked_long_enough(db, make_user):
+    user = await make_user("retention")
+    now = datetime.utcnow()
+    long_ago, recently = now - timedelta(days=2), now - timedelta(minutes=5)
+    tokens = {
+        "expired": (long_ago, None),
+        "expired_revoked_long_ago": (long_ago, long_ago),
+        "expired_revoked_recently": (long_ago, recently),
+        "expired_recently": (recently, None),
+        "live": (now + timedelta(days=1), None),
+    }
+    family = uuid.uuid4().hex
+    for name, (expires_at, revoked_at) in tokens.items():
+        db.add(RefreshToken(jti=f"{family}-{name}", family_id=family, user_id=user.id,
+                            expires_at=expires_at, revoked_at=revoked_at))
+    await db.commit()
+
+    await retention().run_once(now)
+    kept = (await db.scalars(select(RefreshToken.jti).where(RefreshToken.family_id == family))).all()
+    assert sorted(jti.split("-", 1)[1] for jti in kept) == ["expired_recently", "expired_revoked_recently", "live"]
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select
+from app.db.models import UsageLog, UsageRollup
+from app.db.session import AsyncSessionLocal
+from app.services.rollups import ALL_ENDPOINTS, ALL_TIME, aggregate, apply_rollups, rebuild_rollups
+from app.services.usage import UsageRecord, UsageService, write_usage
+
+
+def records(user_id: int, count: int, start: datetime, endpoint: str = "/protected"):
+    return [
+        UsageRecord(user_id, endpoint, "GET", 200, start + timedelta(minutes=n), 10.0 if n % 2 else None)
+        for n in range(count)
+    ]
+
+
+async def lifetime_total(db, user_id: int) -> int:
+    return await db.scalar(select(UsageRollup.request_count).where(
+        UsageRollup.user_id == user_id,
+        UsageRollup.endpoint == ALL_ENDPOINTS,
+        UsageRollup.period == "all",
+    )) or 0
+
+
+async def log_count(db, user_id: int) -> int:
+    return await db.scalar(select(func.count()).select_from(UsageLog).where(UsageLog.user_id == user_id))
+
+
+def test_aggregate_folds_records_into_every_period_and_the_total():
+    start = datetime(2024, 1, 15, 10, 30)
+    rows = aggregate(records(1, 3, start) + records(1, 2, start + timedelta(hours=1), "/users/me"))
+    by_key = {(row["endpoint"], row["period"], row["bucket_start"]): row for row in rows}
+
+    assert by_key[("/protected", "hour", datetime(2024, 1, 15, 10))]["request_count"] == 3
+    assert by_key[("/users/me", "hour", datetime(2024, 1, 15, 11))]["request_count"] == 2
+    assert by_key[(ALL_ENDPOINTS, "day", datetime(2024, 1, 15))]["request_count"] == 5
+    assert by_key[(ALL_ENDPOINTS, "month", datetime(2024, 1, 1))]["request_count"] == 5
+    total = by_key[(ALL_ENDPOINTS, "all", ALL_TIME)]
+    # Only records with a response time count towards the average
+    assert total["timed_count"] == 2
+    assert total["response_time_sum"] == 20.0
+    assert total["last_request_at"] == start + timedelta(hours=1, minutes=1)
+
+
+@pytest.mark.asyncio
+async def test_write_usage_keeps_rollups_in_step_with_logs(db, make_user):
+    user_id = (await make_user("rollup")).id
+    now = datetime.utcnow().replace(microsecond=0)
+    await write_usage(db, records(user_id, 4, now - timedelta(minutes=10)))
+    await db.commit()
+    await write_usage(db, records(user_id, 3, now - timedelta(minutes=5), "/users/me"))
+    await db.commit()
+
+    summary = await UsageService(db).get_usage_summary(user_id)
+    assert summary["total_requests"] == 7 == await log_count(db, user_id)
+    assert summary["most_used_endpoint"] == "/protected"
+    assert summary["average_response_time"] == 10.0
+
+
+@pytest.mark.asyncio
+async def test_rebuild_recomputes_rollups_from_logs(db, make_user):
+    user_id = (await make_user("rollup")).id
+    other_id = (await make_user("rollup")).id
+    now = datetime.utcnow().replace(microsecond=0)
+    await write_usage(db, records(user_id, 5, now - timedelta(hours=1)))
+    await write_usage(db, records(other_id, 2, now - timedelta(hours=1)))
+    # Counted twice, as a botched backfill would
+    await apply_rollups(db, records(user_id, 5, now - timedelta(hours=1)))
+    await db.commit()
+    assert await lifetime_total(db, user_id) == 10
+
+    assert await rebuild_rollups(db, chunk_size=2, user_id=user_id) == 5
+    assert await lifetime_total(db, user_id) == 5
+    assert await lifetime_total(db, other_id) == 2
+
+
+@pytest.mark.asyncio
+async def test_rebuild_during_writes_counts_every_log_once(db, make_user):
+    user_id = (await make_user("rollup")).id
+    now = datetime.utcnow().replace(microsecond=0)
+    await write_usage(db, records(user_id, 50, now - timedelta(hours=2)))
+    await db.commit()
+
+    async def writer(offset: int):
+        for batch in range(5):
+            async with AsyncSessionLocal() as session:
+                await write_usage(session, records(user_id, 20, now - timedelta(minutes=offset + batch)))
+                await session.commit()
+
+    async def rebuild():
+        async with AsyncSessionLocal() as session:
+            await rebuild_rollups(session, chunk_size=7)
+
+    await asyncio.gather(writer(0), rebuild(), writer(30), rebuild())
+
+    assert await log_count(db, user_id) == 250
+    assert await lifetime_total(db, user_id) == 250
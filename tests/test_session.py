@@ -0,0 +1,52 @@
+import asyncio
+import httpx
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import get_async_database_url, get_db
+from app.main import app
+from helpers import bearer
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("sqlite:///./saas_auth.db", "sqlite+aiosqlite:///./saas_auth.db"),
+    ("postgresql://user:secret@db/saas", "postgresql+asyncpg://user:secret@db/saas"),
+])
+def test_the_async_url_uses_the_async_driver_for_the_backend(monkeypatch, url, expected):
+    monkeypatch.setattr(settings, "async_database_url", None)
+    monkeypatch.setattr(settings, "database_url", url)
+    assert get_async_database_url() == expected
+
+
+def test_an_explicit_async_url_wins_and_unknown_backends_are_refused(monkeypatch):
+    monkeypatch.setattr(settings, "async_database_url", "postgresql+psycopg://db/saas")
+    assert get_async_database_url() == "postgresql+psycopg://db/saas"
+
+    monkeypatch.setattr(settings, "async_database_url", None)
+    monkeypatch.setattr(settings, "database_url", "mysql://db/saas")
+    with pytest.raises(ValueError, match="set ASYNC_DATABASE_URL"):
+        get_async_database_url()
+
+
+@pytest.mark.asyncio
+async def test_get_db_yields_an_async_session_and_closes_it(db):
+    dependency = get_db()
+    session = await dependency.__anext__()
+    assert isinstance(session, AsyncSession)
+    assert await session.scalar(text("SELECT 1")) == 1
+    with pytest.raises(StopAsyncIteration):
+        await dependency.__anext__()
+    assert not session.in_transaction()
+
+
+def test_concurrent_requests_each_get_their_own_session(client, user_tokens):
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            responses = await asyncio.gather(*(
+                http.get("/users/profile", headers=bearer(user_tokens)) for _ in range(10)
+            ))
+        return [response.status_code for response in responses]
+
+    assert client.portal.call(burst) == [200] * 10
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.instrumentation import (
+    DB_TIME_HEADER, QUERY_COUNT_HEADER, REPEATED_HEADER, QueryMetrics, RequestProfile, SqlProfiler, sql_profiler,
+)
+from app.db.models import User
+
+
+def profile_of(*statements) -> RequestProfile:
+    profile = RequestProfile()
+    for statement in statements:
+        profile.record(statement, 1.0)
+    return profile
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ('SELECT users.id FROM "users" WHERE users.id = ?', ("SELECT", "users")),
+    ("INSERT INTO usage_logs (user_id) VALUES (?)", ("INSERT", "usage_logs")),
+    ("update Subscriptions SET status=?", ("UPDATE", "subscriptions")),
+    ("DELETE FROM refresh_tokens", ("DELETE", "refresh_tokens")),
+    ("BEGIN", ("BEGIN", "-")),
+])
+def test_statements_are_classified_by_operation_and_table(statement, expected):
+    assert QueryMetrics().classify(statement) == expected
+
+
+def test_statements_repeated_past_the_threshold_are_flagged():
+    profile = profile_of(*["SELECT plan"] * 5, *["SELECT user"] * 2, "SELECT log")
+    assert profile.query_count == 8
+    assert profile.repeated(5) == [{"statement": "SELECT plan", "count": 5, "db_time_ms": 5.0}]
+    assert [entry["statement"] for entry in profile.repeated(2)] == ["SELECT plan", "SELECT user"]
+
+
+def test_the_report_keeps_the_slowest_requests(monkeypatch):
+    monkeypatch.setattr(settings, "sql_profiling_enabled", True)
+    profiler = SqlProfiler(report_size=2, repeat_threshold=3)
+    for route, elapsed_ms in [("/a", 5), ("/b", 50), ("/c", 1), ("/d", 20)]:
+        profile, token = profiler.start()
+        statements = ["SELECT x"] * 3 if route == "/d" else ["SELECT x"]
+        for statement in statements:
+            profile.record(statement, 0.5)
+        headers = profiler.finish(profile, token, "GET", route, 200, elapsed_ms)
+
+    assert headers == {QUERY_COUNT_HEADER: "3", DB_TIME_HEADER: "1.500", REPEATED_HEADER: "1"}
+    report = profiler.report()
+    assert [entry["route"] for entry in report["slowest"]] == ["/b", "/d"]
+    assert (report["profiled_requests"], report["requests_with_repeated_statements"]) == (4, 1)
+
+    profiler.reset()
+    assert profiler.report()["slowest"] == []
+
+
+@pytest.mark.asyncio
+async def test_queries_run_in_a_loop_are_reported(db, make_user):
+    users = [await make_user("profiled") for _ in range(5)]
+    profiler = SqlProfiler(repeat_threshold=5)
+    profile, token = profiler.start()
+    for user in users:
+        await db.scalar(select(User.email).where(User.id == user.id))
+    profiler.finish(profile, token, "GET", "/loop", 200, 1.0)
+
+    (repeated,) = profiler.report()["slowest"][0]["repeated_statements"]
+    assert repeated["count"] == 5
+    assert repeated["statement"].startswith("SELECT users.email")
+
+
+def test_profiled_requests_get_debug_headers_and_reach_the_report(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(settings, "sql_profiling_enabled", True)
+    sql_profiler.reset()
+    response = client.get("/admin/users", headers=admin_headers)
+    assert int(response.headers[QUERY_COUNT_HEADER]) >= 1
+    assert REPEATED_HEADER in response.headers
+
+    report = client.get("/admin/debug/sql", params={"reset": True}, headers=admin_headers).json()
+    assert "/admin/users" in [entry["route"] for entry in report["slowest"]]
+    assert client.get("/admin/debug/sql", headers=admin_headers).json()["profiled_requests"] <= 1
+
+    monkeypatch.setattr(settings, "sql_profiling_enabled", False)
+    assert QUERY_COUNT_HEADER not in client.get("/admin/users", headers=admin_headers).headers
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.core.security import password_hasher
+from app.db.models import Base
+from app.main import app
+from conftest import TEST_DIR
+
+IMPORT_CHECK = """
+import json, sys
+import app.main
+print(json.dumps({"stripe": "stripe" in sys.modules, "redis_client": "redis.client" in sys.modules}))
+"""
+
+
+def test_importing_the_app_leaves_stripe_and_redis_unimported():
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'imports.db')}"}
+    output = subprocess.run([sys.executable, "-c", IMPORT_CHECK], env=env, capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert json.loads(output.stdout.splitlines()[-1]) == {"stripe": False, "redis_client": False}
+
+
+def test_lazy_modules_run_on_first_attribute_access(tmp_path, monkeypatch):
+    marker = tmp_path / "imported"
+    (tmp_path / "lazy_probe.py").write_text(f"open({str(marker)!r}, 'w').close()\nVALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "lazy_probe", raising=False)
+
+    probe = lazy_import("lazy_probe")
+    try:
+        assert not marker.exists()
+        assert probe.VALUE == 42
+        assert marker.exists()
+        assert lazy_import("lazy_probe") is probe
+    finally:
+        sys.modules.pop("lazy_probe", None)
+
+
+def test_startup_can_leave_ddl_and_seeding_to_migrations(monkeypatch):
+    # Tables exist already, as they would after `alembic upgrade head`
+    with TestClient(app):
+        pass
+
+    def refuse(*args, **kwargs):
+        raise AssertionError("not expected during startup")
+
+    monkeypatch.setattr(settings, "create_tables_on_startup", False)
+    monkeypatch.setattr(settings, "seed_admin_on_startup", False)
+    monkeypatch.setattr(Base.metadata, "create_all", refuse)
+    monkeypatch.setattr(password_hasher, "hash", refuse)
+    with TestClient(app) as client:
+        assert client.get("/health").json() == {"status": "healthy"}
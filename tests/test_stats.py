@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from app.core import cache
+from app.core.cache import StaleWhileRevalidate
+from app.services.stats import load_system_stats
+from app.services.usage import UsageRecord, write_usage
+from helpers import bearer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def counting_loader():
+    loads = []
+
+    async def load():
+        loads.append(None)
+        await asyncio.sleep(0)
+        return len(loads)
+    return load, loads
+
+
+@pytest.mark.asyncio
+async def test_values_are_fresh_then_stale_then_reloaded(clock):
+    load, loads = counting_loader()
+    stats = StaleWhileRevalidate(load, ttl=5, max_stale=30)
+    assert await stats.get() == 1
+
+    clock.now += 4
+    assert await stats.get() == 1
+    assert stats.hits == 1
+
+    # Stale: the old value is returned at once and one refresh runs behind it
+    clock.now += 2
+    assert await asyncio.gather(stats.get(), stats.get()) == [1, 1]
+    await asyncio.sleep(0.01)
+    assert len(loads) == 2
+    assert await stats.get() == 2
+
+    # Too old to serve: callers wait for the load
+    clock.now += 36
+    assert await stats.get() == 3
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_load(clock):
+    load, loads = counting_loader()
+    stats = StaleWhileRevalidate(load, ttl=5, max_stale=30)
+    assert await asyncio.gather(*(stats.get() for _ in range(10))) == [1] * 10
+    assert len(loads) == 1
+
+    stats.invalidate()
+    assert await stats.get() == 2
+
+
+@pytest.mark.asyncio
+async def test_stats_count_users_and_todays_and_this_months_requests(db, make_user):
+    before = await load_system_stats()
+    user = await make_user("stats")
+    await make_user("stats", is_active=False)
+    now = datetime.utcnow()
+    await write_usage(db, [UsageRecord(user.id, "/protected", "GET", 200, stamp)
+                           for stamp in [now] * 3 + [now - timedelta(days=40)]])
+    await db.commit()
+
+    after = await load_system_stats()
+    changes = {key: after[key] - before[key] for key in before}
+    assert changes == {
+        "total_users": 2,
+        "active_users": 1,
+        "total_requests_today": 3,
+        "total_requests_this_month": 3,
+        "free_plan_users": 2,
+        "pro_plan_users": 0,
+    }
+
+
+def test_the_endpoint_is_admin_only_and_reports_the_age(client, admin_headers, user_tokens):
+    response = client.get("/admin/stats", headers=admin_headers)
+    assert response.status_code == 200
+    assert int(response.headers["Age"]) >= 0
+    assert response.json()["total_users"] >= 1
+    assert client.get("/admin/stats", headers=bearer(user_tokens)).status_code == 403
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app.db.models import Subscription, SubscriptionPlan, User
+from app.db.session import AsyncSessionLocal
+from app.services.subscriptions import SubscriptionSweeper
+from helpers import bearer
+
+
+def grant(client, admin_headers, user_id, current_period_end=None):
+    params = {"current_period_end": current_period_end.isoformat()} if current_period_end else {}
+    return client.post(f"/admin/users/{user_id}/subscription", params=params, headers=admin_headers)
+
+
+def sweep(client, now):
+    sweeper = SubscriptionSweeper(batch_size=2, grace_seconds=3600, interval=300)
+    return client.portal.call(sweeper.run_once, now)
+
+
+def subscription_status(client, user_id):
+    async def load():
+        async with AsyncSessionLocal() as db:
+            return (await db.scalars(select(Subscription.status).where(Subscription.user_id == user_id))).one()
+    return client.portal.call(load)
+
+
+def test_an_invoiced_grant_expires_after_its_period_end_and_grace(client, admin_headers, register, login):
+    username, password, user = register()
+    tokens = login(username, password)
+    end = datetime.utcnow() + timedelta(days=1)
+    assert grant(client, admin_headers, user["id"], end).status_code == 200
+    assert client.get("/auth/me", headers=bearer(tokens)).json()["subscription_plan"] == "PRO"
+
+    # Still inside the grace period
+    sweep(client, end + timedelta(minutes=59))
+    assert subscription_status(client, user["id"]) == "active"
+
+    result = sweep(client, end + timedelta(hours=1, minutes=1))
+    assert result["expired"] >= 1
+    assert subscription_status(client, user["id"]) == "expired"
+    # The cached principal was invalidated with the downgrade
+    assert client.get("/auth/me", headers=bearer(tokens)).json()["subscription_plan"] == "FREE"
+
+
+def test_a_grant_without_a_period_end_is_never_expired(client, admin_headers, register):
+    _, _, user = register()
+    assert grant(client, admin_headers, user["id"]).status_code == 200
+
+    sweep(client, datetime.utcnow() + timedelta(days=400))
+    assert subscription_status(client, user["id"]) == "active"
+
+
+def test_grants_are_validated(client, admin_headers, register):
+    _, _, user = register()
+    response = grant(client, admin_headers, user["id"], datetime.utcnow() - timedelta(minutes=1))
+    assert response.status_code == 422
+    assert response.json()["detail"] == "current_period_end must be in the future"
+
+    assert grant(client, admin_headers, user["id"]).status_code == 200
+    assert grant(client, admin_headers, user["id"]).status_code == 409
+    assert grant(client, admin_headers, 10 ** 9).status_code == 404
+
+
+async def subscribe(db, user, status, current_period_end):
+    subscription = Subscription(user_id=user.id, plan=SubscriptionPlan.PRO, status=status,
+                                current_period_end=current_period_end)
+    db.add(subscription)
+    await db.commit()
+    return subscription
+
+
+async def statuses(db, *subscriptions):
+    ids = [subscription.id for subscription in subscriptions]
+    rows = dict((await db.execute(select(Subscription.id, Subscription.status).where(Subscription.id.in_(ids)))).all())
+    return [rows[subscription_id] for subscription_id in ids]
+
+
+async def plan_of(db, user):
+    return await db.scalar(select(User.subscription_plan).where(User.id == user.id))
+
+
+@pytest.mark.asyncio
+async def test_every_due_subscription_is_expired_in_batches(db, make_user):
+    now = datetime.utcnow()
+    users = [await make_user("sweep", subscription_plan=SubscriptionPlan.PRO) for _ in range(5)]
+    due = [await subscribe(db, user, "active", now - timedelta(hours=2)) for user in users]
+
+    result = await SubscriptionSweeper(batch_size=2, grace_seconds=3600, interval=300).run_once(now)
+    assert result["expired"] >= 5
+    assert await statuses(db, *due) == ["expired"] * 5
+    assert [await plan_of(db, user) for user in users] == [SubscriptionPlan.FREE] * 5
+
+
+@pytest.mark.asyncio
+async def test_only_live_subscriptions_are_expired(db, make_user):
+    now = datetime.utcnow()
+    user = await make_user("sweep", subscription_plan=SubscriptionPlan.PRO)
+    past_due = await subscribe(db, user, "past_due", now - timedelta(days=3))
+    canceled = await subscribe(db, user, "canceled", now - timedelta(days=3))
+
+    await SubscriptionSweeper(batch_size=10, grace_seconds=3600, interval=300).run_once(now)
+    assert await statuses(db, past_due, canceled) == ["expired", "canceled"]
+
+
+@pytest.mark.asyncio
+async def test_users_with_another_live_subscription_keep_their_plan(db, make_user):
+    now = datetime.utcnow()
+    user = await make_user("sweep", subscription_plan=SubscriptionPlan.PRO)
+    lapsed = await subscribe(db, user, "active", now - timedelta(days=30))
+    renewed = await subscribe(db, user, "active", now + timedelta(days=30))
+
+    result = await SubscriptionSweeper(batch_size=10, grace_seconds=3600, interval=300).run_once(now)
+    assert await statuses(db, lapsed, renewed) == ["expired", "active"]
+    assert await plan_of(db, user) == SubscriptionPlan.PRO
+    assert result["downgraded"] < result["expired"]
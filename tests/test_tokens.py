@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import select
+from app.db.models import RefreshToken
+from app.services.retention import UsageRetention
+from helpers import bearer
+
+
+def refresh(client, refresh_token):
+    return client.post("/auth/refresh", params={"refresh_token": refresh_token})
+
+
+def test_refresh_rotates_the_pair(client, user_tokens):
+    response = refresh(client, user_tokens["refresh_token"])
+
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != user_tokens["refresh_token"]
+    assert client.get("/auth/me", headers=bearer(rotated["access_token"])).status_code == 200
+    # The successor can be refreshed in turn
+    assert refresh(client, rotated["refresh_token"]).status_code == 200
+
+
+def test_reusing_a_spent_refresh_token_revokes_the_family(client, user_tokens):
+    rotated = refresh(client, user_tokens["refresh_token"]).json()
+
+    reuse = refresh(client, user_tokens["refresh_token"])
+    assert reuse.status_code == 401
+    assert reuse.json()["detail"] == "Refresh token reuse detected"
+
+    # Everything descended from that login is cut off, access tokens included
+    assert refresh(client, rotated["refresh_token"]).status_code == 401
+    for access_token in (user_tokens["access_token"], rotated["access_token"]):
+        response = client.get("/auth/me", headers=bearer(access_token))
+        assert response.status_code == 401
+        assert response.json()["detail"] == "Token has been revoked"
+
+
+def test_reuse_leaves_other_sessions_alone(client, register, login):
+    username, password, _ = register()
+    stolen = login(username, password)
+    other = login(username, password)
+
+    refresh(client, stolen["refresh_token"])
+    assert refresh(client, stolen["refresh_token"]).status_code == 401
+
+    assert client.get("/auth/me", headers=bearer(other["access_token"])).status_code == 200
+    assert refresh(client, other["refresh_token"]).status_code == 200
+
+
+def test_access_tokens_cannot_be_used_to_refresh(client, user_tokens):
+    assert refresh(client, user_tokens["access_token"]).status_code == 401
+    assert refresh(client, "not-a-token").status_code == 401
+
+
+def test_logout_revokes_only_this_session(client, register, login):
+    username, password, _ = register()
+    first = login(username, password)
+    second = login(username, password)
+
+    response = client.post("/auth/logout", headers=bearer(first["access_token"]))
+    assert response.json() == {"message": "Logged out", "revoked_sessions": 1}
+
+    assert client.get("/auth/me", headers=bearer(first["access_token"])).status_code == 401
+    assert refresh(client, first["refresh_token"]).status_code == 401
+    assert client.get("/auth/me", headers=bearer(second["access_token"])).status_code == 200
+
+
+def test_logout_all_revokes_every_session(client, register, login):
+    username, password, _ = register()
+    sessions = [login(username, password) for _ in range(3)]
+
+    response = client.post("/auth/logout?all=true", headers=bearer(sessions[0]["access_token"]))
+    assert response.json()["revoked_sessions"] == 3
+
+    for tokens in sessions:
+        assert client.get("/auth/me", headers=bearer(tokens["access_token"])).status_code == 401
+        assert refresh(client, tokens["refresh_token"]).status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_expired_refresh_tokens_are_deleted_after_the_retention(db, make_user):
+    user = await make_user("tokens")
+    name = user.username
+    now = datetime.utcnow()
+    tokens = {
+        "long expired": (now - timedelta(days=2), None),
+        "recently expired": (now - timedelta(hours=1), None),
+        "live": (now + timedelta(days=1), None),
+        # Kept while its revocation may still be needed to refuse access tokens
+        "recently revoked": (now - timedelta(days=2), now - timedelta(minutes=1)),
+    }
+    for jti, (expires_at, revoked_at) in tokens.items():
+        db.add(RefreshToken(jti=f"{name}:{jti}", family_id=name, user_id=user.id,
+                            expires_at=expires_at, revoked_at=revoked_at))
+    await db.commit()
+
+    retention = UsageRetention(
+        retention_days=None, action="drop", batch_size=2, premake_months=0, interval=3600,
+        refresh_token_retention=timedelta(hours=24),
+    )
+    result = await retention.run_once(now)
+
+    assert result["refresh_tokens_deleted"] >= 1
+    remaining = set((await db.scalars(select(RefreshToken.jti).where(RefreshToken.family_id == name))).all())
+    assert remaining == {f"{name}:recently expired", f"{name}:live", f"{name}:recently revoked"}
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime
+import pytest
+from sqlalchemy import func, select
+from app.db.models import UsageLog
+from app.services.usage import UsageBuffer, UsageRecord
+
+
+def record(user_id: int) -> UsageRecord:
+    return UsageRecord(user_id, "/protected", "GET", 200, datetime.utcnow(), 5.0)
+
+
+async def log_count(db, user_id: int) -> int:
+    return await db.scalar(select(func.count()).select_from(UsageLog).where(UsageLog.user_id == user_id))
+
+
+def test_a_full_queue_drops_records_instead_of_blocking():
+    buffer = UsageBuffer(max_size=3, batch_size=10, flush_interval=60)
+    accepted = [buffer.push(record(1)) for _ in range(5)]
+
+    assert accepted == [True, True, True, False, False]
+    assert buffer.stats()["pending"] == 3
+    assert buffer.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_everything_queued_in_batches(db, make_user):
+    user = await make_user("buffered")
+    buffer = UsageBuffer(max_size=100, batch_size=2, flush_interval=60)
+    for _ in range(5):
+        buffer.push(record(user.id))
+
+    assert await buffer.flush() == 5
+    assert await log_count(db, user.id) == 5
+    assert buffer.stats()["pending"] == 0
+    assert buffer.flushed == 5
+
+
+@pytest.mark.asyncio
+async def test_a_failed_batch_is_kept_for_the_next_flush(db, make_user, monkeypatch):
+    user = await make_user("buffered")
+    buffer = UsageBuffer(max_size=100, batch_size=10, flush_interval=60)
+    for _ in range(3):
+        buffer.push(record(user.id))
+    write_batch = buffer._write_batch
+
+    async def fail_once(batch):
+        monkeypatch.setattr(buffer, "_write_batch", write_batch)
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(buffer, "_write_batch", fail_once)
+    assert await buffer.flush() == 0
+    assert buffer.failed_batches == 1
+    assert buffer.stats()["pending"] == 3
+
+    assert await buffer.flush() == 3
+    assert await log_count(db, user.id) == 3
+
+
+@pytest.mark.asyncio
+async def test_the_flusher_wakes_for_a_full_batch_and_drains_on_stop(db, make_user):
+    user = await make_user("buffered")
+    buffer = UsageBuffer(max_size=100, batch_size=2, flush_interval=60)
+    buffer.start()
+    try:
+        buffer.push(record(user.id))
+        buffer.push(record(user.id))
+        # Well before the flush interval
+        for _ in range(100):
+            if buffer.flushed == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert buffer.flushed == 2
+
+        buffer.push(record(user.id))
+    finally:
+        await buffer.stop()
+    assert await log_count(db, user.id) == 3